@@ -0,0 +1,375 @@
+import random
+
+_MAX_LEVEL = 32  # 跳表的最大层数，每层的节点数约为下一层的四分之一，足以容纳 4^32 个区段
+
+
+class _Node:
+    __slots__ = ('key', 'next')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level  # 每层的后继节点
+
+
+def _random_level():
+    level = 1
+    while level < _MAX_LEVEL and random.random() < 0.25:
+        level += 1
+    return level
+
+
+class _SizeIndex:
+    """按 (长度, 起始块) 排序的空闲区段跳表：插入、删除和查找不小于给定键的最小区段的期望耗时均为 O(log n)
+
+    有序列表的插入和删除需要移动其后的全部元素，碎片化的卷上有大量空闲区段时耗时随区段数线性增长。
+    """
+
+    __slots__ = ('_head', '_tail', '_level', '_count')
+
+    def __init__(self, sorted_keys=()):
+        """sorted_keys 为已按顺序排列的初始键，逐个接在末尾，建立耗时为 O(n)"""
+        self._head = _Node(None, _MAX_LEVEL)
+        self._tail = None  # 最后一个节点，即最长的区段
+        self._level = 1
+        self._count = 0
+        last = [self._head] * _MAX_LEVEL  # 每层当前的最后一个节点
+        for key in sorted_keys:
+            node = _Node(key, _random_level())
+            for i in range(len(node.next)):
+                last[i].next[i] = node
+                last[i] = node
+            self._level = max(self._level, len(node.next))
+            self._tail = node
+            self._count += 1
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        node = self._head.next[0]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+    def _predecessors(self, key):
+        """每层中最后一个小于 key 的节点"""
+        update = [self._head] * _MAX_LEVEL
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            following = node.next[i]
+            while following is not None and following.key < key:
+                node = following
+                following = node.next[i]
+            update[i] = node
+        return update
+
+    def add(self, key):
+        update = self._predecessors(key)
+        node = _Node(key, _random_level())
+        for i in range(len(node.next)):
+            node.next[i] = update[i].next[i]
+            update[i].next[i] = node
+        self._level = max(self._level, len(node.next))
+        if node.next[0] is None:
+            self._tail = node
+        self._count += 1
+
+    def remove(self, key):
+        update = self._predecessors(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for i in range(len(node.next)):
+            update[i].next[i] = node.next[i]
+        if node is self._tail:
+            self._tail = update[0] if update[0] is not self._head else None
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+        self._count -= 1
+
+    def ceiling(self, key):
+        """不小于 key 的最小键，不存在时返回 None"""
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            following = node.next[i]
+            while following is not None and following.key < key:
+                node = following
+                following = node.next[i]
+        node = node.next[0]
+        return None if node is None else node.key
+
+    def last(self):
+        """最大的键，为空时返回 None"""
+        return None if self._tail is None else self._tail.key
+
+
+class ExtentAllocator:
+    """空闲空间管理：位图记录每个块的占用情况，空闲区段按 (长度, 起始块) 保存在跳表中以便最佳适配
+
+    被多个文件共享的块在 refcounts 中记录引用计数，未记录的已占用块引用计数为1。
+    事务期间记录分配和共享以便回滚，释放操作推迟到提交时统一进行，因此被释放的块在事务结束前不会被重新分配。
+    """
+
+    def __init__(self, total_blocks):
+        self.total_blocks = total_blocks
+        self.reset()
+
+    def reset(self):
+        """将所有块置为空闲"""
+        self.bitmap = bytearray((self.total_blocks + 7) // 8)  # 1 表示已占用
+        self.free_count = 0
+        self._by_start = {}  # 起始块 -> 长度
+        self._by_end = {}  # 结束块(不含) -> 起始块
+        self._sizes = _SizeIndex()  # 有序的 (长度, 起始块)
+        self.refcounts = {}  # 块号 -> 引用计数（仅记录大于1的块）
+        self._txn = None
+        if self.total_blocks:
+            self._insert_extent(0, self.total_blocks)
+
+    @classmethod
+    def from_references(cls, total_blocks, references):
+        """由每个块被文件引用的次数（块号 -> 次数）重建分配器：未被引用的块为空闲，被引用多次的块记录引用计数"""
+        allocator = cls(total_blocks)
+        allocator._rebuild([block_index for block_index in range(total_blocks) if block_index not in references])
+        allocator.refcounts = {block_index: count for block_index, count in references.items() if count > 1}
+        return allocator
+
+    @classmethod
+    def from_state(cls, total_blocks, bitmap, free_extents, refcounts):
+        """由保存的位图、空闲区段和引用计数直接恢复分配器"""
+        allocator = cls.__new__(cls)
+        allocator.total_blocks = total_blocks
+        allocator.bitmap = bitmap
+        allocator.free_count = 0
+        allocator._by_start = {}
+        allocator._by_end = {}
+        allocator.refcounts = refcounts
+        allocator._txn = None
+        for start, length in free_extents:
+            allocator._by_start[start] = length
+            allocator._by_end[start + length] = start
+            allocator.free_count += length
+        allocator._sizes = _SizeIndex(sorted((length, start) for start, length in allocator._by_start.items()))
+        return allocator
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_sizes']  # 跳表由空闲区段重建，不逐个节点保存
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._sizes = _SizeIndex(sorted((length, start) for start, length in self._by_start.items()))
+
+    def _rebuild(self, free_sorted):
+        self.bitmap = bytearray(b'\xff' * ((self.total_blocks + 7) // 8))
+        self.free_count = 0
+        self._by_start = {}
+        self._by_end = {}
+        self._sizes = _SizeIndex()
+        self.refcounts = {}
+        self._txn = None
+        for start, length in _runs(free_sorted):
+            self._set_range(start, length, False)
+            self._insert_extent(start, length)
+
+    def is_free(self, block_index):
+        return not self.bitmap[block_index >> 3] & (1 << (block_index & 7))
+
+    def _set_range(self, start, length, used):
+        """将 [start, start+length) 的位图置为占用/空闲"""
+        end = start + length
+        bitmap = self.bitmap
+        # 前后不足一个字节的部分逐位处理，中间整字节批量处理
+        while start < end and start & 7:
+            if used:
+                bitmap[start >> 3] |= 1 << (start & 7)
+            else:
+                bitmap[start >> 3] &= ~(1 << (start & 7)) & 0xff
+            start += 1
+        full_end = end & ~7
+        if start < full_end:
+            bitmap[start >> 3:full_end >> 3] = (b'\xff' if used else b'\x00') * ((full_end - start) >> 3)
+            start = full_end
+        while start < end:
+            if used:
+                bitmap[start >> 3] |= 1 << (start & 7)
+            else:
+                bitmap[start >> 3] &= ~(1 << (start & 7)) & 0xff
+            start += 1
+
+    def _insert_extent(self, start, length):
+        self._by_start[start] = length
+        self._by_end[start + length] = start
+        self._sizes.add((length, start))
+        self.free_count += length
+
+    def _remove_extent(self, start):
+        length = self._by_start.pop(start)
+        del self._by_end[start + length]
+        self._sizes.remove((length, start))
+        self.free_count -= length
+        return length
+
+    def _take(self, start, count):
+        """从以 start 开头的空闲区段头部取出 count 个块"""
+        length = self._remove_extent(start)
+        if length > count:
+            self._insert_extent(start + count, length - count)
+        self._set_range(start, count, True)
+        return start, count
+
+    def allocate_extents(self, num_blocks, hint=None):
+        """分配 num_blocks 个块，返回 [(起始块, 长度), ...]；空间不足时返回 None
+
+        优先从 hint 处接续分配（用于文件尾部追加），其次选择能容纳全部请求的最小区段，
+        都不满足时从最大的区段开始拼接。
+        """
+        if num_blocks > self.free_count:
+            return None
+        extents = []
+        remaining = num_blocks
+        if remaining and hint is not None and hint in self._by_start:
+            count = min(remaining, self._by_start[hint])
+            extents.append(self._take(hint, count))
+            remaining -= count
+        while remaining:
+            fit = self._sizes.ceiling((remaining, -1))
+            if fit is not None:
+                extents.append(self._take(fit[1], remaining))
+                break
+            length, start = self._sizes.last()
+            extents.append(self._take(start, length))
+            remaining -= length
+        if self._txn is not None:
+            self._txn[0].extend(extents)
+        return extents
+
+    def allocate(self, num_blocks, hint=None):
+        """分配 num_blocks 个块，返回块号列表；空间不足时返回 None"""
+        extents = self.allocate_extents(num_blocks, hint)
+        if extents is None:
+            return None
+        blocks = []
+        for start, length in extents:
+            blocks.extend(range(start, start + length))
+        return blocks
+
+    def free(self, blocks):
+        """批量释放块，相邻的空闲区段会被合并；已空闲的块会被忽略"""
+        blocks = sorted(b for b in set(blocks) if not self.is_free(b))
+        for start, length in _runs(blocks):
+            self._set_range(start, length, False)
+            left = self._by_end.get(start)
+            if left is not None:
+                length += self._remove_extent(left)
+                start = left
+            if start + length in self._by_start:
+                length += self._remove_extent(start + length)
+            self._insert_extent(start, length)
+
+    def refcount(self, block_index):
+        if self.is_free(block_index):
+            return 0
+        return self.refcounts.get(block_index, 1)
+
+    def share(self, blocks):
+        """为每个块增加一次引用"""
+        refcounts = self.refcounts
+        if self._txn is not None:
+            blocks = list(blocks)
+            self._txn[1].extend(blocks)
+        for block_index in blocks:
+            refcounts[block_index] = refcounts.get(block_index, 1) + 1
+
+    def release(self, blocks):
+        """为每个块减少一次引用，引用计数归零的块被批量释放"""
+        if self._txn is not None:
+            self._txn[2].extend(blocks)
+            return
+        refcounts = self.refcounts
+        freed = []
+        for block_index in blocks:
+            count = refcounts.get(block_index)
+            if count is None:
+                freed.append(block_index)
+            elif count == 2:
+                del refcounts[block_index]
+            else:
+                refcounts[block_index] = count - 1
+        self.free(freed)
+
+    def begin(self):
+        """开始事务"""
+        self._txn = ([], [], [])  # 分配的区段, 增加过引用的块, 推迟的释放
+
+    def commit(self):
+        """提交事务：执行推迟的释放"""
+        _, _, released = self._txn
+        self._txn = None
+        self.release(released)
+
+    def rollback(self):
+        """回滚事务：撤销引用计数的增加并释放事务中分配的块，推迟的释放被丢弃"""
+        allocated, shared, _ = self._txn
+        self._txn = None
+        refcounts = self.refcounts
+        for block_index in shared:
+            count = refcounts[block_index]
+            if count == 2:
+                del refcounts[block_index]
+            else:
+                refcounts[block_index] = count - 1
+        blocks = []
+        for start, length in allocated:
+            blocks.extend(range(start, start + length))
+        self.free(blocks)
+
+    def free_extents(self):
+        """按起始块顺序返回所有空闲区段"""
+        return sorted(self._by_start.items())
+
+    def used_extents(self):
+        """按起始块顺序返回所有已占用区段"""
+        extents = []
+        start = 0
+        for free_start, length in self.free_extents():
+            if free_start > start:
+                extents.append((start, free_start - start))
+            start = free_start + length
+        if start < self.total_blocks:
+            extents.append((start, self.total_blocks - start))
+        return extents
+
+    def largest_free_extent(self):
+        return self._sizes.last()[0] if self._sizes else 0
+
+    def stats(self):
+        """块的使用情况和空闲空间的碎片程度"""
+        largest = self.largest_free_extent()
+        return {
+            "total_blocks": self.total_blocks,
+            "free_blocks": self.free_count,
+            "used_blocks": self.total_blocks - self.free_count,
+            "shared_blocks": len(self.refcounts),
+            "free_extents": len(self._by_start),
+            "largest_free_extent": largest,
+            # 空闲块中不属于最大空闲区段的比例，0 表示空闲空间完全连续
+            "fragmentation": 1 - largest / self.free_count if self.free_count else 0.0,
+        }
+
+
+def _runs(sorted_blocks):
+    """将有序块号序列切分为连续区段 (起始块, 长度)"""
+    runs = []
+    start = prev = None
+    for block_index in sorted_blocks:
+        if prev is not None and block_index == prev + 1:
+            prev = block_index
+            continue
+        if start is not None:
+            runs.append((start, prev - start + 1))
+        start = prev = block_index
+    if start is not None:
+        runs.append((start, prev - start + 1))
+    return runs
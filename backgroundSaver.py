@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+import diskImage
+
+
+class BackgroundSaver:
+    """后台保存：在拥有文件系统的线程上取得一致的快照，在工作线程中写入映像并原子替换
+
+    调用线程（如 GUI 线程）上只编码元数据，数据区使用写时复制的快照：工作线程按顺序读取，其间被覆盖的块
+    由写入方先保存旧内容，因此无论数据区多大，取得快照的耗时只与文件数有关。
+    快照在文件系统的全局锁中取得，其它线程的修改不会混入；poll 和 save_async 应在同一线程中调用。
+    """
+
+    def __init__(self, file_system, path, interval=30.0, dirty_threshold=256, on_progress=None, on_finished=None):
+        self.file_system = file_system
+        self.path = path
+        self.interval = interval  # 有未保存的修改时，距上次保存超过该秒数即保存
+        self.dirty_threshold = dirty_threshold  # 未保存的修改次数达到该值时立即保存
+        self.on_progress = on_progress  # (已写入字节数, 总字节数)，在工作线程中调用
+        self.on_finished = on_finished  # (快照序号, 耗时秒数, 异常或 None)，在调用 poll 的线程中调用
+        self.saved_lsn = file_system.lsn
+        self.last_save = time.monotonic()
+        self.last_latency = None
+        self._thread = None
+        self._result = None
+
+    @property
+    def busy(self):
+        return self._thread is not None
+
+    def dirty_count(self):
+        """自上次保存以来的修改次数"""
+        return self.file_system.lsn - self.saved_lsn
+
+    def poll(self):
+        """定期调用：处理已完成的保存，并按时间间隔或修改次数触发新的保存"""
+        if self._thread is not None:
+            if self._thread.is_alive():
+                return
+            self._finish()
+        dirty = self.dirty_count()
+        if dirty >= self.dirty_threshold or (dirty and time.monotonic() - self.last_save >= self.interval):
+            self.save_async()
+
+    def save_async(self):
+        """取得快照并在工作线程中写入，已有保存在进行时返回 False"""
+        if self._thread is not None:
+            return False
+        file_system = self.file_system
+        # 写入完成前一直持有保存锁，同步保存会等待本次保存替换完映像后再写入，保证映像不会回退；
+        # 与同步保存一样先取得全局锁再取得保存锁，避免与持有全局锁写检查点的线程互相等待
+        with file_system.lock:
+            file_system.save_lock.acquire()
+            try:
+                snapshot = diskImage.snapshot_image(file_system, copy_data=True)
+            except BaseException:
+                file_system.save_lock.release()
+                raise
+        self._thread = threading.Thread(target=self._run, args=(snapshot,), name="BackgroundSaver", daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self, snapshot):
+        start = time.monotonic()
+        error = None
+        try:
+            temp_path = diskImage.write_snapshot(snapshot, self.path, self.on_progress)
+            try:
+                os.replace(temp_path, self.path)
+            except OSError:
+                os.remove(temp_path)
+                raise
+        except Exception as e:  # 保存失败时旧映像保持不变，错误交给 poll 所在的线程处理
+            error = e
+        finally:
+            snapshot.data.release(self.file_system.block_store)
+            self.file_system.save_lock.release()
+        self._result = (snapshot.lsn, time.monotonic() - start, error)
+
+    def _finish(self):
+        self._thread.join()
+        self._thread = None
+        lsn, latency, error = self._result
+        self._result = None
+        self.last_save = time.monotonic()
+        with self.file_system.lock:
+            if error is None:
+                self.saved_lsn = lsn
+                self.last_latency = latency
+                if self.file_system.journal is not None:
+                    self.file_system.journal.discard_through(lsn)  # 快照之前的日志记录已不再需要
+            elif isinstance(error, PermissionError):
+                # Windows 下无法替换仍被映射的映像，解除映射后下次保存即可成功
+                self.file_system._release_image()
+        if self.on_finished is not None:
+            self.on_finished(lsn, latency, error)
+
+    def wait(self):
+        """等待进行中的保存完成"""
+        if self._thread is not None:
+            self._finish()
+
+    def close(self):
+        self.wait()
@@ -0,0 +1,690 @@
+import argparse
+import gc
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 各规模的默认参数：文件数、卷的总块数、块大小、目录树的宽度和深度、单个文件的最大块数、计时的操作次数
+SCALES = {
+    "small": dict(files=2000, blocks=1 << 16, block_size=512, width=8, depth=32, file_blocks=4, ops=2000),
+    "medium": dict(files=20000, blocks=1 << 18, block_size=512, width=16, depth=64, file_blocks=4, ops=10000),
+    "large": dict(files=100000, blocks=1 << 20, block_size=256, width=32, depth=128, file_blocks=4, ops=20000),
+}
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """登记基准测试：func(config, recorder) 先完成不计时的准备工作，再通过 recorder.time 逐个计时"""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+class Recorder:
+    """记录每次操作的耗时（纳秒）和处理的字节数"""
+
+    def __init__(self):
+        self.samples = []
+        self.bytes = 0
+        self.extra = {}
+
+    def time(self, func, *args):
+        start = time.perf_counter_ns()
+        result = func(*args)
+        self.samples.append(time.perf_counter_ns() - start)
+        return result
+
+
+class Workload:
+    """按配置生成目录树和文件内容；同一配置和随机种子总是生成相同的工作负载"""
+
+    def __init__(self, config):
+        self.config = config
+        self.rng = random.Random(config["seed"])
+        self.block_size = config["block_size"]
+        self.pool = self.rng.randbytes(max(self.block_size * config["file_blocks"] * 4, 1 << 16))
+        width = config["width"]
+        # 宽树：width 个一级目录，每个下面 width 个二级目录，文件平均分布在二级目录中
+        self.directories = [f"/root/w{i}/s{j}" for i in range(width) for j in range(width)]
+        # 深树：/root/deep/l1/l2/.../l{depth}
+        self.deep = ["/root/deep" + "".join(f"/l{k}" for k in range(1, level + 1))
+                     for level in range(config["depth"] + 1)]
+        self.files = [(self.directories[i % len(self.directories)], f"f{i}.dat") for i in range(config["files"])]
+
+    def data(self, max_size=None):
+        size = self.rng.randint(0, max_size if max_size is not None else self.block_size * self.config["file_blocks"])
+        start = self.rng.randrange(len(self.pool) - size + 1)
+        return self.pool[start:start + size]
+
+    def create_file_system(self):
+        from fileManagement import IndexedFileSystem
+        file_system = IndexedFileSystem(self.config["blocks"] * self.block_size, self.block_size)
+        file_system.format()
+        return file_system
+
+    def create_tree(self, file_system):
+        width = self.config["width"]
+        for i in range(width):
+            file_system.create_directory(f"/root/w{i}")
+            for j in range(width):
+                file_system.create_directory(f"/root/w{i}/s{j}")
+        for path in self.deep:
+            file_system.create_directory(path)
+
+    def populate(self, file_system):
+        """创建目录树并按目录成批写入所有文件，返回写入的字节数"""
+        self.create_tree(file_system)
+        by_directory = {}
+        for directory, name in self.files:
+            by_directory.setdefault(directory, []).append((name, self.data()))
+        total = 0
+        for directory, entries in by_directory.items():
+            file_system.allocate_files(directory, entries)  # 卷太小时抛出 NoSpaceError，需增大 --blocks
+            total += sum(len(data) for _, data in entries)
+        return total
+
+    def sample_files(self, count):
+        return [f"{directory}/{name}" for directory, name in self.rng.sample(self.files, min(count, len(self.files)))]
+
+
+@benchmark("allocate")
+def bench_allocate(config, recorder):
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    workload.create_tree(file_system)
+    for directory, name in workload.files:
+        data = workload.data()
+        recorder.time(file_system.allocate_file, f"{directory}/{name}", data)
+        recorder.bytes += len(data)
+
+
+@benchmark("allocate_batch")
+def bench_allocate_batch(config, recorder):
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    workload.create_tree(file_system)
+    by_directory = {}
+    for directory, name in workload.files:
+        by_directory.setdefault(directory, []).append((name, workload.data()))
+    for directory, entries in by_directory.items():
+        recorder.time(file_system.allocate_files, directory, entries)
+        recorder.bytes += sum(len(data) for _, data in entries)
+    recorder.extra["files"] = len(workload.files)
+
+
+@benchmark("metadata_memory")
+def bench_metadata_memory(config, recorder):
+    """成批创建全部文件，报告 inode、目录项和块号列表平均每个文件占用的内存"""
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    workload.create_tree(file_system)
+    by_directory = {}
+    for directory, name in workload.files:
+        by_directory.setdefault(directory, []).append((name, workload.data()))
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for directory, entries in by_directory.items():
+        recorder.time(file_system.allocate_files, directory, entries)
+    file_system.dentry_cache.clear()
+    gc.collect()
+    recorder.extra["metadata_bytes_per_file"] = round((tracemalloc.get_traced_memory()[0] - before) / len(workload.files), 1)
+    if not tracing:
+        tracemalloc.stop()
+
+
+@benchmark("allocate_fragmented")
+def bench_allocate_fragmented(config, recorder):
+    """先用单块文件占满一半的卷，再删除其中一半制造碎片，之后分配需要拼接多个空闲区段的文件"""
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    file_system.create_directory("/root/frag")
+    count = config["blocks"] // 2
+    one_block = workload.pool[:workload.block_size]
+    for start in range(0, count, 4096):
+        file_system.allocate_files("/root/frag", [(f"x{i}", one_block) for i in range(start, min(start + 4096, count))])
+    for i in range(0, count, 2):
+        file_system.delete_file(f"/root/frag/x{i}")
+    size = workload.block_size * 8
+    for i in range(config["ops"]):
+        recorder.time(file_system.allocate_file, f"/root/frag/y{i}", workload.pool[:size])
+        recorder.bytes += size
+    recorder.extra["free_extents"] = len(file_system.allocator.free_extents())
+
+
+@benchmark("read")
+def bench_read(config, recorder):
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    workload.populate(file_system)
+    for path in workload.sample_files(config["ops"]):
+        data = recorder.time(file_system.read_file, path)
+        recorder.bytes += len(data)
+
+
+@benchmark("read_large")
+def bench_read_large(config, recorder):
+    """读取大文件；同时读取四分之一大小的文件，单次耗时之比的对数给出随文件大小增长的阶数（线性约为1）"""
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    blocks = min(config["blocks"] // 4, 1 << 16)
+    sizes = {"small": blocks // 4 * workload.block_size, "large": blocks * workload.block_size}
+    data = (workload.pool * (sizes["large"] // len(workload.pool) + 1))[:sizes["large"]]
+    for name, size in sizes.items():
+        file_system.allocate_file(f"/root/{name}", data[:size])
+    rounds = max(config["ops"] // 500, 8)
+    mean = {}
+    for name, size in sizes.items():
+        samples = []
+        for _ in range(rounds):
+            start = time.perf_counter_ns()
+            file_system.read_file(f"/root/{name}")
+            samples.append(time.perf_counter_ns() - start)
+        mean[name] = sum(samples) / len(samples)
+        if name == "large":
+            recorder.samples.extend(samples)
+            recorder.bytes += size * rounds
+    recorder.extra["file_bytes"] = sizes["large"]
+    recorder.extra["scaling_exponent"] = round(math.log(mean["large"] / mean["small"]) / math.log(4), 3)
+
+
+@benchmark("seek")
+def bench_seek(config, recorder):
+    """在大文件中随机定位后读取一小段；块号经由间接索引查找，单次耗时只与索引级数有关，不随文件大小增长"""
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    blocks = min(config["blocks"] // 2, 1 << 18)
+    size = blocks * workload.block_size
+    file_system.allocate_file("/root/large", (workload.pool * (size // len(workload.pool) + 1))[:size])
+    handle = file_system.open("/root/large")
+    buffer = bytearray(64)
+
+    def seek_read(offset):
+        handle.seek(offset)
+        return handle.readinto(buffer)
+
+    for _ in range(config["ops"]):
+        recorder.bytes += recorder.time(seek_read, workload.rng.randrange(size - len(buffer)))
+    recorder.extra["file_bytes"] = size
+
+
+@benchmark("write")
+def bench_write(config, recorder):
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    workload.populate(file_system)
+    for path in workload.sample_files(config["ops"]):
+        data = workload.data()
+        recorder.time(file_system.write_file, path, data)
+        recorder.bytes += len(data)
+
+
+@benchmark("append")
+def bench_append(config, recorder):
+    """不断向同一个文件追加小块数据，单次追加的耗时不应随文件变大而增长"""
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    file_system.allocate_file("/root/log", b"", "a")
+    chunk = workload.pool[:workload.block_size // 3 + 1]
+    for _ in range(config["ops"]):
+        recorder.time(file_system.append, "/root/log", chunk)
+        recorder.bytes += len(chunk)
+    recorder.extra["file_bytes"] = file_system.get_file("/root/log").size
+
+
+@benchmark("copy_file")
+def bench_copy_file(config, recorder):
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    workload.populate(file_system)
+    directories = workload.directories
+    for path in workload.sample_files(config["ops"]):
+        recorder.time(file_system.copy_file, path, workload.rng.choice(directories))
+
+
+@benchmark("copy_directory")
+def bench_copy_directory(config, recorder):
+    """复制每个一级目录（包含 width 个子目录及其中的文件）"""
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    workload.populate(file_system)
+    file_system.create_directory("/root/copies")
+    for i in range(config["width"]):
+        recorder.time(file_system.copy_directory, f"/root/w{i}", "/root/copies")
+    recorder.extra["files_per_op"] = config["files"] // config["width"]
+
+
+@benchmark("delete_directory")
+def bench_delete_directory(config, recorder):
+    """删除每个一级目录及其全部内容"""
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    workload.populate(file_system)
+    for i in range(config["width"]):
+        recorder.time(file_system.delete_directory, f"/root/w{i}")
+    recorder.extra["files_per_op"] = config["files"] // config["width"]
+
+
+@benchmark("change_directory")
+def bench_change_directory(config, recorder):
+    """在宽树和深树中随机切换目录，混合绝对路径和相对路径"""
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    workload.populate(file_system)
+    rng = workload.rng
+    targets = []
+    for _ in range(config["ops"]):
+        kind = rng.random()
+        if kind < 0.4:
+            targets.append(rng.choice(workload.deep))
+        elif kind < 0.8:
+            targets.append(rng.choice(workload.directories))
+        else:
+            targets.append("..")
+    for path in targets:
+        recorder.time(file_system.change_directory, path)
+
+
+@benchmark("find")
+def bench_find(config, recorder):
+    """全卷按名称查找，混合子串和通配符查询，每次查询之间重命名一个文件；首次查询建立索引的耗时单独报告"""
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    workload.populate(file_system)
+    rng = workload.rng
+    start = time.perf_counter()
+    file_system.find("")
+    recorder.extra["build_seconds"] = round(time.perf_counter() - start, 3)
+    files = len(workload.files)
+    queries = []
+    for _ in range(config["ops"]):
+        kind = rng.random()
+        if kind < 0.5:
+            queries.append(f"f{rng.randrange(files)}.")
+        elif kind < 0.8:
+            queries.append(f"f{rng.randrange(files)}*.dat")
+        else:
+            queries.append("*.dat")
+    paths = workload.sample_files(config["ops"])
+    for i, query in enumerate(queries):
+        recorder.time(file_system.find, query, None, 100)
+        if i < len(paths):
+            file_system.rename_file(paths[i], f"renamed{i}.dat")
+    recorder.extra["indexed"] = len(file_system.search_index)
+
+
+DEFRAG_BUDGET = 0.005  # defragment 每一步的时间预算（秒）
+
+
+@benchmark("defragment")
+def bench_defragment(config, recorder):
+    """交错追加使文件分散后，以固定的时间预算分步整理整个卷，计时每一步"""
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    workload.populate(file_system)
+    paths = [f"{directory}/{name}" for directory, name in workload.files]
+    for path in workload.rng.sample(paths, len(paths) // 4):
+        file_system.delete_file(path)  # 留下分散的空洞，之后的追加落在其中
+    for path in workload.sample_files(config["ops"]):
+        if file_system.get_file(path) is not None:
+            file_system.append(path, workload.data(workload.block_size * 2))
+    before = file_system.fragmentation_stats()
+    while not recorder.time(file_system.defragment, DEFRAG_BUDGET):
+        pass
+    after = file_system.fragmentation_stats()
+    recorder.bytes = file_system.defragmenter.moved_blocks * workload.block_size
+    recorder.extra["extents_per_file"] = [round(before["extents_per_file"], 2), round(after["extents_per_file"], 2)]
+    recorder.extra["fragmented_files"] = [before["fragmented_files"], after["fragmented_files"]]
+    recorder.extra["moved_files"] = file_system.defragmenter.moved_files
+
+
+CAPACITY_BLOCKS = 8192  # compressed_capacity 使用的卷的最大块数
+_TEXT_WORDS = ("the file system stores every block in a single buffer and writes the journal before the image "
+               "directory index search event compression ratio allocator extent free used metadata inode").split()
+
+
+def _fill_volume(config, texts, compression, recorder=None):
+    """在固定大小的卷上依次写入文本文件直到空间不足，返回 (写入的字节数, 文件系统)；recorder 不为 None 时逐个计时"""
+    from errors import NoSpaceError
+    from fileManagement import IndexedFileSystem
+    block_size = config["block_size"]
+    file_system = IndexedFileSystem(min(config["blocks"], CAPACITY_BLOCKS) * block_size, block_size,
+                                    compression=compression)
+    stored = count = 0
+    while True:
+        data = texts[count % len(texts)]
+        try:
+            if recorder is not None:
+                recorder.time(file_system.allocate_file, f"/root/t{count}.txt", data)
+                recorder.bytes += len(data)
+            else:
+                file_system.allocate_file(f"/root/t{count}.txt", data)
+        except NoSpaceError:
+            return stored, file_system
+        stored += len(data)
+        count += 1
+
+
+@benchmark("compressed_capacity")
+def bench_compressed_capacity(config, recorder):
+    """以 zlib 压缩写入文本文件直到卷满，并与不压缩时同样大小的卷能容纳的字节数比较"""
+    workload = Workload(config)
+    rng = workload.rng
+    largest = workload.block_size * config["file_blocks"] * 4
+    texts = []
+    for _ in range(64):
+        size = rng.randint(workload.block_size, largest)
+        texts.append(" ".join(rng.choice(_TEXT_WORDS) for _ in range(size // 4)).encode()[:size])
+    raw_bytes, _ = _fill_volume(config, texts, None)
+    compressed_bytes, file_system = _fill_volume(config, texts, "zlib", recorder)
+    recorder.extra["capacity_gain"] = round(compressed_bytes / raw_bytes, 2)
+    recorder.extra["compression_ratio"] = round(file_system.compression_stats()["ratio"], 2)
+
+
+CONCURRENT_THREADS = 4  # concurrent 中读线程的个数，另有同样个数的写线程
+
+
+@benchmark("concurrent")
+def bench_concurrent(config, recorder):
+    """读线程以文件句柄流式读取的同时，写线程不断覆盖、创建和删除文件，每个线程使用自己的会话并以相对路径访问；
+    计时每次完整读取一个文件，结束后检查分配器与目录树一致（没有泄漏或重复分配的块）"""
+    import threading
+    from errors import FileSystemError
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    workload.populate(file_system)
+    per_thread = config["ops"] // CONCURRENT_THREADS
+    largest = workload.block_size * config["file_blocks"]
+    finished = threading.Event()
+    samples = [[] for _ in range(CONCURRENT_THREADS)]
+    read_bytes = [0] * CONCURRENT_THREADS
+    writes = [0] * CONCURRENT_THREADS
+    failures = []
+
+    def reader(k):
+        rng = random.Random(config["seed"] * 1000 + k)
+        session = file_system.session()
+        buffer = bytearray(workload.block_size)
+        try:
+            for _ in range(per_thread):
+                directory, name = rng.choice(workload.files)
+                session.change_directory(directory)
+                start = time.perf_counter_ns()
+                try:
+                    with session.open(name) as handle:
+                        while True:
+                            count = handle.readinto(buffer)
+                            if not count:
+                                break
+                            read_bytes[k] += count
+                except FileSystemError:
+                    continue  # 已被写线程删除
+                samples[k].append(time.perf_counter_ns() - start)
+        except BaseException as e:
+            failures.append(e)
+
+    def writer(k):
+        rng = random.Random(config["seed"] * 1000 + CONCURRENT_THREADS + k)
+        session = file_system.session()
+        try:
+            while not finished.is_set():
+                directory, name = rng.choice(workload.files)
+                session.change_directory(directory)
+                size = rng.randint(0, largest)
+                start = rng.randrange(len(workload.pool) - size + 1)
+                data = workload.pool[start:start + size]
+                try:
+                    choice = rng.random()
+                    if choice < 0.6:
+                        session.write_file(name, data)
+                    elif choice < 0.8:
+                        session.delete_file(name)
+                    else:
+                        session.allocate_file(name, data)
+                    writes[k] += 1
+                except FileSystemError:
+                    pass  # 已被删除，或空间不足
+        except BaseException as e:
+            failures.append(e)
+
+    readers = [threading.Thread(target=reader, args=(k,)) for k in range(CONCURRENT_THREADS)]
+    writers = [threading.Thread(target=writer, args=(k,)) for k in range(CONCURRENT_THREADS)]
+    for thread in readers + writers:
+        thread.start()
+    for thread in readers:
+        thread.join()
+    finished.set()
+    for thread in writers:
+        thread.join()
+    if failures:
+        raise failures[0]
+    problems = file_system.check_consistency()
+    if any(problems.values()):
+        raise AssertionError(f"Allocator is inconsistent after concurrent access: {problems}")
+    for thread_samples in samples:
+        recorder.samples.extend(thread_samples)
+    recorder.bytes = sum(read_bytes)
+    recorder.extra["concurrent_writes"] = sum(writes)
+
+
+def _populated_image(config, directory):
+    workload = Workload(config)
+    file_system = workload.create_file_system()
+    written = workload.populate(file_system)
+    path = os.path.join(directory, "bench.img")
+    return file_system, path, written
+
+
+@benchmark("save_to_disk")
+def bench_save_to_disk(config, recorder):
+    with tempfile.TemporaryDirectory() as directory:
+        file_system, path, _ = _populated_image(config, directory)
+        for _ in range(config["repeat"]):
+            recorder.time(file_system.save_to_disk, path)
+            recorder.bytes += os.path.getsize(path)
+
+
+@benchmark("load_from_disk")
+def bench_load_from_disk(config, recorder):
+    """加载映像并遍历整棵目录树（目录按需解码，遍历时才会全部解码）"""
+    from fileManagement import IndexedFileSystem
+
+    def load_and_walk(path):
+        file_system = IndexedFileSystem.load_from_disk(path)
+        queue = [file_system.root]
+        for directory in queue:
+            len(directory.files)
+            queue.extend(directory.subdirectories.values())
+        file_system._release_image()
+        return file_system
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_system, path, _ = _populated_image(config, directory)
+        file_system.save_to_disk(path)
+        del file_system
+        for _ in range(config["repeat"]):
+            recorder.time(load_and_walk, path)
+            recorder.bytes += os.path.getsize(path)
+
+
+def _percentile(sorted_samples, fraction):
+    index = min(len(sorted_samples) - 1, max(0, math.ceil(fraction * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+
+def summarize(recorder, elapsed):
+    """由各次操作的耗时计算吞吐量和延迟分位数（微秒）"""
+    samples = sorted(recorder.samples)
+    total = sum(samples)
+    result = {
+        "ops": len(samples),
+        "seconds": round(total / 1e9, 6),
+        "wall_seconds": round(elapsed, 3),
+        "ops_per_sec": round(len(samples) / (total / 1e9), 1) if total else None,
+    }
+    if recorder.bytes and total:
+        result["mib_per_sec"] = round(recorder.bytes / (1024 * 1024) / (total / 1e9), 2)
+    if samples:
+        result["latency_us"] = {
+            "mean": round(total / len(samples) / 1000, 2),
+            "p50": round(_percentile(samples, 0.50) / 1000, 2),
+            "p90": round(_percentile(samples, 0.90) / 1000, 2),
+            "p99": round(_percentile(samples, 0.99) / 1000, 2),
+            "max": round(samples[-1] / 1000, 2),
+        }
+    # 后十分之一与前十分之一操作的中位耗时之比：单次操作的代价随规模增长时（如二次复杂度）明显大于1
+    if len(recorder.samples) >= 50:
+        tenth = len(recorder.samples) // 10
+        head = sorted(recorder.samples[:tenth])
+        tail = sorted(recorder.samples[-tenth:])
+        result["growth"] = round(_percentile(tail, 0.5) / max(_percentile(head, 0.5), 1), 2)
+    result.update(recorder.extra)
+    return result
+
+
+def run_benchmark(name, config, trace_memory=False):
+    """在当前进程中运行一个基准测试并返回结果"""
+    recorder = Recorder()
+    if trace_memory:
+        tracemalloc.start()
+    gc.collect()
+    start = time.monotonic()
+    BENCHMARKS[name](config, recorder)
+    result = summarize(recorder, time.monotonic() - start)
+    if trace_memory:
+        result["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result["peak_rss_kib"] = peak // 1024 if sys.platform == "darwin" else peak
+    return result
+
+
+def run_isolated(name, config, trace_memory=False):
+    """在独立的子进程中运行，使各项的峰值内存互不影响"""
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(run_benchmark, (name, config, trace_memory))
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, threshold):
+    """与之前的结果比较，返回变慢超过 threshold 倍的项"""
+    regressions = []
+    print(f"\n{'benchmark':<22}{'baseline ops/s':>16}{'current ops/s':>16}{'ratio':>8}{'p99 ratio':>11}")
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+        if not old or not old.get("ops_per_sec") or not result.get("ops_per_sec"):
+            continue
+        ratio = old["ops_per_sec"] / result["ops_per_sec"]
+        p99_ratio = result["latency_us"]["p99"] / max(old["latency_us"]["p99"], 0.01)
+        flag = ""
+        if ratio > threshold or p99_ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<22}{old['ops_per_sec']:>16}{result['ops_per_sec']:>16}{ratio:>8.2f}{p99_ratio:>11.2f}{flag}")
+    return regressions
+
+
+def _print_result(name, result):
+    latency = result.get("latency_us", {})
+    notes = []
+    if "mib_per_sec" in result:
+        notes.append(f"{result['mib_per_sec']} MiB/s")
+    if "growth" in result:
+        notes.append(f"growth {result['growth']}")
+    if "metadata_bytes_per_file" in result:
+        notes.append(f"{result['metadata_bytes_per_file']} B/file")
+    if "scaling_exponent" in result:
+        notes.append(f"scaling {result['scaling_exponent']}")
+    if "extents_per_file" in result:
+        notes.append("extents/file {} -> {}".format(*result["extents_per_file"]))
+    if "capacity_gain" in result:
+        notes.append(f"capacity x{result['capacity_gain']} (ratio {result['compression_ratio']})")
+    if "concurrent_writes" in result:
+        notes.append(f"{result['concurrent_writes']} concurrent writes, consistent")
+    if "build_seconds" in result:
+        notes.append(f"build {result['build_seconds']} s")
+    if "peak_rss_kib" in result:
+        notes.append(f"rss {result['peak_rss_kib'] // 1024} MiB")
+    print(f"{name:<22}{result['ops']:>8} ops {result['ops_per_sec'] or 0:>12} ops/s  "
+          f"p50 {latency.get('p50', 0):>9} us  p99 {latency.get('p99', 0):>9} us  {'  '.join(notes)}")
+
+
+if __name__ == '__main__':
+    # python benchmark.py --scale medium --output bench.json
+    # python benchmark.py --scale medium --compare bench.json
+    parser = argparse.ArgumentParser(description="Headless benchmarks for IndexedFileSystem")
+    parser.add_argument("benchmarks", nargs="*", help=f"benchmarks to run (default: all): {', '.join(BENCHMARKS)}")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    for key in ("files", "blocks", "block_size", "width", "depth", "file_blocks", "ops"):
+        parser.add_argument("--" + key.replace("_", "-"), type=int, help=f"override the {key} of the scale")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions of save_to_disk and load_from_disk")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="also report the peak Python heap via tracemalloc (slows the benchmarks)")
+    parser.add_argument("--in-process", action="store_true", help="run every benchmark in this process")
+    parser.add_argument("--output", help="write the results as JSON to this path")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="slowdown factor reported as a regression by --compare")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+    config = dict(SCALES[args.scale], repeat=args.repeat, seed=args.seed)
+    for key in ("files", "blocks", "block_size", "width", "depth", "file_blocks", "ops"):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scale": args.scale,
+            "config": config,
+        },
+        "results": {},
+    }
+    for name in args.benchmarks or BENCHMARKS:
+        run = run_benchmark if args.in_process else run_isolated
+        result = run(name, config, args.trace_memory)
+        report["results"][name] = result
+        _print_result(name, result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to '{args.output}'.")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.threshold):
+            sys.exit(1)
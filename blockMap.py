@@ -0,0 +1,249 @@
+import struct
+from array import array
+from functools import lru_cache
+
+NDIRECT = 12  # 直接保存在 inode 中的块号个数
+LEVELS = 3  # 间接索引的最大级数：一级、二级、三级
+POINTER_SIZE = 4  # 索引块中每个块号占4字节，与 array('I') 的布局相同
+
+_POINTER = struct.Struct("=I")
+
+
+@lru_cache(maxsize=None)
+def _geometry(block_size):
+    """返回 (每个索引块的块号个数, 各级索引覆盖的块数)"""
+    per_block = block_size // POINTER_SIZE
+    return per_block, tuple(per_block ** level for level in range(1, LEVELS + 1))
+
+
+def max_blocks(block_size):
+    """单个文件最多能索引的块数"""
+    return NDIRECT + sum(_geometry(block_size)[1])
+
+
+def index_count(count, block_size):
+    """索引 count 个块所需的间接索引块个数；不超过 NDIRECT 个块时不需要索引块"""
+    remaining = count - NDIRECT
+    if remaining <= 0:
+        return 0
+    per_block, spans = _geometry(block_size)
+    total = 0
+    for level, level_span in enumerate(spans, 1):
+        if remaining <= 0:
+            break
+        used = min(remaining, level_span)
+        # 高度为 level 的索引树中，从根往下每一层的索引块个数
+        span = level_span
+        for _ in range(level):
+            total += (used + span - 1) // span
+            span //= per_block
+        remaining -= used
+    if remaining > 0:
+        raise ValueError(f"{count} blocks exceed the maximum of {max_blocks(block_size)}")
+    return total
+
+
+class BlockMap:
+    """超过 NDIRECT 个块的文件的块映射：前 NDIRECT 个块号保存在 inode 中，其余依次保存在一级、二级、三级间接索引块中
+
+    间接索引块与数据块一样从卷中分配，每个索引块保存 block_size // 4 个块号；只有 roots 中的各级根索引块号保存在内存中。
+    按下标查找至多读取三个索引块，切片和遍历按索引块批量读取。索引块总是只属于一个文件，修改时原地改写。
+    支持 len()、下标、切片和迭代，切片返回 array('I')。
+    """
+
+    __slots__ = ('store', 'count', 'direct', 'roots')
+
+    def __init__(self, store, count=0, direct=(), roots=()):
+        self.store = store
+        self.count = count
+        self.direct = array('I', direct)
+        self.roots = array('I', roots)  # roots[level - 1] 为 level 级间接索引的根索引块
+
+    def __copy__(self):
+        return BlockMap(self.store, self.count, self.direct, self.roots)
+
+    def __repr__(self):
+        return f"BlockMap(count={self.count}, direct={self.direct.tolist()}, roots={self.roots.tolist()})"
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        chunk = _geometry(self.store.block_size)[0] * 64
+        for start in range(0, self.count, chunk):
+            yield from self._slice(start, min(start + chunk, self.count))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.count)
+            if step != 1:
+                return self._slice(0, self.count)[i]
+            return self._slice(start, max(start, stop))
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("block index out of range")
+        if i < NDIRECT:
+            return self.direct[i]
+        node, slot = self._locate(i)
+        return self._read(node, slot)
+
+    def _read(self, node, slot):
+        return _POINTER.unpack_from(self.store.buffer, node * self.store.block_size + slot * POINTER_SIZE)[0]
+
+    def _write(self, node, slot, value):
+        self.store.preserve(node)
+        _POINTER.pack_into(self.store.buffer, node * self.store.block_size + slot * POINTER_SIZE, value)
+
+    def _level_of(self, i):
+        """返回 (级数, 该级内的下标)"""
+        i -= NDIRECT
+        for level, span in enumerate(_geometry(self.store.block_size)[1], 1):
+            if i < span:
+                return level, i
+            i -= span
+        raise IndexError("block index exceeds the maximum file size")
+
+    def _locate(self, i):
+        """返回第 i 个块号所在的叶索引块及其槽位"""
+        per_block = _geometry(self.store.block_size)[0]
+        level, i = self._level_of(i)
+        node = self.roots[level - 1]
+        for height in range(level - 1, 0, -1):
+            slot, i = divmod(i, per_block ** height)
+            node = self._read(node, slot)
+        return node, i
+
+    def _slice(self, start, stop):
+        """第 [start, stop) 个块号，只读取覆盖该范围的索引块"""
+        blocks = array('I', self.direct[start:min(stop, NDIRECT)])
+        if stop <= max(start, NDIRECT):
+            return blocks
+        block_size = self.store.block_size
+        per_block, spans = _geometry(block_size)
+        if start >= NDIRECT:
+            leaf, slot = self._locate(start)
+            if slot + stop - start <= per_block:
+                # 整个范围位于同一个叶索引块中
+                offset = leaf * block_size + slot * POINTER_SIZE
+                blocks.frombytes(self.store.buffer[offset:offset + (stop - start) * POINTER_SIZE])
+                return blocks
+        base = NDIRECT
+        for level, root in enumerate(self.roots, 1):
+            if stop <= base:
+                break
+            span = spans[level - 1]
+            if start < base + span:
+                self._collect(root, level, base, max(start, base), min(stop, base + span), blocks)
+            base += span
+        return blocks
+
+    def _collect(self, node, height, base, start, stop, out):
+        """将以 node 为根、高度为 height、从第 base 块开始的子树中 [start, stop) 部分的块号追加到 out"""
+        block_size = self.store.block_size
+        offset = node * block_size
+        if height == 1:
+            out.frombytes(self.store.buffer[offset + (start - base) * POINTER_SIZE:offset + (stop - base) * POINTER_SIZE])
+            return
+        span = _geometry(block_size)[0] ** (height - 1)
+        for slot in range((start - base) // span, (stop - base - 1) // span + 1):
+            child_base = base + slot * span
+            self._collect(self._read(node, slot), height - 1, child_base,
+                          max(start, child_base), min(stop, child_base + span), out)
+
+    def index_blocks(self, first=0):
+        """覆盖范围从第 first 块或之后开始的全部索引块；first 为0时即文件的全部索引块"""
+        found = []
+        base = NDIRECT
+        for level, root in enumerate(self.roots, 1):
+            self._collect_index(root, level, base, first, found)
+            base += _geometry(self.store.block_size)[1][level - 1]
+        return found
+
+    def _collect_index(self, node, height, base, first, found):
+        per_block = _geometry(self.store.block_size)[0]
+        span = per_block ** (height - 1)
+        if base >= first:
+            found.append(node)
+        if height == 1 or base + span * per_block <= first:
+            return
+        for slot in range(min(per_block, (self.count - base + span - 1) // span)):
+            child_base = base + slot * span
+            if child_base + span > first:
+                self._collect_index(self._read(node, slot), height - 1, child_base, first, found)
+
+    def set(self, i, block_index, before_write):
+        """将第 i 个块号改为 block_index；原地修改索引块前调用 before_write(索引块号)"""
+        if i < NDIRECT:
+            self.direct[i] = block_index
+            return
+        node, slot = self._locate(i)
+        before_write(node)
+        self._write(node, slot, block_index)
+
+    def extend(self, blocks, index_blocks, before_write):
+        """在末尾追加块号
+
+        index_blocks 为新分配的索引块，个数须为 index_count(追加后的块数) - index_count(追加前的块数)；
+        原地修改已有的索引块前调用 before_write(索引块号)，新分配的索引块无需保存旧内容。
+        """
+        blocks = array('I', blocks)
+        pos, n = self.count, len(blocks)
+        taken = 0
+        if pos < NDIRECT:
+            taken = min(n, NDIRECT - pos)
+            self.direct.extend(blocks[:taken])
+            pos += taken
+        block_size = self.store.block_size
+        per_block = _geometry(block_size)[0]
+        fresh = iter(index_blocks)
+        written = set()  # 本次新分配的索引块
+        while taken < n:
+            leaf, slot = self._leaf_for_append(pos, fresh, written, before_write)
+            count = min(n - taken, per_block - slot)
+            if leaf not in written:
+                before_write(leaf)
+            offset = leaf * block_size + slot * POINTER_SIZE
+            self.store.preserve(leaf)
+            self.store.buffer[offset:offset + count * POINTER_SIZE] = blocks[taken:taken + count].tobytes()
+            taken += count
+            pos += count
+        self.count = pos
+
+    def _leaf_for_append(self, pos, fresh, written, before_write):
+        """返回第 pos 个块号所在的叶索引块及槽位，沿途缺少的索引块从 fresh 中取用；pos 必须紧接已有的块"""
+        per_block = _geometry(self.store.block_size)[0]
+        level, i = self._level_of(pos)
+        if len(self.roots) < level:
+            node = next(fresh)
+            self.roots.append(node)
+            written.add(node)
+        node = self.roots[level - 1]
+        for height in range(level - 1, 0, -1):
+            slot, i = divmod(i, per_block ** height)
+            if i == 0:
+                # 新子树的第一个块，子索引块尚未分配
+                child = next(fresh)
+                written.add(child)
+                if node not in written:
+                    before_write(node)
+                self._write(node, slot, child)
+            else:
+                child = self._read(node, slot)
+            node = child
+        return node, i
+
+    def truncate(self, count):
+        """截断为前 count 个块号，返回不再需要的索引块；被截掉的数据块由调用方释放"""
+        freed = self.index_blocks(count)
+        base = NDIRECT
+        levels = 0
+        for level, span in enumerate(_geometry(self.store.block_size)[1][:len(self.roots)], 1):
+            if base >= count:
+                break
+            levels = level
+            base += span
+        del self.roots[levels:]
+        del self.direct[count:]
+        self.count = count
+        return freed
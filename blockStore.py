@@ -0,0 +1,213 @@
+import mmap
+import os
+import threading
+
+
+class DataSnapshot:
+    """数据区某一时刻的只读视图：写时复制，快照之后被覆盖的块先由 BlockStore 保存旧内容，读取时以旧内容代替
+
+    取得快照不复制数据区，后台线程按顺序切片读取（snapshot[start:stop]），已读过的块不再保存，
+    因此额外占用的内存只有保存期间尚未读到、又被修改的块。
+    """
+
+    def __init__(self, store):
+        self.block_size = store.block_size
+        self.total_blocks = store.total_blocks
+        self.source = store.buffer
+        self.preserved = {}  # 块号 -> 快照时的内容
+        self.position = 0  # 已读出的块数，此前的块被修改时不再需要保存
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.total_blocks * self.block_size
+
+    def preserve(self, start, count):
+        """块即将被修改：保存尚未读出的块在快照时的内容"""
+        size = self.block_size
+        with self.lock:
+            for index in range(max(start, self.position), min(start + count, self.total_blocks)):
+                if index not in self.preserved:
+                    self.preserved[index] = bytes(self.source[index * size:(index + 1) * size])
+
+    def __getitem__(self, span):
+        """按顺序读取 [start:stop) 字节，返回快照时的内容"""
+        start, stop, _ = span.indices(len(self))
+        size = self.block_size
+        with self.lock:
+            data = bytearray(self.source[start:stop])
+            for index in range(start // size, (stop + size - 1) // size):
+                old = self.preserved.pop(index, None) if index < stop // size else self.preserved.get(index)
+                if old is not None:
+                    lo = max(start, index * size)
+                    hi = min(stop, (index + 1) * size)
+                    data[lo - start:hi - start] = old[lo - index * size:hi - index * size]
+            self.position = max(self.position, stop // size)
+        return bytes(data)
+
+    def release(self, store):
+        """读取结束，之后的修改不再保存"""
+        with self.lock:
+            self.position = self.total_blocks
+            self.preserved.clear()
+            if store.snapshot is self:
+                store.snapshot = None
+
+
+class BlockStore:
+    """连续块存储：所有数据块位于同一块预分配的缓冲区（bytearray 或 mmap）中"""
+
+    def __init__(self, total_blocks, block_size, backing_file=None, offset=0, access=mmap.ACCESS_WRITE):
+        self.total_blocks = total_blocks
+        self.block_size = block_size
+        self.backing_file = backing_file  # 为 None 时数据只保存在内存中
+        self.offset = offset  # 数据区在映像文件中的起始偏移
+        self.access = access  # ACCESS_COPY 时修改只保存在内存中，不写回映射的文件
+        self._file = None
+        self._mmap = None
+        self.snapshot = None  # 进行中的数据区快照，修改块之前需先保存旧内容
+        self._open_buffer()
+
+    def _open_buffer(self):
+        """按块数和块大小准备底层缓冲区"""
+        length = self.total_blocks * self.block_size
+        if self.backing_file is None:
+            self.buffer = memoryview(bytearray(length))
+            return
+
+        if self.access == mmap.ACCESS_COPY:
+            self._file = open(self.backing_file, 'rb')
+        else:
+            mode = 'r+b' if os.path.exists(self.backing_file) else 'w+b'
+            self._file = open(self.backing_file, mode)
+            self._file.seek(0, os.SEEK_END)
+            if self._file.tell() < self.offset + length:
+                self._file.truncate(self.offset + length)  # 扩展为稀疏文件，未写入部分读出为0
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=self.access)
+        # mmap 的偏移必须按分配粒度对齐，因此映射整个文件后再切片
+        self.buffer = memoryview(self._mmap)[self.offset:self.offset + length]
+
+    def take_snapshot(self):
+        """取得数据区的写时复制快照，读取结束后由调用方 release()；同一时刻只支持一个快照"""
+        self.snapshot = DataSnapshot(self)
+        return self.snapshot
+
+    def preserve(self, start, count=1):
+        """修改从 start 开始的 count 个块之前调用，快照进行中时保存它们的旧内容"""
+        snapshot = self.snapshot
+        if snapshot is not None:
+            snapshot.preserve(start, count)
+
+    def _span(self, index):
+        start = index * self.block_size
+        return start, start + self.block_size
+
+    def read_block(self, index, length=None):
+        """读取单个块，返回指向缓冲区的 memoryview（不复制）"""
+        start, end = self._span(index)
+        if length is not None:
+            end = start + length
+        return self.buffer[start:end]
+
+    def write_block(self, index, data):
+        """整块写入，不足一块的部分补0"""
+        self.preserve(index)
+        start, end = self._span(index)
+        n = len(data)
+        self.buffer[start:start + n] = data
+        if n < self.block_size:
+            self.buffer[start + n:end] = bytes(self.block_size - n)
+
+    def write_into(self, index, offset, data):
+        """在块内偏移处写入，不影响块内其它字节"""
+        self.preserve(index)
+        start = index * self.block_size + offset
+        self.buffer[start:start + len(data)] = data
+
+    def copy_blocks(self, source, target, count):
+        """将从 source 开始的 count 个连续块复制到从 target 开始的位置，两个范围不能重叠"""
+        self.preserve(target, count)
+        size = self.block_size
+        self.buffer[target * size:(target + count) * size] = self.buffer[source * size:(source + count) * size]
+
+    def clear_block(self, index):
+        self.preserve(index)
+        start, end = self._span(index)
+        self.buffer[start:end] = bytes(self.block_size)
+
+    def read(self, blocks, size):
+        """按块号顺序拼接读取 size 字节"""
+        parts = []
+        remaining = size
+        for block_index in blocks:
+            if remaining <= 0:
+                break
+            n = min(self.block_size, remaining)
+            parts.append(self.read_block(block_index, n))
+            remaining -= n
+        return b"".join(parts)
+
+    def write(self, blocks, data):
+        """将 data 依次写入给定的块"""
+        view = memoryview(data)
+        for i, block_index in enumerate(blocks):
+            self.write_block(block_index, view[i * self.block_size:(i + 1) * self.block_size])
+
+    def clear(self):
+        """清空所有块"""
+        if self._mmap is None:
+            # 快照继续读取原来的缓冲区，之后不会再被修改
+            self.snapshot = None
+            self.buffer = memoryview(bytearray(self.total_blocks * self.block_size))
+            return
+        self.preserve(0, self.total_blocks)
+        chunk = 1024 * 1024
+        zeros = bytes(chunk)
+        length = len(self.buffer)
+        for start in range(0, length, chunk):
+            end = min(start + chunk, length)
+            self.buffer[start:end] = zeros[:end - start]
+
+    def flush(self):
+        if self._mmap is not None:
+            self._mmap.flush()
+
+    def detach(self):
+        """将映射的数据复制到内存中并关闭映射文件"""
+        if self._mmap is None:
+            return
+        data = memoryview(bytearray(self.buffer))
+        snapshot = self.snapshot
+        if snapshot is not None:
+            with snapshot.lock:  # 内容相同，快照改为读取内存中的副本，映射随后关闭
+                snapshot.source = data
+        self.close()
+        self.backing_file = None
+        self.offset = 0
+        self.buffer = data
+
+    def close(self):
+        """关闭映射文件；调用前需释放所有由 read_block 返回的视图"""
+        if self._mmap is not None:
+            self.buffer.release()
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+            self._file = None
+
+    def __getstate__(self):
+        # 序列化时只保存块数据本身，映射文件会被转换为内存存储
+        return {
+            'total_blocks': self.total_blocks,
+            'block_size': self.block_size,
+            'data': self.buffer.tobytes(),
+        }
+
+    def __setstate__(self, state):
+        self.total_blocks = state['total_blocks']
+        self.block_size = state['block_size']
+        self.backing_file = None
+        self.offset = 0
+        self._file = None
+        self._mmap = None
+        self.snapshot = None
+        self.buffer = memoryview(bytearray(state['data']))
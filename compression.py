@@ -0,0 +1,38 @@
+import lzma
+import zlib
+
+METHODS = ("zlib", "lzma")  # 可选的压缩算法，None 表示不压缩
+
+# 映像中保存的算法编号，0 表示不压缩
+_CODES = {None: 0, "zlib": 1, "lzma": 2}
+_METHODS = {code: method for method, code in _CODES.items()}
+
+
+def check_method(method):
+    if method is not None and method not in METHODS:
+        raise ValueError(f"Unknown compression method: {method}")
+    return method
+
+
+def encode_method(method):
+    return _CODES[method]
+
+
+def decode_method(code):
+    return _METHODS[code]
+
+
+def compress(data, method):
+    """压缩 data，返回完整的压缩流"""
+    if method == "zlib":
+        return zlib.compress(data, 6)
+    return lzma.compress(data, preset=6)
+
+
+def decompress(data, method, limit=None):
+    """解压 data 中的压缩流，流结束后的数据（最后一块末尾的0）被忽略；limit 不为 None 时至多解压出 limit 字节"""
+    if limit == 0:
+        return b""
+    if method == "zlib":
+        return zlib.decompressobj().decompress(data, limit or 0)  # zlib 以 0 表示不限制
+    return lzma.LZMADecompressor().decompress(data, -1 if limit is None else limit)
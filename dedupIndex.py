@@ -0,0 +1,44 @@
+import hashlib
+
+
+class DedupIndex:
+    """内容寻址索引：记录块内容指纹到块号的映射，用于让内容相同的块被多个文件共享
+
+    索引只是提示，块被释放或原地改写后对应的索引项会过期，使用前须核对块的实际内容。
+    """
+
+    def __init__(self):
+        self._blocks = {}  # 指纹 -> 块号
+        self._digests = {}  # 块号 -> 指纹
+        self.hits = 0  # 因内容已存在而直接共享、未占用新块的次数
+
+    def __len__(self):
+        return len(self._blocks)
+
+    @staticmethod
+    def fingerprint(data):
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def lookup(self, digest):
+        return self._blocks.get(digest)
+
+    def add(self, block_index, digest):
+        """登记块的当前内容，同时移除该块旧内容的索引项"""
+        self.discard(block_index)
+        self._blocks[digest] = block_index
+        self._digests[block_index] = digest
+
+    def relocate(self, old_block, new_block):
+        """块的内容被原样移动到新块：索引项改为指向新块"""
+        self.discard(new_block)
+        digest = self._digests.pop(old_block, None)
+        if digest is None:
+            return
+        if self._blocks.get(digest) == old_block:
+            self._blocks[digest] = new_block
+        self._digests[new_block] = digest
+
+    def discard(self, block_index):
+        digest = self._digests.pop(block_index, None)
+        if digest is not None and self._blocks.get(digest) == block_index:
+            del self._blocks[digest]
@@ -0,0 +1,152 @@
+import time
+
+from blockMap import BlockMap, index_count
+
+
+def count_extents(blocks):
+    """块号序列（按在文件中的顺序）由几段连续的块组成，空文件为0"""
+    if not len(blocks):
+        return 0
+    if isinstance(blocks, BlockMap):
+        blocks = blocks[:]  # 一次读出全部块号，不逐个查找索引块
+    return 1 + sum(1 for previous, block_index in zip(blocks, blocks[1:]) if block_index != previous + 1)
+
+
+def file_fragmentation(file_system, inode):
+    """单个文件的碎片程度：数据块数、间接索引块数和数据块组成的连续区段数"""
+    count = len(inode.blocks)
+    return {
+        "blocks": count,
+        "index_blocks": index_count(count, file_system.block_size),
+        "extents": count_extents(inode.blocks),
+    }
+
+
+def volume_fragmentation(file_system, directory):
+    """目录子树中文件的碎片程度，以及整个卷空闲空间的碎片程度；需要遍历子树
+
+    files 只统计占用了块的文件，extents_per_file 为这些文件的平均区段数，1 表示全部连续存放。
+    """
+    files = fragmented = extents = worst = 0
+    for inode in file_system._walk_files(directory):
+        count = count_extents(inode.blocks)
+        if not count:
+            continue
+        files += 1
+        extents += count
+        fragmented += count > 1
+        worst = max(worst, count)
+    allocator = file_system.allocator.stats()
+    return {
+        "files": files,
+        "fragmented_files": fragmented,
+        "extents": extents,
+        "extents_per_file": extents / files if files else 0.0,
+        "max_extents": worst,
+        "free_extents": allocator["free_extents"],
+        "largest_free_extent": allocator["largest_free_extent"],
+        "free_fragmentation": allocator["fragmentation"],
+    }
+
+
+class Defragmenter:
+    """在线碎片整理：逐个文件检查，将不连续的文件整体搬到一段足够大的空闲区段中
+
+    每次调用 step() 只工作给定的时间，可以在界面的定时器或后台任务中分多次完成，每次之间文件系统照常使用；
+    一遍整理按目录逐个处理，期间被删除的文件直接跳过，新建的文件留到下一遍。文件的数据块按原来的顺序连续存放，
+    间接索引块紧跟其后；压缩文件的块中是压缩流，按块原样搬移即可。含有共享块（复制的文件或去重）的文件不搬移，
+    否则共享它的其它文件仍指向旧块，需要逐一改写。搬移只改变物理布局，不写日志，在下次保存映像时落盘。
+    """
+
+    def __init__(self, file_system):
+        self.file_system = file_system
+        self.reset()
+
+    def reset(self):
+        """放弃进行中的一遍，下次调用 step() 时从头开始"""
+        self._root = None  # 进行中的一遍所针对的根目录，为 None 时下次调用开始新的一遍
+        self._directories = []  # 尚未处理的目录
+        self._files = []  # 正在处理的目录中尚未检查的文件
+        self.checked_files = 0
+        self.moved_files = 0
+        self.moved_blocks = 0
+        self.skipped_files = 0  # 不连续但无法整理的文件：含共享块，或没有足够大的空闲区段
+
+    @property
+    def running(self):
+        """是否有进行中的一遍"""
+        return self._root is not None
+
+    def step(self, budget=None):
+        """整理至多 budget 秒（None 表示一直整理到本遍结束），本遍结束时返回 True
+
+        每次至少检查一个文件，单个文件的搬移不会被打断，因此大文件可能使某一步超出 budget。
+        文件系统被格式化后进行中的一遍作废，重新开始。
+        """
+        file_system = self.file_system
+        if self._root is not file_system.root:
+            self.reset()
+            self._root = file_system.root
+            self._directories.append(self._root)
+        deadline = None if budget is None else time.perf_counter() + budget
+        while True:
+            if self._files:
+                inode = self._files.pop()
+                if file_system._attached(inode):
+                    self.checked_files += 1
+                    self._relocate(inode)
+            elif self._directories:
+                directory = self._directories.pop()
+                self._files = list(directory.files.values())
+                self._files.reverse()  # 按目录中的顺序处理
+                self._directories.extend(directory.subdirectories.values())
+            else:
+                self._root = None
+                return True
+            if deadline is not None and time.perf_counter() >= deadline:
+                return False
+
+    def _relocate(self, inode):
+        """将不连续的文件搬到一段连续的空闲块中，返回是否搬移"""
+        file_system = self.file_system
+        allocator = file_system.allocator
+        blocks = inode.blocks[:]
+        if count_extents(blocks) <= 1:
+            return False
+        if any(allocator.refcount(block_index) > 1 for block_index in blocks):
+            self.skipped_files += 1
+            return False
+        index_blocks = inode.blocks.index_blocks() if isinstance(inode.blocks, BlockMap) else []
+        needed = len(blocks) + len(index_blocks)
+        if allocator.largest_free_extent() < needed:
+            self.skipped_files += 1
+            return False
+        # 最大的空闲区段足够时按最佳适配分配，得到的总是一段连续的块
+        (start, _), = allocator.allocate_extents(needed)
+        count = len(blocks)
+        store = file_system.block_store
+        dedup_index = file_system.dedup_index
+        target = start
+        run_start = previous = blocks[0]
+        for block_index in list(blocks[1:]) + [None]:
+            if block_index is not None and block_index == previous + 1:
+                previous = block_index
+                continue
+            length = previous - run_start + 1
+            store.copy_blocks(run_start, target, length)
+            if dedup_index is not None:
+                for offset in range(length):
+                    dedup_index.relocate(run_start + offset, target + offset)
+            target += length
+            if block_index is not None:
+                run_start = previous = block_index
+        new_index = list(range(start + count, start + needed))
+        if dedup_index is not None:
+            for block_index in new_index:
+                dedup_index.discard(block_index)  # 索引块会被原地改写，不能作为去重的共享对象
+        with file_system.inode_locks.writing(inode):  # 复制旧块时读取照常进行，换用新块前等待读取结束
+            file_system._assign_blocks(inode, range(start, start + count), new_index)
+            allocator.release(list(blocks) + index_blocks)
+        self.moved_files += 1
+        self.moved_blocks += count
+        return True
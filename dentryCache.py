@@ -0,0 +1,92 @@
+from collections import OrderedDict
+
+
+class DentryCache:
+    """目录项缓存：按绝对路径缓存已解析的目录和文件，超出容量时淘汰最久未使用的项
+
+    文件以其路径为键，目录以路径加 "/" 为键，因此同名的文件和目录不会冲突。
+    缓存项按所在目录建立索引，失效目录时只遍历其下已缓存的项，与缓存容量无关；文件没有子项，用 discard() 直接移除。
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._entries = OrderedDict()  # 路径 -> Directory/Inode
+        self._children = {}  # 目录的键 -> 直接位于其下、本身已缓存或其下有缓存项的键
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, key):
+        """查找缓存项，命中时将其移到最近使用的位置；未命中时返回 None"""
+        node = self._entries.get(key)
+        if node is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return node
+
+    def insert(self, key, node):
+        if key not in self._entries:
+            self._link(key)
+        self._entries[key] = node
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.capacity:
+            self._remove(next(iter(self._entries)))
+
+    def _link(self, key):
+        """将键逐级登记到上级目录之下，上级目录本身未缓存时也登记，失效时才能从祖先找到它"""
+        while True:
+            parent = _parent_key(key)
+            if not parent:
+                return
+            siblings = self._children.get(parent)
+            if siblings is not None:
+                siblings.add(key)
+                return
+            self._children[parent] = {key}
+            key = parent
+
+    def _unlink(self, key):
+        """键既未缓存、其下也没有缓存项时从上级目录中移除，并逐级清理因此变空的上级"""
+        while key not in self._entries and key not in self._children:
+            parent = _parent_key(key)
+            siblings = self._children.get(parent)
+            if siblings is None:
+                return
+            siblings.discard(key)
+            if siblings:
+                return
+            del self._children[parent]
+            key = parent
+
+    def _remove(self, key):
+        del self._entries[key]
+        self._unlink(key)
+
+    def discard(self, path):
+        """失效一个文件的缓存项"""
+        if path in self._entries:
+            self._remove(path)
+
+    def invalidate(self, path):
+        """失效 path 对应的文件、目录及其下的所有缓存项"""
+        self.discard(path)
+        top = path + "/"
+        stack = [top]
+        while stack:
+            key = stack.pop()
+            self._entries.pop(key, None)
+            stack.extend(self._children.pop(key, ()))
+        self._unlink(top)
+
+    def clear(self):
+        self._entries.clear()
+        self._children.clear()
+
+
+def _parent_key(key):
+    """缓存项所在目录的键：/root/a/b 与 /root/a/b/ 均位于 /root/a/ 之下"""
+    return key[:key.rstrip("/").rfind("/") + 1]
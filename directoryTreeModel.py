@@ -0,0 +1,260 @@
+from bisect import bisect_left
+
+from PyQt5.QtCore import QAbstractItemModel, QModelIndex, Qt
+
+from eventBus import FORMATTED
+from fileManagement import Directory
+
+
+def _sort_key(name):
+    return name.casefold(), name
+
+
+class _Node:
+    """目录树中的一行：子目录在首次展开时才读取，按名称排序
+
+    每个节点记住自己在父节点中的行号；插入或删除子节点后只记下第一个可能失效的行号 stale，
+    之后的行号在下次查询时一并重新编号，一次同步中的多次插入删除只重新编号一遍。
+    """
+
+    __slots__ = ('directory', 'parent', 'name', 'children', 'keys', 'fetched', 'row', 'stale')
+
+    def __init__(self, directory, parent, row=0):
+        self.directory = directory
+        self.parent = parent
+        self.name = directory.name if directory is not None else None  # 上次同步时的名称，用于发现重命名
+        self.children = []
+        self.keys = []  # 与 children 一一对应的排序键，用于二分查找插入位置
+        self.fetched = False
+        self.row = row  # 在父节点 children 中的行号，不小于父节点的 stale 时可能已失效
+        self.stale = 0  # children 中从该行起缓存的行号可能已失效
+
+
+class DirectoryTreeModel(QAbstractItemModel):
+    """文件系统目录树的模型
+
+    每个目录对应一个常驻的节点，子目录在视图展开时才通过 fetchMore 读取；模型订阅文件系统的变更事件，
+    只同步事件涉及的已读取目录，发出精确的行插入、删除和移动信号，视图的展开状态随节点保留，目录重命名后仍保持展开。
+    """
+
+    def __init__(self, file_system, parent=None):
+        super().__init__(parent)
+        self.file_system = file_system
+        self.current_directory = file_system.current_directory
+        self._build()
+        self.subscription = file_system.watch(self.on_events)
+
+    def _build(self):
+        self._root = _Node(None, None)  # 不可见的根，唯一的子节点为文件系统的根目录
+        self._root.fetched = True
+        self._nodes = {}  # id(目录) -> 节点，只包含已读取的节点
+        self._append(self._root, self.file_system.root)
+
+    def _append(self, parent, directory):
+        node = _Node(directory, parent, len(parent.children))
+        parent.children.append(node)
+        parent.keys.append(_sort_key(node.name))
+        self._nodes[id(directory)] = node
+        return node
+
+    def _forget(self, node):
+        """节点所在的行已被删除，从索引中移除整棵子树"""
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            self._nodes.pop(id(node.directory), None)
+            stack.extend(node.children)
+
+    # QAbstractItemModel 接口
+
+    def index(self, row, column, parent=QModelIndex()):
+        node = self._node(parent)
+        if column != 0 or not 0 <= row < len(node.children):
+            return QModelIndex()
+        return self.createIndex(row, 0, node.children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        parent = index.internalPointer().parent
+        if parent is self._root:
+            return QModelIndex()
+        return self.createIndex(self._row(parent), 0, parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self._node(parent).children)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self._node(parent)
+        if node.fetched:
+            return bool(node.children)
+        return bool(node.directory.subdirectories)
+
+    def canFetchMore(self, parent):
+        node = self._node(parent)
+        return not node.fetched and bool(node.directory.subdirectories)
+
+    def fetchMore(self, parent):
+        node = self._node(parent)
+        if node.fetched:
+            return
+        node.fetched = True
+        subdirectories = sorted(node.directory.subdirectories.values(), key=lambda d: _sort_key(d.name))
+        if not subdirectories:
+            return
+        self.beginInsertRows(parent, 0, len(subdirectories) - 1)
+        for directory in subdirectories:
+            self._append(node, directory)
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        directory = index.internalPointer().directory
+        if role == Qt.DisplayRole:
+            icon = "📂" if directory is self.current_directory else "📁"
+            return f"{icon} {directory.name}"
+        if role == Qt.ToolTipRole:
+            return directory.location
+        if role == Qt.UserRole:
+            return directory
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole and section == 0:
+            return '快速访问'
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    # 目录与索引的对应
+
+    def _node(self, index):
+        return index.internalPointer() if index.isValid() else self._root
+
+    @staticmethod
+    def _row(node):
+        """节点在父节点中的行号，缓存失效时重新编号父节点中从 stale 起的子节点"""
+        parent = node.parent
+        if node.row >= parent.stale:
+            children = parent.children
+            for row in range(parent.stale, len(children)):
+                children[row].row = row
+            parent.stale = len(children)
+        return node.row
+
+    def _index_of(self, node):
+        if node is self._root:
+            return QModelIndex()
+        return self.createIndex(self._row(node), 0, node)
+
+    def directory(self, index):
+        """索引对应的目录，无效索引返回 None"""
+        return index.internalPointer().directory if index.isValid() else None
+
+    def index_for(self, directory):
+        """目录对应的索引，沿途尚未读取的上级目录会被读取，以便视图展开到该目录"""
+        chain = []
+        while directory is not None:
+            chain.append(directory)
+            directory = directory.parent
+        node = self._root
+        for directory in reversed(chain):
+            self.fetchMore(self._index_of(node))
+            child = self._nodes.get(id(directory))
+            if child is None or child.parent is not node:
+                return QModelIndex()  # 目录不在当前的树中
+            node = child
+        return self._index_of(node)
+
+    def set_current_directory(self, directory):
+        """更改以 📂 标记的当前目录，只刷新新旧两行"""
+        previous, self.current_directory = self.current_directory, directory
+        for node in (self._nodes.get(id(previous)), self._nodes.get(id(directory))):
+            if node is not None and node.parent is not None:
+                index = self._index_of(node)
+                self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+    # 增量更新
+
+    def on_events(self, events):
+        """同步事件涉及的目录；未读取过的目录不需要同步，展开时自然读取最新内容"""
+        if any(event.kind == FORMATTED for event in events):
+            # 格式化后根目录已被替换，整棵树重新建立
+            self.beginResetModel()
+            self._build()
+            self.endResetModel()
+            return
+        parents = {}
+        for event in events:
+            if isinstance(event.node, Directory):
+                for parent in (event.parent, event.old_parent):
+                    if parent is not None:
+                        parents[id(parent)] = parent
+        for parent in parents.values():
+            node = self._nodes.get(id(parent))
+            if node is None:
+                continue
+            if not node.fetched:
+                # 尚未展开的目录也同步一次，视图才会更新它的展开标记
+                node.fetched = True
+            self._sync(node)
+
+    def _sync(self, node):
+        """对比节点的子目录与文件系统中的当前内容，发出行删除、移动和插入信号"""
+        subdirectories = node.directory.subdirectories
+        current = {id(directory): directory for directory in subdirectories.values()}
+        parent_index = self._index_of(node)
+
+        # 删除不再存在的子目录，从后往前删除以保持行号有效
+        for row in range(len(node.children) - 1, -1, -1):
+            child = node.children[row]
+            if id(child.directory) not in current or subdirectories.get(child.directory.name) is not child.directory:
+                self.beginRemoveRows(parent_index, row, row)
+                del node.children[row]
+                del node.keys[row]
+                node.stale = min(node.stale, row)
+                self.endRemoveRows()
+                self._forget(child)
+
+        # 重命名的子目录移动到新名称的位置，节点不变，展开状态随之保留
+        for child in [child for child in node.children if child.name != child.directory.name]:
+            row = self._row(child)
+            child.name = child.directory.name
+            key = _sort_key(child.name)
+            target = bisect_left(node.keys[:row] + node.keys[row + 1:], key)  # 移出该行之后的插入位置
+            destination = target + 1 if target >= row else target  # 以移动前的行号表示插入位置
+            moved = destination not in (row, row + 1) and self.beginMoveRows(parent_index, row, row, parent_index,
+                                                                              destination)
+            del node.children[row]
+            del node.keys[row]
+            node.children.insert(target, child)
+            node.keys.insert(target, key)
+            node.stale = min(node.stale, row, target)
+            if moved:
+                self.endMoveRows()
+            index = self.createIndex(target, 0, child)
+            self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+        # 插入新增的子目录
+        known = {id(child.directory) for child in node.children}
+        for directory in current.values():
+            if id(directory) in known:
+                continue
+            key = _sort_key(directory.name)
+            row = bisect_left(node.keys, key)
+            self.beginInsertRows(parent_index, row, row)
+            child = _Node(directory, node, row)
+            node.children.insert(row, child)
+            node.keys.insert(row, key)
+            node.stale = min(node.stale, row)
+            self._nodes[id(directory)] = child
+            self.endInsertRows()
@@ -0,0 +1,310 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from blockMap import BlockMap, NDIRECT
+from compression import decode_method, encode_method
+
+# 映像布局：
+#   [超级块, 4096 字节] [数据区, total_blocks * block_size] [元数据区：各段依次存放]
+# 元数据各段的偏移和长度记录在超级块之后的段表中，新版本只在段表末尾追加新段。
+IMAGE_MAGIC = b"IFSIMG01"
+IMAGE_VERSION = 3  # 2：大文件的块号保存在数据区的间接索引块中；3：inode 表项记录压缩算法
+# 没有压缩文件的卷仍写为版本 2，旧版本的程序可以读取
+_UNCOMPRESSED_VERSION = 2
+SUPERBLOCK_SIZE = 4096
+
+_SUPER = struct.Struct("<8sIIQQQQII")  # magic, version, block_size, total_blocks, size, data_offset, lsn, inode_count, section_count
+_SECTION = struct.Struct("<QQ")  # 偏移, 长度
+SECTIONS = ("bitmap", "free_extents", "refcounts", "inodes", "names", "dirents", "blocklists", "usage")
+
+# inode 表项：类型, 权限位, 压缩算法（版本 2 中为保留的0）, 父目录 inode 号, 名称偏移, 名称长度, 文件大小, 创建时间, 修改时间, 列表偏移, 列表长度
+# 目录的列表指向 dirents 段中的子项 inode 号，文件的列表指向 blocklists 段中的块号；
+# 带间接索引的文件的列表依次为块数、NDIRECT 个直接块号和各级根索引块号，索引块本身位于数据区
+_INODE = struct.Struct("<BBHIIIQddQI")
+KIND_FILE = 0
+KIND_DIRECTORY = 1
+KIND_INDEXED_FILE = 2
+NO_PARENT = 0xFFFFFFFF
+# usage 段：每个目录依次为 inode 号、子树的总字节数、文件数、子目录数、块数，按 inode 号排列
+_USAGE_FIELDS = 5
+
+_TYPE_BITS = (("r", 1), ("w", 2), ("a", 4))
+
+
+def _encode_type(file_type):
+    return sum(bit for flag, bit in _TYPE_BITS if flag in file_type)
+
+
+def _decode_type(bits):
+    return "".join(flag for flag, bit in _TYPE_BITS if bits & bit)
+
+
+_TYPE_NAMES = tuple(_decode_type(bits) for bits in range(8))  # 解码时共用，不为每个文件新建权限字符串
+
+
+def is_image(filename):
+    """判断文件是否为原生映像格式"""
+    with open(filename, 'rb') as f:
+        return f.read(len(IMAGE_MAGIC)) == IMAGE_MAGIC
+
+
+class ImageSnapshot:
+    """某一时刻的完整映像内容：超级块、数据区和各元数据段，写入时不再访问文件系统"""
+
+    def __init__(self, superblock, data, sections, lsn):
+        self.superblock = superblock
+        self.data = data
+        self.sections = sections
+        self.lsn = lsn
+
+    @property
+    def total_bytes(self):
+        return len(self.superblock) + len(self.data) + sum(len(section) for section in self.sections)
+
+
+def snapshot_image(file_system, copy_data=False):
+    """编码文件系统的元数据；copy_data 为 True 时数据区改用写时复制的 DataSnapshot，之后的修改不会影响快照，
+    读取结束后需调用 snapshot.data.release(file_system.block_store)
+
+    尚未解码的目录及其子树与加载时的映像完全相同，直接从映射的映像中复制表项并重新编号，不为保存而解码，
+    因此保存的耗时与目录树的大小成正比，但不会使按需加载的映像在保存后全部常驻内存。
+    """
+    names = bytearray()
+    dirents = array('I')
+    blocklists = array('I')
+    usage = array('Q')
+    records = []
+    compressed = False
+    image = file_system._image
+
+    # 广度优先编号，根目录为 0 号；队列中的整数为映像中尚未解码的 inode 号
+    queue = [(file_system.root, NO_PARENT)]
+    next_ino = 1
+    for node, parent_ino in queue:
+        ino = len(records)
+        if isinstance(node, int):
+            kind, type_bits, method, _, name_off, name_len, size, init_time, revise_time, list_off, list_len = \
+                image.record(node)
+            names_off = len(names)
+            names += image.sections["names"][name_off:name_off + name_len]
+            if kind == KIND_DIRECTORY:
+                children = image.children(list_off, list_len)
+                new_off = len(dirents)
+                dirents.extend(range(next_ino, next_ino + len(children)))
+                next_ino += len(children)
+                queue.extend((child, ino) for child in children)
+                usage.append(ino)
+                usage.extend(image.usage(node))
+            else:
+                new_off = len(blocklists)
+                blocklists.frombytes(image.raw_blocks(list_off, list_len))
+                compressed = compressed or method != 0
+            records.append((kind, type_bits, method, parent_ino, names_off, name_len, size, init_time, revise_time,
+                            new_off, list_len))
+            continue
+        name = node.name.encode('utf-8')
+        name_off = len(names)
+        names += name
+        undecoded = file_system._undecoded_children(node)  # 不能用 hasattr 判断，访问子项会触发解码
+        if undecoded is not None or hasattr(node, 'subdirectories'):
+            if undecoded is not None:
+                children = image.children(*undecoded)
+            else:
+                children = list(node.subdirectories.values()) + list(node.files.values())
+            list_off = len(dirents)
+            dirents.extend(range(next_ino, next_ino + len(children)))
+            next_ino += len(children)
+            queue.extend((child, ino) for child in children)
+            records.append((KIND_DIRECTORY, 0, 0, parent_ino, name_off, len(name), 0,
+                            node.init_timestamp, node.init_timestamp, list_off, len(children)))
+            usage.append(ino)
+            usage.extend(node.usage)
+        else:
+            list_off = len(blocklists)
+            blocks = node.blocks
+            if isinstance(blocks, BlockMap):
+                kind = KIND_INDEXED_FILE
+                blocklists.append(blocks.count)
+                blocklists.extend(blocks.direct)
+                blocklists.extend([0] * (NDIRECT - len(blocks.direct)))
+                blocklists.extend(blocks.roots)
+            else:
+                kind = KIND_FILE
+                blocklists.extend(blocks)
+            compressed = compressed or node.compression is not None
+            records.append((kind, _encode_type(node.type), encode_method(node.compression), parent_ino, name_off, len(name), node.size,
+                            node.init_timestamp, node.revise_timestamp, list_off, len(blocklists) - list_off))
+
+    inode_table = bytearray(_INODE.size * len(records))
+    for ino, record in enumerate(records):
+        _INODE.pack_into(inode_table, ino * _INODE.size, *record)
+
+    allocator = file_system.allocator
+    free_extents = array('Q')
+    for start, length in allocator.free_extents():
+        free_extents.append(start)
+        free_extents.append(length)
+    refcounts = array('Q')
+    for block_index, count in sorted(allocator.refcounts.items()):
+        refcounts.append(block_index)
+        refcounts.append(count)
+
+    sections = {
+        "bitmap": bytes(allocator.bitmap),
+        "free_extents": free_extents.tobytes(),
+        "refcounts": refcounts.tobytes(),
+        "inodes": bytes(inode_table),
+        "names": bytes(names),
+        "dirents": dirents.tobytes(),
+        "blocklists": blocklists.tobytes(),
+        "usage": usage.tobytes(),
+    }
+
+    if copy_data:
+        data = file_system.block_store.take_snapshot()
+    else:
+        data = file_system.block_store.buffer
+    data_offset = SUPERBLOCK_SIZE
+    data_length = len(data)
+    offset = data_offset + data_length
+    table = []
+    for section in SECTIONS:
+        table.append((offset, len(sections[section])))
+        offset += len(sections[section])
+
+    superblock = bytearray(SUPERBLOCK_SIZE)
+    version = IMAGE_VERSION if compressed else _UNCOMPRESSED_VERSION
+    _SUPER.pack_into(superblock, 0, IMAGE_MAGIC, version, file_system.block_size, file_system.total_blocks,
+                     file_system.size, data_offset, file_system.lsn, len(records), len(SECTIONS))
+    for i, entry in enumerate(table):
+        _SECTION.pack_into(superblock, _SUPER.size + i * _SECTION.size, *entry)
+
+    return ImageSnapshot(bytes(superblock), data, [sections[section] for section in SECTIONS], file_system.lsn)
+
+
+def write_snapshot(snapshot, filename, progress=None):
+    """将快照写入临时文件并落盘，返回临时文件路径，由调用方原子替换；progress(已写入字节数, 总字节数)"""
+    total = snapshot.total_bytes
+    temp_path = filename + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(snapshot.superblock)
+        written = len(snapshot.superblock)
+        data = snapshot.data
+        chunk = 4 * 1024 * 1024
+        for start in range(0, len(data), chunk):
+            f.write(data[start:start + chunk])
+            written += min(chunk, len(data) - start)
+            if progress is not None:
+                progress(written, total)
+        for section in snapshot.sections:
+            f.write(section)
+        f.flush()
+        os.fsync(f.fileno())
+    if progress is not None:
+        progress(total, total)
+    return temp_path
+
+
+def write_image(file_system, filename):
+    """将文件系统写为原生映像的临时文件并落盘，返回临时文件路径，由调用方原子替换"""
+    return write_snapshot(snapshot_image(file_system), filename)
+
+
+class ImageReader:
+    """原生映像的只读视图：映射整个文件，按需解码 inode 和目录项"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.block_size, self.total_blocks, self.size, self.data_offset,
+         self.lsn, self.inode_count, section_count) = _SUPER.unpack_from(self._mmap, 0)
+        if magic != IMAGE_MAGIC:
+            raise ValueError(f"'{filename}' is not a file system image")
+        if version > IMAGE_VERSION:
+            raise ValueError(f"Unsupported image version {version}")
+        view = self._view = memoryview(self._mmap)
+        self.sections = {}
+        for i, section in enumerate(SECTIONS[:section_count]):
+            offset, length = _SECTION.unpack_from(self._mmap, _SUPER.size + i * _SECTION.size)
+            self.sections[section] = view[offset:offset + length]
+        self._dirents = self.sections["dirents"].cast('I')
+        self._blocklists = self.sections["blocklists"].cast('I')
+        self._usage = self._usage_inos = None  # 旧映像没有 usage 段
+        if "usage" in self.sections:
+            self._usage = self.sections["usage"].cast('Q')
+            self._usage_inos = self._usage[::_USAGE_FIELDS]
+
+    def inode(self, ino):
+        """解码一个 inode 表项：(类型, 权限, 父目录, 名称, 大小, 创建时间, 修改时间, 列表偏移, 列表长度, 压缩算法)"""
+        kind, type_bits, method, parent, name_off, name_len, size, init_time, revise_time, list_off, list_len = \
+            _INODE.unpack_from(self.sections["inodes"], ino * _INODE.size)
+        name = str(self.sections["names"][name_off:name_off + name_len], 'utf-8')
+        return (kind, _TYPE_NAMES[type_bits], parent, name, size, init_time, revise_time, list_off, list_len,
+                decode_method(method))
+
+    def record(self, ino):
+        """未解码的 inode 表项原样返回，保存时直接复制：(类型, 权限位, 压缩算法, 父目录, 名称偏移, 名称长度, 大小,
+        创建时间, 修改时间, 列表偏移, 列表长度)"""
+        return _INODE.unpack_from(self.sections["inodes"], ino * _INODE.size)
+
+    def usage(self, ino):
+        """目录子树的汇总值 (总字节数, 文件数, 子目录数, 块数)，映像中没有保存时返回 None"""
+        if self._usage is None:
+            return None
+        start = bisect_left(self._usage_inos, ino) * _USAGE_FIELDS + 1
+        return tuple(self._usage[start:start + _USAGE_FIELDS - 1])
+
+    def children(self, list_off, list_len):
+        return self._dirents[list_off:list_off + list_len].tolist()
+
+    def blocks(self, list_off, list_len):
+        blocks = array('I')
+        blocks.frombytes(self._blocklists[list_off:list_off + list_len].cast('B'))
+        return blocks
+
+    def raw_blocks(self, list_off, list_len):
+        """文件的块号列表在映像中的原始字节"""
+        return self._blocklists[list_off:list_off + list_len].cast('B')
+
+    def block_map(self, store, list_off, list_len):
+        """解码带间接索引的文件的块映射，索引块从 store 中读取"""
+        pointers = self.blocks(list_off, list_len)
+        count = pointers[0]
+        return BlockMap(store, count, pointers[1:1 + min(count, NDIRECT)], pointers[1 + NDIRECT:])
+
+    def allocator_state(self):
+        """返回 (位图, 空闲区段列表, 引用计数字典)"""
+        extents = array('Q')
+        extents.frombytes(self.sections["free_extents"])
+        refcounts = array('Q')
+        refcounts.frombytes(self.sections["refcounts"])
+        return (bytearray(self.sections["bitmap"]),
+                list(zip(extents[0::2], extents[1::2])),
+                dict(zip(refcounts[0::2], refcounts[1::2])))
+
+    def close(self):
+        if self._usage is not None:
+            self._usage_inos.release()
+            self._usage.release()
+        self._dirents.release()
+        self._blocklists.release()
+        for view in self.sections.values():
+            view.release()
+        self._view.release()
+        self._mmap.close()
+        self._file.close()
+
+
+if __name__ == '__main__':
+    # 一次性转换：python diskImage.py filesystem.pkl filesystem.img
+    from fileManagement import IndexedFileSystem
+
+    if len(sys.argv) != 3:
+        print("Usage: python diskImage.py <old.pkl> <new.img>")
+        sys.exit(1)
+    IndexedFileSystem.load_from_disk(sys.argv[1]).save_to_disk(sys.argv[2])
+    print(f"Converted '{sys.argv[1]}' to '{sys.argv[2]}'.")
@@ -0,0 +1,22 @@
+class FileSystemError(Exception):
+    """文件系统操作失败；批量操作中抛出时整个批量操作回滚"""
+
+
+class NotFoundError(FileSystemError):
+    """路径指向的文件或目录不存在"""
+
+
+class AlreadyExistsError(FileSystemError):
+    """目标名称已被占用"""
+
+
+class PermissionDeniedError(FileSystemError):
+    """文件的权限类型不允许该操作（只读或只追加）"""
+
+
+class NoSpaceError(FileSystemError):
+    """空闲块不足，操作未做任何修改"""
+
+
+class FileTooLargeError(NoSpaceError):
+    """文件超过块索引（直接块和三级间接索引）能表示的最大大小"""
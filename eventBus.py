@@ -0,0 +1,170 @@
+# 事件类型
+CREATED = "created"
+DELETED = "deleted"
+RENAMED = "renamed"  # 在同一目录中改名
+MOVED = "moved"  # 移动到另一个目录（可能同时改名）
+WRITTEN = "written"  # 文件内容改变：写入、覆盖或追加
+TYPE_CHANGED = "type_changed"
+FORMATTED = "formatted"  # 整个文件系统被格式化，node 为新的根目录
+
+# 目录发生这些事件时，其子树中的订阅也会收到通知
+_SUBTREE_KINDS = {DELETED, RENAMED, MOVED}
+
+
+class FileSystemEvent:
+    """一次修改的结果：path 为修改后的绝对路径（删除时为删除前的路径），parent 为所在目录；
+    重命名和移动时 old_path、old_parent 为修改前的路径和所在目录"""
+
+    __slots__ = ('kind', 'path', 'node', 'parent', 'old_path', 'old_parent')
+
+    def __init__(self, kind, path, node, parent, old_path=None, old_parent=None):
+        self.kind = kind
+        self.path = path
+        self.node = node
+        self.parent = parent
+        self.old_path = old_path
+        self.old_parent = old_parent
+
+    def __repr__(self):
+        if self.old_path is not None:
+            return f"FileSystemEvent({self.kind}, {self.old_path!r} -> {self.path!r})"
+        return f"FileSystemEvent({self.kind}, {self.path!r})"
+
+
+class Subscription:
+    """watch() 返回的订阅，用于取消订阅"""
+
+    __slots__ = ('callback', 'directory', 'recursive')
+
+    def __init__(self, callback, directory, recursive):
+        self.callback = callback
+        self.directory = directory
+        self.recursive = recursive
+
+
+class EventBus:
+    """按子树分发文件系统事件
+
+    订阅登记在目录节点上而不是路径上，目录被重命名或移动后订阅仍然有效。一次发布的事件按订阅分组，
+    每个订阅的回调以其关心的事件列表调用一次，没有相关事件时不调用。
+    """
+
+    def __init__(self):
+        self._subscriptions = {}  # id(目录) -> [Subscription]，None 表示整个文件系统
+
+    def __bool__(self):
+        return bool(self._subscriptions)
+
+    def subscribe(self, callback, directory=None, recursive=True):
+        """订阅 directory 子树中的事件；recursive 为 False 时只订阅目录本身及其直接子项，directory 为 None 时订阅全部事件"""
+        subscription = Subscription(callback, directory, recursive)
+        key = None if directory is None else id(directory)
+        self._subscriptions.setdefault(key, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        key = None if subscription.directory is None else id(subscription.directory)
+        subscriptions = self._subscriptions.get(key, [])
+        if subscription in subscriptions:
+            subscriptions.remove(subscription)
+            if not subscriptions:
+                del self._subscriptions[key]
+
+    def publish(self, events):
+        if not self._subscriptions:
+            return
+        deliveries = {}  # Subscription -> [事件]，按订阅的先后顺序调用
+        for event in events:
+            for subscription in self._matching(event):
+                deliveries.setdefault(subscription, []).append(event)
+        for subscription, matched in deliveries.items():
+            subscription.callback(matched)
+
+    def _matching(self, event):
+        subscriptions = self._subscriptions
+        if event.kind == FORMATTED:
+            return [s for group in subscriptions.values() for s in group]
+        matched = list(subscriptions.get(None, ()))
+        matched.extend(subscriptions.get(id(event.node), ()))  # 被订阅的目录本身
+        for parent in (event.parent, event.old_parent):
+            depth = 0
+            while parent is not None:
+                for subscription in subscriptions.get(id(parent), ()):
+                    if (depth == 0 or subscription.recursive) and subscription not in matched:
+                        matched.append(subscription)
+                parent = parent.parent
+                depth += 1
+        if event.kind in _SUBTREE_KINDS and hasattr(event.node, 'subdirectories'):
+            # 被删除、重命名或移动的目录之下的订阅：路径已改变或已不存在
+            for key, group in subscriptions.items():
+                if key is None or key == id(event.node):
+                    continue
+                node = group[0].directory.parent
+                while node is not None and node is not event.node:
+                    node = node.parent
+                if node is not None:
+                    matched.extend(s for s in group if s not in matched)
+        return matched
+
+
+def coalesce(events, attached, original):
+    """将一个批量操作中的事件合并为批量操作前后两个状态之间的差异，每个节点至多出现一次（外加一次内容或权限的修改）
+
+    依次报告：已有节点的 renamed/moved（old_path 为批量操作前的路径），被删除的已有节点（批量操作前的路径），
+    新建且保留下来的节点（最终路径），以及内容或权限改变过的已有节点（最终路径）。创建后又被删除的节点不报告；
+    位于被删除目录中的节点只报告该目录，位于新建目录中的新节点只报告该目录。批量操作中的路径可能多次改变，
+    订阅者应按 node 而不是按路径逐个重放这些事件。
+    attached(node) 判断节点在提交时是否仍在文件系统中，original(node) 返回批量操作前的 (名称, 父目录)。
+    """
+    nodes = {}  # id(节点) -> [节点, 事件类型集合]，按首次出现的顺序
+    born = set()  # 批量操作中创建的节点（复制目录时只有副本的根节点有事件）
+    for event in events:
+        entry = nodes.get(id(event.node))
+        if entry is None:
+            entry = nodes[id(event.node)] = [event.node, set()]
+            if event.kind == CREATED:
+                born.add(id(event.node))
+        entry[1].add(event.kind)
+
+    def original_parent(node):
+        return original(node)[1]
+
+    def covered(node, parent_of, marked):
+        parent = parent_of(node)
+        while parent is not None:
+            if id(parent) in marked:
+                return True
+            parent = parent_of(parent)
+        return False
+
+    new = {node_id for node_id, (node, _) in nodes.items()
+           if node_id in born or covered(node, original_parent, born)}
+    created = {node_id for node_id in new if attached(nodes[node_id][0])}
+    deleted = {node_id for node_id, (node, _) in nodes.items() if node_id not in new and not attached(node)}
+
+    locations = {}
+
+    def original_location(node):
+        location = locations.get(id(node))
+        if location is None:
+            name, parent = original(node)
+            location = locations[id(node)] = (original_location(parent) if parent is not None else "") + "/" + name
+        return location
+
+    moves, deletions, creations, changes = [], [], [], []
+    for node_id, (node, kinds) in nodes.items():
+        if node_id in created:
+            if not covered(node, lambda n: n.parent, created):
+                creations.append(FileSystemEvent(CREATED, node.location, node, node.parent))
+        elif node_id in deleted:
+            if not covered(node, original_parent, deleted):
+                deletions.append(FileSystemEvent(DELETED, original_location(node), node, original_parent(node)))
+        elif node_id not in new:
+            old_name, old_parent = original(node)
+            if old_name != node.name or old_parent is not node.parent:
+                kind = RENAMED if old_parent is node.parent else MOVED
+                moves.append(FileSystemEvent(kind, node.location, node, node.parent, original_location(node), old_parent))
+            for kind in (WRITTEN, TYPE_CHANGED):
+                if kind in kinds:
+                    changes.append(FileSystemEvent(kind, node.location, node, node.parent))
+    return moves + deletions + creations + changes
@@ -0,0 +1,253 @@
+import os
+from bisect import bisect_left
+
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, QRect, QSize, Qt
+from PyQt5.QtGui import QColor, QFont, QKeySequence, QPixmap
+from PyQt5.QtWidgets import QAbstractItemView, QListView, QStyle, QStyledItemDelegate
+
+from fileManagement import Directory
+
+CELL_SIZE = QSize(100, 100)  # 每个格子的大小
+ICON_SIZE = 64  # 图标缩放后的边长
+BATCH_SIZE = 256  # 视图每轮事件循环布局的项数，大目录打开时界面不会长时间无响应
+RELAYOUT_EVENTS = 64  # 一次收到的事件超过该数目时整体重新排列，不再逐行插入和删除
+
+_pixmaps = {}  # (图片路径, 边长) -> 缩放后的 QPixmap，所有项共用
+
+
+def cached_pixmap(path, size=ICON_SIZE):
+    """按路径加载并缩放图标，同一图标只加载和缩放一次"""
+    pixmap = _pixmaps.get((path, size))
+    if pixmap is None:
+        pixmap = _pixmaps[(path, size)] = QPixmap(path).scaled(size, size, Qt.KeepAspectRatio,
+                                                               Qt.SmoothTransformation)
+    return pixmap
+
+
+# 排序方式 -> 排序键；目录总是排在文件之前，两者分别排序
+SORT_KEYS = {
+    "name": lambda node: (node.name.casefold(), node.name),
+    "size": lambda node: (getattr(node, 'size', 0), node.name.casefold()),
+    "modified": lambda node: (getattr(node, 'revise_timestamp', node.init_timestamp), node.name.casefold()),
+    "type": lambda node: (os.path.splitext(node.name)[1].casefold(), node.name.casefold()),
+}
+
+
+class _Descending:
+    """反转排序键的比较，使降序排列的键列表也能二分查找"""
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+
+class FileListModel(QAbstractListModel):
+    """当前目录内容的列表模型：每项为一个 Inode 或 Directory，视图只为可见的项读取数据
+
+    模型只订阅所显示目录的直接子项的变更事件，逐行插入、删除和移动，不重新读取整个目录。
+    """
+
+    def __init__(self, file_system, dir_icon, file_icon, parent=None):
+        super().__init__(parent)
+        self.file_system = file_system
+        self.dir_icon = dir_icon
+        self.file_icon = file_icon
+        self.directory = None
+        self.subscription = None
+        self.entries = []
+        self.keys = []  # 与 entries 一一对应的排序键，目录和文件各自有序
+        self.directory_count = 0  # entries 中目录排在前面，文件排在后面
+        self.sort_key = "name"
+        self.sort_order = Qt.AscendingOrder
+        self._rows = None  # id(节点) -> 行号，首次按节点查找行号时建立，行号改变时作废
+
+    def set_directory(self, directory):
+        """显示 directory 的内容"""
+        if self.subscription is not None:
+            self.file_system.unwatch(self.subscription)
+        self.beginResetModel()
+        self.directory = directory
+        self._arrange(list(directory.subdirectories.values()), list(directory.files.values()))
+        self.endResetModel()
+        self.subscription = self.file_system.watch(self.on_events, directory, recursive=False)
+
+    def _key(self, node):
+        key = SORT_KEYS[self.sort_key](node)
+        return _Descending(key) if self.sort_order == Qt.DescendingOrder else key
+
+    def _arrange(self, directories, files):
+        directories.sort(key=self._key)
+        files.sort(key=self._key)
+        self.entries = directories + files
+        self.keys = [self._key(node) for node in self.entries]
+        self.directory_count = len(directories)
+        self._rows = None
+
+    def _relayout(self, directories, files):
+        """以新的内容和顺序重新排列，选中的项和当前项随节点移动，已不存在的项取消选中"""
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        nodes = [self.entries[index.row()] for index in persistent]
+        self._arrange(directories, files)
+        self.changePersistentIndexList(persistent, [self.index_of(node) for node in nodes])
+        self.layoutChanged.emit()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """按 sort_key 重新排序"""
+        self.sort_order = order
+        self._relayout(self.entries[:self.directory_count], self.entries[self.directory_count:])
+
+    def set_sort_key(self, sort_key, order=Qt.AscendingOrder):
+        self.sort_key = sort_key
+        self.sort(0, order)
+
+    def on_events(self, events):
+        """按事件更新显示的内容：新增的项按排序插入，移出的项删除，改名或修改过的项移动到新的位置"""
+        directory = self.directory
+        if len(events) > RELAYOUT_EVENTS:
+            self._relayout(list(directory.subdirectories.values()), list(directory.files.values()))
+            return
+        for event in events:
+            node = event.node
+            if node is directory:
+                continue
+            entries = directory.subdirectories if isinstance(node, Directory) else directory.files
+            present = entries.get(node.name) is node
+            index = self.index_of(node)
+            if index.isValid() and present:
+                self._reposition(index.row(), node)
+            elif index.isValid():
+                self._remove(index.row())
+            elif present:
+                self._insert(node)
+
+    def _remove(self, row):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.entries[row]
+        del self.keys[row]
+        if row < self.directory_count:
+            self.directory_count -= 1
+        self._rows = None
+        self.endRemoveRows()
+
+    def _segment(self, node):
+        """节点所属的行范围：目录或文件"""
+        if isinstance(node, Directory):
+            return 0, self.directory_count
+        return self.directory_count, len(self.entries)
+
+    def _insert(self, node):
+        key = self._key(node)
+        row = bisect_left(self.keys, key, *self._segment(node))
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.entries.insert(row, node)
+        self.keys.insert(row, key)
+        if isinstance(node, Directory):
+            self.directory_count += 1
+        self._rows = None
+        self.endInsertRows()
+
+    def _reposition(self, row, node):
+        """名称、大小等改变后把节点移动到新的排序位置，节点所在的行不删除，选中状态随之保留"""
+        key = self._key(node)
+        low, high = self._segment(node)
+        del self.keys[row]
+        target = bisect_left(self.keys, key, low, high - 1)  # 移出该行之后的插入位置
+        self.keys.insert(row, key)
+        destination = target + 1 if target >= row else target  # 以移动前的行号表示插入位置
+        if destination not in (row, row + 1) and self.beginMoveRows(QModelIndex(), row, row, QModelIndex(),
+                                                                    destination):
+            del self.entries[row]
+            del self.keys[row]
+            self.entries.insert(target, node)
+            self.keys.insert(target, key)
+            self._rows = None
+            self.endMoveRows()
+            row = target
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def node(self, index):
+        return self.entries[index.row()] if index.isValid() else None
+
+    def index_of(self, node):
+        """节点所在的索引，不在当前目录中时返回无效索引"""
+        if self._rows is None:
+            self._rows = {id(entry): row for row, entry in enumerate(self.entries)}
+        row = self._rows.get(id(node))
+        return self.index(row) if row is not None else QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.entries)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node = self.entries[index.row()]
+        if role == Qt.DisplayRole:
+            return node.name
+        if role == Qt.DecorationRole:
+            return cached_pixmap(self.dir_icon if isinstance(node, Directory) else self.file_icon)
+        if role == Qt.ToolTipRole:
+            return node.location
+        if role == Qt.UserRole:
+            return node
+        return None
+
+
+class FileItemDelegate(QStyledItemDelegate):
+    """绘制图标和名称：图标取自共享的缓存，过长的名称在中间省略"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.font = QFont("SimSun", 8)
+        self.highlight = QColor("lightblue")
+
+    def sizeHint(self, option, index):
+        return CELL_SIZE
+
+    def paint(self, painter, option, index):
+        painter.save()
+        rect = option.rect
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(rect, self.highlight)
+        pixmap = index.data(Qt.DecorationRole)
+        top = rect.y() + 8
+        painter.drawPixmap(rect.x() + (rect.width() - pixmap.width()) // 2, top, pixmap)
+        painter.setFont(self.font)
+        text_rect = QRect(rect.x() + 2, top + ICON_SIZE + 4, rect.width() - 4, rect.bottom() - top - ICON_SIZE - 4)
+        name = painter.fontMetrics().elidedText(index.data(Qt.DisplayRole), Qt.ElideMiddle, text_rect.width())
+        painter.setPen(option.palette.color(option.palette.Text))
+        painter.drawText(text_rect, Qt.AlignHCenter | Qt.AlignTop, name)
+        painter.restore()
+
+
+class FileGridView(QListView):
+    """图标网格形式的文件视图：只绘制可见的项，支持 Ctrl/Shift 多选"""
+
+    # 交给主窗口处理的快捷键，QListView 默认会处理复制快捷键
+    _FORWARDED_KEYS = (QKeySequence.Copy, QKeySequence.Paste, QKeySequence.Delete)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setViewMode(QListView.IconMode)
+        self.setMovement(QListView.Static)
+        self.setResizeMode(QListView.Adjust)
+        self.setGridSize(CELL_SIZE)
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QListView.Batched)
+        self.setBatchSize(BATCH_SIZE)
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setItemDelegate(FileItemDelegate(self))
+        self.setContextMenuPolicy(Qt.CustomContextMenu)
+
+    def keyPressEvent(self, event):
+        if any(event.matches(key) for key in self._FORWARDED_KEYS):
+            event.ignore()
+            return
+        super().keyPressEvent(event)
@@ -0,0 +1,113 @@
+import io
+
+
+class FileHandle(io.RawIOBase):
+    """文件句柄：按块流式读取文件，数据直接来自块存储的 memoryview；压缩的文件在首次读取时整体解压一次
+
+    每次读取期间持有文件的读锁而不持有文件系统的全局锁，多个线程的句柄可以同时读取，见 IndexedFileSystem.reading()。
+    """
+
+    def __init__(self, file_system, inode, mode="r"):
+        super().__init__()
+        self.file_system = file_system
+        self.inode = inode
+        self.mode = mode
+        self._pos = 0
+        self._content = None  # 压缩文件解压后的内容
+        self._content_version = None  # 解压时文件的 (块号序列, 修改时间)，文件被重写后随之变化
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        self._checkClosed()
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._checkClosed()
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.inode.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if pos < 0:
+            raise ValueError(f"Negative seek position {pos}")
+        self._pos = pos
+        return pos
+
+    def _views(self, n):
+        """从当前位置开始依次返回最多 n 字节的块视图，并移动读写位置"""
+        if self.inode.compression is not None:
+            yield from self._content_views(n)
+            return
+        block_size = self.file_system.block_size
+        store = self.file_system.block_store
+        end = min(self._pos + n, self.inode.size)
+        while self._pos < end:
+            block_offset = self._pos % block_size
+            length = min(block_size - block_offset, end - self._pos)
+            block_index = self.inode.blocks[self._pos // block_size]
+            view = store.read_block(block_index)[block_offset:block_offset + length]
+            self._pos += length
+            yield view
+
+    def _content_views(self, n):
+        # 压缩文件只会整体重写到新的块，块号或修改时间变化即说明内容已变化
+        version = (self.inode.blocks, self.inode.revise_timestamp)
+        if self._content is None or self._content_version != version:
+            self._content = memoryview(self.file_system.read_content(self.inode))
+            self._content_version = version
+        end = min(self._pos + n, len(self._content))
+        if self._pos < end:
+            view = self._content[self._pos:end]
+            self._pos = end
+            yield view
+
+    def readinto(self, buffer):
+        """读入调用方提供的缓冲区，返回读取的字节数"""
+        self._checkClosed()
+        target = memoryview(buffer).cast('B')
+        filled = 0
+        with self.file_system.reading(self.inode):
+            for view in self._views(len(target)):
+                target[filled:filled + len(view)] = view
+                filled += len(view)
+        self.file_system.metrics.count_read(filled)
+        return filled
+
+    def read(self, size=-1):
+        self._checkClosed()
+        with self.file_system.reading(self.inode):
+            if size is None or size < 0:
+                size = max(self.inode.size - self._pos, 0)
+            data = b"".join(self._views(size))
+        self.file_system.metrics.count_read(len(data))
+        return data
+
+    def readall(self):
+        return self.read()
+
+    def iter_blocks(self):
+        """从当前位置起逐块返回 memoryview，不复制数据
+
+        视图直接引用块存储，只在取得时持有读锁：其它线程随后写入该文件时视图中的内容可能随之改变，需要一致的内容时用 read()。
+        """
+        self._checkClosed()
+        block_size = self.file_system.block_size
+        while True:
+            with self.file_system.reading(self.inode):
+                if self._pos >= self.inode.size:
+                    return
+                views = list(self._views(block_size - self._pos % block_size))
+            for view in views:
+                self.file_system.metrics.count_read(len(view))
+                yield view
+
+    def __iter__(self):
+        return self.iter_blocks()
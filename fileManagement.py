@@ -1,26 +1,272 @@
+import logging
+import mmap
 import os
 import pickle
+import threading
+import time
+from array import array
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
+from functools import partial
+from itertools import islice
+import diskImage
+from blockMap import BlockMap, NDIRECT, POINTER_SIZE, index_count, max_blocks
+from blockStore import BlockStore
+from compression import check_method, compress, decompress
+from dedupIndex import DedupIndex
+from defragmenter import Defragmenter, file_fragmentation, volume_fragmentation
+from dentryCache import DentryCache
+from allocator import ExtentAllocator
+from eventBus import EventBus, FileSystemEvent, coalesce, CREATED, DELETED, RENAMED, MOVED, WRITTEN, TYPE_CHANGED, FORMATTED
+from errors import FileSystemError, NotFoundError, AlreadyExistsError, PermissionDeniedError, NoSpaceError, FileTooLargeError
+from fileHandle import FileHandle
+from journal import Journal
+from locking import LockTable, synchronized
+from searchIndex import SearchIndex
+from session import Session
+from metrics import Metrics, instrumented
+from transaction import Transaction
 
-class Inode:
-    def __init__(self, name, size, location):
-        self.name = name
+logger = logging.getLogger(__name__)
+
+# 目录被重命名或移动时加1，此前缓存的路径全部失效，在下次访问时按需重新拼接
+_path_epoch = 0
+
+
+def _invalidate_paths():
+    global _path_epoch
+    _path_epoch += 1
+
+
+_NO_BLOCKS = range(0)
+
+
+def _block_list(blocks):
+    """文件的块号序列：带间接索引的 BlockMap 原样返回，其余转换为 array('I')"""
+    if isinstance(blocks, BlockMap):
+        return blocks
+    return array('I', blocks) if len(blocks) else _NO_BLOCKS
+
+
+def _pack_blocks(blocks):
+    """inode 中保存的块号序列：不超过 NDIRECT 个的连续块只保存一个整数（首块号 << 4 | 块数），
+    不连续的块保存为 array('I')，带间接索引的 BlockMap 原样保存"""
+    if isinstance(blocks, BlockMap):
+        return blocks
+    count = len(blocks)
+    if not count:
+        return _NO_BLOCKS
+    first = blocks[0]
+    if count <= NDIRECT and (type(blocks) is range and blocks.step == 1 or blocks[-1] - first == count - 1 and all(
+            block_index == first + i for i, block_index in enumerate(blocks))):
+        return first << 4 | count
+    return blocks if isinstance(blocks, array) else array('I', blocks)
+
+
+def _owned_blocks(inode):
+    """文件占用的全部块：数据块以及间接索引块"""
+    blocks = inode.blocks
+    if isinstance(blocks, BlockMap):
+        return list(blocks) + blocks.index_blocks()
+    return blocks
+
+
+def _timestamp(value):
+    return value.timestamp() if isinstance(value, datetime) else float(value)
+
+
+def _state_slots(cls):
+    """类及其基类中需要保存的全部槽位，路径缓存除外"""
+    return tuple(name for klass in reversed(cls.__mro__) for name in getattr(klass, '__slots__', ())
+                 if name not in ('_location', '_location_epoch'))
+
+
+class _PathNode:
+    """文件和目录共用的名称和父目录；使用 __slots__ 而不是 __dict__，百万级文件时元数据占用的内存显著减少
+
+    名称不做 sys.intern：文件名大多互不相同，驻留表的每一项比名称本身还大，目录的键与节点共用同一个字符串对象即可。
+    """
+
+    __slots__ = ('_name', '_parent')
+
+    def _init_path(self, name, parent):
+        self._name = name
+        self._parent = parent
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = name
+        self._moved()
+
+    @property
+    def parent(self):
+        return self._parent
+
+    @parent.setter
+    def parent(self, parent):
+        self._parent = parent
+        self._moved()
+
+    def _moved(self):
+        pass
+
+    @property
+    def init_time(self):
+        """创建时间；内部以浮点时间戳保存"""
+        return datetime.fromtimestamp(self.init_timestamp)
+
+    @init_time.setter
+    def init_time(self, value):
+        self.init_timestamp = _timestamp(value)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self._state_slots if hasattr(self, name)}
+
+    def __setstate__(self, state):
+        # 兼容旧版本保存的 name/parent/location 属性和 datetime 时间
+        for attr in ('name', 'parent'):
+            if attr in state:
+                state['_' + attr] = state.pop(attr)
+        for attr in ('init_time', 'revise_time'):
+            if attr in state:
+                state[attr.replace('time', 'timestamp')] = _timestamp(state.pop(attr))
+        for name in self._state_slots:
+            if name in state:
+                setattr(self, name, state[name])
+
+class Inode(_PathNode):
+    """文件：大小、权限类型、创建和修改时间戳，以及按顺序排列的数据块号
+
+    不超过 NDIRECT 个块的文件直接保存块号：连续的块只保存一个整数，读取时以 range 返回，不连续的保存为 array('I')；
+    更大的文件保存为 BlockMap，其余块号位于卷中的间接索引块里。三者都支持下标、切片和迭代，
+    修改块号需通过赋值 inode.blocks = ...，不能原地修改读出的序列。
+    compression 不为 None 时数据块中保存的是整个文件内容的压缩流，size 仍为解压后的字节数。
+    timestamp 为创建时间，批量创建的文件共用同一个时间戳对象。
+    """
+
+    __slots__ = ('size', 'type', '_blocks', 'compression', 'init_timestamp', 'revise_timestamp')
+
+    def __init__(self, name, size, timestamp=None):
+        self._init_path(name, None)
         self.size = size
-        self.init_time = datetime.now()  # 创建时间
-        self.revise_time = datetime.now()  # 修改时间
+        self.init_timestamp = self.revise_timestamp = time.time() if timestamp is None else timestamp  # 创建时间和修改时间
         self.type = "rw"  # 文件权限类型：r 只读, w 只写, a 只追加, rw 读写
-        self.location = location  # 文件路径
-        self.blocks = []
-        self.parent = None
-
-class Directory:
-    def __init__(self, name, location, parent=None):
-        self.name = name
-        self.location = location  # 目录路径
-        self.init_time = datetime.now()  # 创建时间 
-        self.parent = parent
-        self.files = {}
-        self.subdirectories = {}
+        self._blocks = _NO_BLOCKS
+        self.compression = None  # 压缩算法，见 compression.METHODS
+
+    @property
+    def blocks(self):
+        blocks = self._blocks
+        if type(blocks) is int:
+            first = blocks >> 4
+            return range(first, first + (blocks & 15))
+        return blocks
+
+    @blocks.setter
+    def blocks(self, blocks):
+        self._blocks = _pack_blocks(blocks)
+
+    @property
+    def location(self):
+        """绝对路径，由所在目录的（已缓存的）路径拼接得到，文件本身不缓存路径"""
+        parent = self._parent
+        return (parent.location if parent is not None else "") + "/" + self._name
+
+    @property
+    def revise_time(self):
+        """修改时间；内部以浮点时间戳保存"""
+        return datetime.fromtimestamp(self.revise_timestamp)
+
+    @revise_time.setter
+    def revise_time(self, value):
+        self.revise_timestamp = _timestamp(value)
+
+    def __setstate__(self, state):
+        if 'blocks' in state:
+            state['_blocks'] = _pack_blocks(_block_list(state.pop('blocks')))
+        state.setdefault('compression', None)  # 旧版本的文件均未压缩
+        super().__setstate__(state)
+
+class Directory(_PathNode):
+    """目录：路径由父目录链推导，并缓存到下一次目录重命名或移动为止
+
+    total_size、file_count、directory_count、block_count 为整棵子树（不含目录本身）的文件字节数、文件数、
+    子目录数和文件占用的块数（含间接索引块，共享的块按引用次数计），每次修改时沿父目录链更新。
+    """
+
+    __slots__ = ('init_timestamp', '_files', '_subdirectories', '_loader', '_location', '_location_epoch',
+                 'total_size', 'file_count', 'directory_count', 'block_count')
+
+    def __init__(self, name, parent=None):
+        self._init_path(name, parent)
+        self._location = None
+        self._location_epoch = -1
+        self.init_timestamp = time.time()  # 创建时间
+        self._files = {}
+        self._subdirectories = {}
+        self._loader = None  # 从映像加载时，子项在首次访问时才解码
+        self.total_size = self.file_count = self.directory_count = self.block_count = 0
+
+    @property
+    def usage(self):
+        """子树的汇总值 (总字节数, 文件数, 子目录数, 块数)"""
+        return self.total_size, self.file_count, self.directory_count, self.block_count
+
+    @usage.setter
+    def usage(self, usage):
+        self.total_size, self.file_count, self.directory_count, self.block_count = usage
+
+    @property
+    def location(self):
+        """绝对路径，缓存有效时直接返回，否则由父目录的路径拼接得到"""
+        if self._location_epoch != _path_epoch:
+            parent = self._parent
+            self._location = (parent.location if parent is not None else "") + "/" + self._name
+            self._location_epoch = _path_epoch
+        return self._location
+
+    @property
+    def files(self):
+        if self._loader is not None:
+            self._load_children()
+        return self._files
+
+    @files.setter
+    def files(self, files):
+        self._files = files
+
+    @property
+    def subdirectories(self):
+        if self._loader is not None:
+            self._load_children()
+        return self._subdirectories
+
+    @subdirectories.setter
+    def subdirectories(self, subdirectories):
+        self._subdirectories = subdirectories
+
+    def _load_children(self):
+        loader, self._loader = self._loader, None
+        loader(self)
+
+    def _moved(self):
+        # 目录的路径变化会影响整棵子树，只推进全局纪元，子树的路径在下次访问时重新计算
+        _invalidate_paths()
+
+    def __setstate__(self, state):
+        # 兼容旧版本保存的 files/subdirectories 属性
+        if 'files' in state:
+            state['_files'] = state.pop('files')
+            state['_subdirectories'] = state.pop('subdirectories')
+        state.setdefault('_loader', None)
+        self._location = None
+        self._location_epoch = -1
+        super().__setstate__(state)
 
     def add_file(self, inode):
         self.files[inode.name] = inode
@@ -57,199 +303,1121 @@ class Directory:
             print("Sub Directory:",sub)
         print("Init Time:",self.init_time)
 
+Inode._state_slots = _state_slots(Inode)
+Directory._state_slots = _state_slots(Directory)
+
 class IndexedFileSystem:
-    def __init__(self, size, block_size):
+    def __init__(self, size, block_size, backing_file=None, dedup=False, compression=None):
+        """创建 size 字节、块大小为 block_size 的卷；块大小决定每个索引块能保存的块号个数，从而决定单个文件的最大大小
+
+        compression 为新写入文件默认使用的压缩算法，见 set_compression()。
+        """
+        if block_size < 16 * POINTER_SIZE or block_size % POINTER_SIZE:
+            raise ValueError(f"Block size must be a multiple of {POINTER_SIZE} and at least {16 * POINTER_SIZE} bytes.")
+        total_blocks = size // block_size
+        if total_blocks > 0xFFFFFFFF:
+            raise ValueError("Volume has more blocks than 32-bit block numbers can address.")
+        # 传入 backing_file 时使用 mmap 映射
+        self._setup(size, block_size, BlockStore(total_blocks, block_size, backing_file),
+                    ExtentAllocator(total_blocks), Directory("root"))
+        if dedup:
+            self.enable_dedup()
+        self.set_compression(compression)
+
+    def _setup(self, size, block_size, block_store, allocator, root, lsn=0):
+        """初始化文件系统的全部状态，新建和从映像加载时共用"""
         self.size = size
         self.block_size = block_size
         self.total_blocks = size // block_size
-        self.data_blocks = [None] * self.total_blocks
-        self.free_blocks = set(range(self.total_blocks))
-        self.root = Directory("root", "/root")
+        self.block_store = block_store
+        self.allocator = allocator
+        self.root = root
+        self.lock = threading.RLock()  # 全局锁：目录树、分配器、日志、事件、缓存和索引的修改都在其中进行
+        self.inode_locks = LockTable()  # 文件内容的读写锁，读取在全局锁之外进行，见 reading()
+        self._local = threading.local()  # 当前线程正在使用的会话，见 session()
         self.current_directory = self.root
-        self.inodes = {}
+        self.lsn = lsn  # 最后一次修改的序号，启用日志时即最后一条日志记录的序号
+        self.journal = None
+        self.snapshot_path = None
+        self.checkpoint_bytes = 0
+        self._image = None  # 按需解码目录时使用的映像
+        self.dentry_cache = DentryCache()
+        self.dedup_index = None  # 启用块级去重时为 DedupIndex
+        self.compression = None  # 新写入文件默认的压缩算法
+        self.save_lock = threading.Lock()  # 保证映像按快照的先后顺序写入
+        self.listeners = []  # 变更通知的回调，参数为本次提交的变更列表
+        self.events = EventBus()  # 按子树订阅的细粒度变更事件，见 watch()
+        self.search_index = SearchIndex(self)  # 首次调用 find() 时建立
+        self.defragmenter = Defragmenter(self)  # 分步进行的碎片整理，见 defragment()
+        self._transaction = None
+        self.metrics = Metrics()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['dentry_cache']
+        del state['save_lock']
+        del state['metrics']
+        del state['events']
+        del state['search_index']
+        del state['defragmenter']
+        del state['lock']
+        del state['inode_locks']
+        del state['_local']
+        state['listeners'] = []
+        state['_transaction'] = None
+        state['journal'] = None  # 日志文件句柄不随快照保存
+        state['snapshot_path'] = None
+        return state
+
+    def __setstate__(self, state):
+        # 兼容旧版本保存的 data_blocks 列表
+        if 'data_blocks' in state:
+            data_blocks = state.pop('data_blocks')
+            store = BlockStore(state['total_blocks'], state['block_size'])
+            for block_index, data in enumerate(data_blocks):
+                if data is not None:
+                    store.write_block(block_index, data)
+            state['block_store'] = store
+        # 旧版本的空闲块集合不可信：复制目录时源和副本共享块却没有引用计数，删除其中一方会把仍被引用的块放回空闲集合，
+        # 因此丢弃该集合，在恢复目录树后按其中的引用重建分配器
+        legacy_allocator = state.pop('free_blocks', None) is not None
+        state.pop('inodes', None)  # 旧版本中只写不读的 inode 字典
+        state.setdefault('lsn', 0)
+        state.setdefault('journal', None)
+        state.setdefault('snapshot_path', None)
+        state.setdefault('checkpoint_bytes', 0)
+        state.setdefault('_image', None)
+        state.setdefault('dedup_index', None)
+        state.setdefault('compression', None)
+        state['dentry_cache'] = DentryCache()
+        state['save_lock'] = threading.Lock()
+        state['metrics'] = Metrics()
+        state['events'] = EventBus()
+        state['search_index'] = SearchIndex(self)
+        state['defragmenter'] = Defragmenter(self)
+        state['lock'] = threading.RLock()
+        state['inode_locks'] = LockTable()
+        state['_local'] = threading.local()
+        if 'current_directory' in state:
+            state['_current_directory'] = state.pop('current_directory')  # 旧版本中当前目录是普通属性
+        state.setdefault('listeners', [])
+        state.setdefault('_transaction', None)
+        self.__dict__.update(state)
+        if legacy_allocator:
+            references = Counter()
+            for inode in self._walk_files(self.root):
+                references.update(_owned_blocks(inode))
+            self.allocator = ExtentAllocator.from_references(self.total_blocks, references)
+        if not hasattr(self.root, 'total_size'):
+            self._recount(self.root)  # 旧版本保存的目录没有汇总值
+
+    @property
+    def current_directory(self):
+        """当前目录：当前线程正在通过会话调用时为会话的当前目录，否则为文件系统自身（默认会话）的当前目录"""
+        session = getattr(self._local, 'session', None)
+        return self._current_directory if session is None else session.current_directory
+
+    @current_directory.setter
+    def current_directory(self, directory):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            self._current_directory = directory
+        else:
+            session.current_directory = directory
+
+    def session(self, path=None):
+        """创建拥有独立当前目录的会话，初始为 path（默认为根目录），供其它线程或后台任务使用，见 Session"""
+        session = Session(self)
+        if path is not None:
+            session.change_directory(path)
+        return session
+
+    @contextmanager
+    def _bound(self, session):
+        """with 块中当前线程的操作使用 session 的当前目录"""
+        local = self._local
+        previous = getattr(local, 'session', None)
+        local.session = session
+        try:
+            yield
+        finally:
+            local.session = previous
 
+    @instrumented("format")
+    @synchronized
     def format(self):
         """格式化文件系统"""
-        self.data_blocks = [None] * self.total_blocks
-        self.free_blocks = set(range(self.total_blocks))
-        self.root = Directory("root", "/root")
+        if self._transaction is not None:
+            raise FileSystemError("Cannot format inside a batch.")
+        with self.inode_locks.writing_all():
+            self.block_store.clear()
+            self.allocator.reset()
+        self.root = Directory("root")
         self.current_directory = self.root
-        self.inodes = {}
+        self.dentry_cache.clear()
+        if self.dedup_index is not None:
+            self.dedup_index = DedupIndex()
+        self._log("format")
+        self._publish(FORMATTED, self.root.location, self.root, None)
 
-    def find_free_blocks(self, num_blocks):
-        """查找空闲块"""
-        if len(self.free_blocks) < num_blocks:
-            return None
-        free_blocks = list(self.free_blocks)[:num_blocks]
-        return free_blocks
+    # 以下操作的路径参数既可以是绝对路径，也可以是相对当前目录的路径，均不会改变当前目录
 
-    def create_directory(self, dir_name):
+    @instrumented("create_directory")
+    @synchronized
+    def create_directory(self, path):
         """创建新目录"""
-        new_dir = Directory(name=dir_name, location=self.get_current_path() + "/" + dir_name, parent=self.current_directory)
-        self.current_directory.add_subdirectory(new_dir)
+        parent, dir_name = self._lookup_parent(path)
+        if parent is None:
+            raise NotFoundError(f"Directory '{os.path.dirname(path)}' not found.")
+        if dir_name in parent.subdirectories:
+            raise AlreadyExistsError(f"Directory '{dir_name}' already exists.")
+        new_dir = Directory(name=dir_name, parent=parent)
+        self._touch(parent)
+        parent.add_subdirectory(new_dir)
+        self._account(parent, directories=1)
+        self._log("mkdir", new_dir.location)
+        self._publish(CREATED, new_dir.location, new_dir, parent)
 
+    @instrumented("change_directory")
+    @synchronized
     def change_directory(self, path):
         """更改当前目录"""
+        directory = self._resolve_directory(path)
+        if directory is None:
+            raise NotFoundError(f"Directory '{path}' not found.")
+        self.current_directory = directory
+        logger.debug("Changed directory to: %s", directory.location)
+
+    def _path_parts(self, path):
+        """将路径规范化为根目录以下的各级名称"""
         if path.startswith("/"):
-            current_dir = self.root
-            path_parts = path.strip("/").split("/")[1:] # 由于/已经进入root目录，首元素root路径应该被舍去
+            parts = []
+            names = path.strip("/").split("/")[1:]  # 由于/已经进入root目录，首元素root路径应该被舍去
         else:
-            current_dir = self.current_directory
-            path_parts = path.split("/")
-
-        for part in path_parts:
-            if part == "..":
-                if current_dir.parent:
-                    current_dir = current_dir.parent
-            elif part == "." or part == "":
-                continue
-            else:
-                next_dir = current_dir.get_subdirectory(part)
-                if next_dir:
-                    current_dir = next_dir
-                else:
-                    print(f"Directory '{part}' not found.")
-                    return
+            parts = self.current_directory.location.split("/")[2:]
+            names = path.split("/")
+        for name in names:
+            if name == "..":
+                if parts:
+                    parts.pop()
+            elif name != "." and name != "":
+                parts.append(name)
+        return parts
+
+    def _parts_path(self, parts):
+        return "/" + "/".join([self.root.name] + parts)
 
-        self.current_directory = current_dir
-        print(f"Changed directory to: {self.get_current_path()}")
+    def _walk_directory(self, parts):
+        """按各级名称查找目录，结果记入目录项缓存"""
+        key = self._parts_path(parts) + "/"
+        directory = self.dentry_cache.lookup(key)
+        if directory is not None:
+            return directory
+        directory = self.root
+        for name in parts:
+            directory = directory.get_subdirectory(name)
+            if directory is None:
+                return None
+        self.dentry_cache.insert(key, directory)
+        return directory
 
+    def _resolve_directory(self, path):
+        """按路径查找目录，不改变当前目录；找不到时返回 None"""
+        return self._walk_directory(self._path_parts(path))
+
+    def _lookup_parent(self, path):
+        """返回 (父目录, 最后一级名称)；父目录不存在时为 None"""
+        parts = self._path_parts(path)
+        if not parts:
+            return None, None
+        return self._walk_directory(parts[:-1]), parts[-1]
+
+    def _lookup_file(self, path):
+        """按路径查找文件，返回 (所在目录, inode)；找不到时 inode 为 None"""
+        parts = self._path_parts(path)
+        if not parts:
+            return None, None
+        key = self._parts_path(parts)
+        inode = self.dentry_cache.lookup(key)
+        if inode is not None:
+            return inode.parent, inode
+        directory = self._walk_directory(parts[:-1])
+        if directory is None:
+            return None, None
+        inode = directory.files.get(parts[-1])
+        if inode is not None:
+            self.dentry_cache.insert(key, inode)
+        return directory, inode
+
+    @synchronized
     def get_current_path(self):
         """获取当前目录路径"""
-        parts = []
-        current_dir = self.current_directory
-        while current_dir:
-            parts.append(current_dir.name)
-            current_dir = current_dir.parent 
-        return "/" + "/".join(reversed(parts))
+        return self.current_directory.location
 
+    @instrumented("list_directory")
+    @synchronized
     def list_directory(self):
         """列出当前目录内容"""
         contents = self.current_directory.list_contents()
         for item in contents:
-            print(item)
+            logger.info("%s", item)
+        return contents
 
-    def allocate_file(self, file_name, file_data, file_type="rw"):
-        """分配文件"""
-        required_blocks = (len(file_data) + self.block_size - 1) // self.block_size
-        free_blocks = self.find_free_blocks(required_blocks)
-        
-        if free_blocks is None:
-            print("Not enough free space to allocate the file.")
-            return
+    def _add_inode(self, directory, file_name, size, blocks, file_type="rw", index_blocks=(), compression=None,
+                   account=True, timestamp=None):
+        """在目录中登记一个已分配好数据块（和索引块）的文件，同名文件被替换并释放其数据块
 
-        inode = Inode(file_name, len(file_data), self.get_current_path() + "/" + file_name)
+        compression 为数据块中内容的压缩算法；account 为 False 时不更新上级目录的汇总值，由调用方统一更新；
+        timestamp 为创建时间，批量创建时传入同一个值，各文件共用一个时间戳对象。
+        """
+        self._touch(directory)
+        replaced = directory.files.get(file_name)
+        if replaced is not None:
+            with self.inode_locks.writing(replaced):
+                self.allocator.release(_owned_blocks(replaced))
+        inode = Inode(file_name, size, timestamp)
         inode.type = file_type  # 设置文件权限
-        for i in range(required_blocks):
-            block_index = free_blocks[i]
-            self.data_blocks[block_index] = file_data[i * self.block_size:(i + 1) * self.block_size]
-            inode.blocks.append(block_index)
-            self.free_blocks.remove(block_index)
-
-        self.current_directory.add_file(inode)
-        inode.parent = self.current_directory
-        print(f"File '{file_name}' allocated with blocks: {inode.blocks}")
-
-    def read_file(self, file_name):
-        """读取文件"""
-        if file_name not in self.current_directory.files:
-            print(f"File '{file_name}' not found.")
+        inode.compression = compression
+        self._assign_blocks(inode, blocks, index_blocks)
+        directory.add_file(inode)
+        inode.parent = directory
+        if account:
+            added_size, added_blocks = self._usage(inode)
+            if replaced is not None:
+                replaced_size, replaced_blocks = self._usage(replaced)
+                self._account(directory, added_size - replaced_size, 0, 0, added_blocks - replaced_blocks)
+            else:
+                self._account(directory, added_size, 1, 0, added_blocks)
+        if replaced is not None:
+            self._publish(DELETED, replaced.location, replaced, directory)
+        return inode
+
+    def _usage(self, inode):
+        """文件的 (字节数, 占用的块数)，块数包括间接索引块"""
+        count = len(inode.blocks)
+        return inode.size, count + index_count(count, self.block_size)
+
+    def _account(self, directory, size=0, files=0, directories=0, blocks=0):
+        """将子树的变化量累加到 directory 及其全部上级目录的汇总值上，耗时只与目录深度有关"""
+        transaction = self._transaction
+        while directory is not None:
+            if transaction is not None:
+                transaction.save_usage(directory)
+            directory.total_size += size
+            directory.file_count += files
+            directory.directory_count += directories
+            directory.block_count += blocks
+            directory = directory.parent
+
+    def _account_file(self, inode, before):
+        """文件的内容改变后，将其字节数和块数相对 before 的变化累加到上级目录"""
+        size, blocks = self._usage(inode)
+        if (size, blocks) != before:
+            self._account(inode.parent, size - before[0], 0, 0, blocks - before[1])
+
+    def _recount(self, directory):
+        """遍历子树重新计算 directory 及其全部子目录的汇总值，用于没有保存汇总值的旧映像"""
+        order = [directory]
+        for node in order:
+            order.extend(node.subdirectories.values())
+        for node in reversed(order):
+            size = blocks = 0
+            for inode in node.files.values():
+                file_size, file_blocks = self._usage(inode)
+                size += file_size
+                blocks += file_blocks
+            files = len(node.files)
+            directories = len(node.subdirectories)
+            for subdirectory in node.subdirectories.values():
+                size += subdirectory.total_size
+                files += subdirectory.file_count
+                directories += subdirectory.directory_count
+                blocks += subdirectory.block_count
+            node.usage = (size, files, directories, blocks)
+
+    @synchronized
+    def disk_usage(self, path):
+        """目录或文件的占用情况，目录为整棵子树的汇总，不需要遍历子树"""
+        directory = self._resolve_directory(path)
+        if directory is not None:
+            size, files, directories, blocks = directory.usage
+        else:
+            _, inode = self._lookup_file(path)
+            if inode is None:
+                raise NotFoundError(f"'{path}' not found.")
+            (size, blocks), files, directories = self._usage(inode), 1, 0
+        return {
+            "size": size,
+            "files": files,
+            "directories": directories,
+            "blocks": blocks,
+            "allocated_bytes": blocks * self.block_size,
+        }
+
+    def max_file_size(self):
+        """单个文件的最大字节数，由块大小和索引级数决定"""
+        return max_blocks(self.block_size) * self.block_size
+
+    def _index_overhead(self, blocks, count):
+        """文件的块号序列由 blocks 增长到 count 个时需要新分配的间接索引块个数；超过单个文件的上限时抛出 FileTooLargeError"""
+        if count <= NDIRECT:
+            return 0
+        if count > max_blocks(self.block_size):
+            raise FileTooLargeError(f"File would exceed the maximum size of {self.max_file_size()} bytes.")
+        used = index_count(len(blocks), self.block_size) if isinstance(blocks, BlockMap) else 0
+        return index_count(count, self.block_size) - used
+
+    def _allocate_index_blocks(self, count):
+        """分配间接索引块；空间不足时返回 None"""
+        if not count:
+            return []
+        index_blocks = self.allocator.allocate(count)
+        if index_blocks is not None and self.dedup_index is not None:
+            # 索引块会被原地改写，不能作为去重的共享对象
+            for block_index in index_blocks:
+                self.dedup_index.discard(block_index)
+        return index_blocks
+
+    def _allocate_data(self, file_data):
+        """为新文件分配数据块和索引块并写入数据，返回 (数据块, 索引块)；空间不足时返回 None 且不做任何修改"""
+        count = (len(file_data) + self.block_size - 1) // self.block_size
+        overhead = self._index_overhead(_NO_BLOCKS, count)
+        if self.dedup_index is not None:
+            blocks = self._dedup_allocate(file_data)
+            if blocks is None:
+                return None
+            index_blocks = self._allocate_index_blocks(overhead)
+            if index_blocks is None:
+                self.allocator.release(blocks)
+                return None
+            return blocks, index_blocks
+        # 数据块和索引块一次性分配，数据块在前以保持连续
+        allocated = self.allocator.allocate(count + overhead)
+        if allocated is None:
             return None
+        self.block_store.write(allocated[:count], file_data)
+        return allocated[:count], allocated[count:]
 
-        inode = self.current_directory.files[file_name]
-        file_data = b""
-        for block_index in inode.blocks:
-            file_data += self.data_blocks[block_index]
-        return file_data[:inode.size]  # Trim to the exact file size
+    def _assign_blocks(self, inode, blocks, index_blocks):
+        """将新分配的数据块（和索引块）设为文件的块号序列，超过 NDIRECT 个块时使用 BlockMap"""
+        if len(blocks) > NDIRECT:
+            inode.blocks = BlockMap(self.block_store)
+            inode.blocks.extend(blocks, index_blocks, self._save_block)
+        else:
+            inode.blocks = _block_list(blocks)
 
-    def write_file(self, file_name, new_data):
-        """写入文件，覆盖原有内容并重新分配内存块"""
-        if file_name not in self.current_directory.files:
-            print(f"File '{file_name}' not found.")
-            return
+    def _set_block(self, inode, i, block_index):
+        """将文件的第 i 个块号改为 block_index"""
+        if isinstance(inode.blocks, BlockMap):
+            inode.blocks.set(i, block_index, self._save_block)
+        else:
+            blocks = array('I', inode.blocks)  # 连续块读出的是 range，改写后重新保存
+            blocks[i] = block_index
+            inode.blocks = blocks
 
-        inode = self.current_directory.files[file_name]
-        if 'r' in inode.type and 'w' not in inode.type:
-            print(f"File '{file_name}' is read-only.")
-            return
+    def _extend_blocks(self, inode, blocks, index_blocks):
+        """在文件末尾追加块号，超过 NDIRECT 个块时改为带间接索引的 BlockMap"""
+        current = inode.blocks
+        if isinstance(current, BlockMap):
+            current.extend(blocks, index_blocks, self._save_block)
+        elif len(current) + len(blocks) <= NDIRECT:
+            inode.blocks = array('I', current) + array('I', blocks)
+        else:
+            block_map = BlockMap(self.block_store)
+            block_map.extend(array('I', current) + array('I', blocks), index_blocks, self._save_block)
+            inode.blocks = block_map
+
+    def _save_block(self, block_index):
+        """原地改写块之前调用：批量操作中保存块的旧内容，以便回滚"""
+        if self._transaction is not None:
+            self._transaction.save_block(self.block_store, block_index)
+
+    @synchronized
+    def set_compression(self, method):
+        """设置新写入文件默认的压缩算法（"zlib"、"lzma" 或 None），已有文件保持原样，直到被整体覆盖写入"""
+        self.compression = check_method(method)
+
+    def _encode(self, data, method):
+        """按 method 压缩文件内容，返回 (写入数据块的内容, 实际使用的算法)；压缩后占用的块数不减少时保存原始内容"""
+        if method is None or not len(data):
+            return data, None
+        packed = compress(data, method)
+        block_size = self.block_size
+        if (len(packed) + block_size - 1) // block_size >= (len(data) + block_size - 1) // block_size:
+            return data, None
+        return packed, method
+
+    def read_content(self, inode, limit=None):
+        """文件的内容，压缩的文件先解压；limit 不为 None 时只返回开头至多 limit 字节"""
+        size = inode.size if limit is None else min(inode.size, limit)
+        if inode.compression is None:
+            return self.block_store.read(inode.blocks, size)  # 按文件大小截断最后一块
+        # 压缩流之后的部分为0，解压到流结束为止
+        stored = self.block_store.read(inode.blocks, len(inode.blocks) * self.block_size)
+        return decompress(stored, inode.compression, size)
+
+    def _replace_content(self, inode, data, method):
+        """将文件内容整体替换为 data：按 method 压缩后写入新分配的块，再释放原来的块；空间不足时返回 False 且不做任何修改"""
+        payload, method = self._encode(data, method)
+        allocated = self._allocate_data(payload)
+        if allocated is None:
+            return False
+        self._touch(inode)
+        released = _owned_blocks(inode)
+        self._assign_blocks(inode, *allocated)
+        self.allocator.release(released)
+        inode.size = len(data)
+        inode.compression = method
+        inode.revise_timestamp = time.time()
+        return True
+
+    def _rewrite_range(self, inode, offset, data):
+        """压缩文件的 _write_range()：压缩流不能按块原地修改，解压后修改再整体重新压缩"""
+        content = bytearray(self.read_content(inode))
+        if offset > len(content):
+            content.extend(bytes(offset - len(content)))
+        content[offset:offset + len(data)] = data
+        return self._replace_content(inode, content, inode.compression)
 
-        # 计算新内容所需的块
-        required_blocks = (len(new_data) + self.block_size - 1) // self.block_size
-        current_blocks = len(inode.blocks)
+    @instrumented("allocate_file")
+    @synchronized
+    def allocate_file(self, path, file_data, file_type="rw", compression=None):
+        """分配文件；compression 为 None 时使用卷的默认压缩算法"""
+        directory, file_name = self._lookup_parent(path)
+        if directory is None:
+            raise NotFoundError(f"Directory '{os.path.dirname(path)}' not found.")
+        payload, method = self._encode(file_data, check_method(compression) or self.compression)
+        allocated = self._allocate_data(payload)
+        if allocated is None:
+            raise NoSpaceError("Not enough free space to allocate the file.")
 
-        # 如果需要更多的块，查找空闲块并分配
-        if required_blocks > current_blocks:
-            additional_blocks = self.find_free_blocks(required_blocks - current_blocks)
-            if additional_blocks is None:
-                print("Not enough free space to extend the file.")
+        self.dentry_cache.discard(directory.location + "/" + file_name)  # 同名文件会被替换
+        free_blocks, index_blocks = allocated
+        inode = self._add_inode(directory, file_name, len(file_data), free_blocks, file_type, index_blocks, method)
+        self._log("create", inode.location, file_data, file_type, method)
+        self._publish(CREATED, inode.location, inode, directory)
+        self.metrics.bytes_written += len(file_data)
+        logger.info("File '%s' allocated.", file_name)
+        logger.debug("File '%s' blocks: %s", file_name, inode.blocks)
+
+    @instrumented("allocate_files")
+    @synchronized
+    def allocate_files(self, directory_path, entries, file_type="rw", compression=None):
+        """批量创建文件：entries 为 (文件名, 数据) 列表，所需的块一次性分配；空间不足时不创建任何文件并抛出 NoSpaceError
+
+        compression 为 None 时使用卷的默认压缩算法。
+        """
+        directory = self._resolve_directory(directory_path)
+        if directory is None:
+            raise NotFoundError(f"Directory '{directory_path}' not found.")
+        method = check_method(compression) or self.compression
+        encoded = [self._encode(file_data, method) for _, file_data in entries]  # (写入的内容, 实际使用的算法)
+        block_size = self.block_size
+        counts = []  # (数据块数, 索引块数)，超过单个文件上限时在分配任何块之前抛出 FileTooLargeError
+        for payload, _ in encoded:
+            count = (len(payload) + block_size - 1) // block_size
+            counts.append((count, self._index_overhead(_NO_BLOCKS, count)))
+        if self.dedup_index is not None:
+            # 去重时每个文件单独查重分配，失败时撤销本批已分配的块
+            allocated = []
+            for payload, _ in encoded:
+                result = self._allocate_data(payload)
+                if result is None:
+                    for blocks, index_blocks in allocated:
+                        self.allocator.release(blocks)
+                        self.allocator.release(index_blocks)
+                    raise NoSpaceError("Not enough free space to allocate the files.")
+                allocated.append(result)
+        else:
+            # 每个文件的数据块之后紧跟它的索引块，全部块一次性分配
+            free_blocks = self.allocator.allocate(sum(count + overhead for count, overhead in counts))
+            if free_blocks is None:
+                raise NoSpaceError("Not enough free space to allocate the files.")
+            allocated = []
+            start = 0
+            for (payload, _), (count, overhead) in zip(encoded, counts):
+                blocks = free_blocks[start:start + count]
+                self.block_store.write(blocks, payload)
+                allocated.append((blocks, free_blocks[start + count:start + count + overhead]))
+                start += count + overhead
+
+        now = time.time()
+        for (file_name, file_data), (blocks, index_blocks), (_, used) in zip(entries, allocated, encoded):
+            self.dentry_cache.discard(directory.location + "/" + file_name)
+            inode = self._add_inode(directory, file_name, len(file_data), blocks, file_type, index_blocks, used,
+                                    timestamp=now)
+            self._log("create", inode.location, file_data, file_type, used)
+            self._publish(CREATED, inode.location, inode, directory)
+        self.metrics.bytes_written += sum(len(file_data) for _, file_data in entries)
+
+    @synchronized
+    def get_directory(self, path):
+        """按路径返回目录，不存在时返回 None"""
+        return self._resolve_directory(path)
+
+    @synchronized
+    def get_file(self, path):
+        """按路径返回文件的 inode，不存在时返回 None"""
+        return self._lookup_file(path)[1]
+
+    @instrumented("find")
+    @synchronized
+    def find(self, pattern="", content=None, limit=None):
+        """在整个卷中按名称（子串或通配符，不区分大小写）和内容中的词查找文件和目录，返回节点列表，见 SearchIndex.find()"""
+        return self.search_index.find(pattern, content, limit)
+
+    @instrumented("open")
+    @synchronized
+    def open(self, path, mode="r"):
+        """打开文件并返回可流式读取的文件句柄"""
+        if mode not in ("r", "rb"):
+            raise ValueError(f"Unsupported mode: {mode}")
+        _, inode = self._lookup_file(path)
+        if inode is None:
+            raise NotFoundError(f"File '{path}' not found.")
+        return FileHandle(self, inode, mode)
+
+    @instrumented("read_file")
+    def read_file(self, path):
+        """读取文件；内容在全局锁之外复制，多个线程可以同时读取，同一文件的写入等待读取结束"""
+        with self.lock:
+            _, inode = self._lookup_file(path)
+            if inode is None:
+                raise NotFoundError(f"File '{path}' not found.")
+            lock = self.inode_locks.acquire_read(inode)
+        try:
+            self.metrics.count_read(inode.size)
+            return self.read_content(inode)
+        finally:
+            lock.release_read()
+
+    @contextmanager
+    def reading(self, inode):
+        """with 块中持有文件的读锁而不持有全局锁，用于按句柄读取；文件已被删除时抛出 NotFoundError
+
+        读锁在全局锁中取得，此时没有写入在进行，块中读到的是某次写入完成后的完整内容。
+        """
+        with self.lock:
+            if not self._attached(inode):
+                raise NotFoundError(f"File '{inode.name}' not found.")
+            lock = self.inode_locks.acquire_read(inode)
+        try:
+            yield inode
+        finally:
+            lock.release_read()
+
+    @instrumented("write_file")
+    @synchronized
+    def write_file(self, path, new_data):
+        """写入文件，覆盖原有内容，只重写内容发生变化的块；文件已压缩或卷设置了默认压缩算法时压缩后整体写入新的块"""
+        _, inode = self._lookup_file(path)
+        if inode is None:
+            raise NotFoundError(f"File '{path}' not found.")
+        if 'r' in inode.type and 'w' not in inode.type:
+            raise PermissionDeniedError(f"File '{path}' is read-only.")
+        with self.inode_locks.writing(inode):
+            # 只追加文件只接受以原内容为前缀的写入，并按追加处理
+            if inode.type == 'a':
+                if len(new_data) < inode.size or not self._has_prefix(inode, new_data):
+                    raise PermissionDeniedError(f"File '{path}' is append-only.")
+                self.append(path, memoryview(new_data)[inode.size:])
                 return
-            inode.blocks.extend(additional_blocks)
-            for block_index in additional_blocks:
-                self.free_blocks.remove(block_index)
-        # 如果需要更少的块，释放多余的块
-        elif required_blocks < current_blocks:
-            for block_index in inode.blocks[required_blocks:]:
-                self.data_blocks[block_index] = None
-                self.free_blocks.add(block_index)
-            inode.blocks = inode.blocks[:required_blocks]
-
-        inode.size = len(new_data)
-        inode.revise_time = datetime.now()  # 更新修改时间
-        for i in range(required_blocks):
+
+            before = self._usage(inode)
+            method = inode.compression or self.compression
+            if method is not None:
+                if not self._replace_content(inode, new_data, method):
+                    raise NoSpaceError("Not enough free space to write the file.")
+                self._finish_write(inode, before, new_data)
+                return
+            data = new_data
+            if len(new_data) < inode.size:
+                # 最后一块中超出新大小的部分一并写为0，截断时只需释放多余的块
+                tail_end = min(inode.size, (len(new_data) + self.block_size - 1) // self.block_size * self.block_size)
+                data = bytes(new_data) + bytes(tail_end - len(new_data))
+            if not self._write_range(inode, 0, data):
+                raise NoSpaceError("Not enough free space to extend the file.")
+            if len(new_data) < inode.size:
+                self._truncate(inode, len(new_data))
+            self._finish_write(inode, before, new_data)
+
+    def _finish_write(self, inode, before, new_data):
+        self._account_file(inode, before)
+        self._log("write", inode.location, new_data)
+        self._publish(WRITTEN, inode.location, inode, inode.parent)
+        self.metrics.bytes_written += len(new_data)
+
+        logger.info("File '%s' written with new data.", inode.location)
+        logger.debug("File '%s' blocks: %s", inode.location, inode.blocks)
+
+    @instrumented("pwrite")
+    @synchronized
+    def pwrite(self, path, offset, data):
+        """从 offset 处写入数据，只修改受影响的块，超出文件末尾时只分配新的尾部块；压缩的文件整体重写"""
+        _, inode = self._lookup_file(path)
+        if inode is None:
+            raise NotFoundError(f"File '{path}' not found.")
+        if 'w' not in inode.type:
+            # 只追加文件只允许在文件末尾写入
+            if inode.type != 'a' or offset != inode.size:
+                raise PermissionDeniedError(f"File '{path}' is {'append-only' if inode.type == 'a' else 'read-only'}.")
+        before = self._usage(inode)
+        write_range = self._write_range if inode.compression is None else self._rewrite_range
+        with self.inode_locks.writing(inode):
+            written = write_range(inode, offset, data)
+        if not written:
+            raise NoSpaceError("Not enough free space to extend the file.")
+        self._account_file(inode, before)
+        self._log("pwrite", inode.location, offset, data)
+        self._publish(WRITTEN, inode.location, inode, inode.parent)
+        self.metrics.bytes_written += len(data)
+        logger.info("File '%s' written %d bytes at offset %d.", path, len(data), offset)
+
+    @instrumented("append")
+    @synchronized
+    def append(self, path, data):
+        """在文件末尾追加数据；未压缩的文件不会因卷的默认压缩算法而改为压缩，追加只写入新的尾部块"""
+        _, inode = self._lookup_file(path)
+        if inode is None:
+            raise NotFoundError(f"File '{path}' not found.")
+        if 'w' not in inode.type and 'a' not in inode.type:
+            raise PermissionDeniedError(f"File '{path}' is read-only.")
+        before = self._usage(inode)
+        write_range = self._write_range if inode.compression is None else self._rewrite_range
+        with self.inode_locks.writing(inode):
+            written = write_range(inode, inode.size, data)
+        if not written:
+            raise NoSpaceError("Not enough free space to extend the file.")
+        self._account_file(inode, before)
+        self._log("append", inode.location, data)
+        self._publish(WRITTEN, inode.location, inode, inode.parent)
+        self.metrics.bytes_written += len(data)
+        logger.info("File '%s' appended with %d bytes.", path, len(data))
+
+    def _write_range(self, inode, offset, data):
+        """将 data 写入文件的 [offset, offset+len(data)) 区间，空间不足时返回 False 且不做任何修改
+
+        块中超出文件大小的部分始终保持为0，因此在文件末尾之后写入时无需补写空洞。
+        与其它文件共享的块在被修改前先复制一份（写时复制）。
+        """
+        self._touch(inode)
+        block_size = self.block_size
+        end = offset + len(data)
+        blocks = inode.blocks
+        old_count = len(blocks)
+        required_blocks = (end + block_size - 1) // block_size
+        first = offset // block_size
+        view = memoryview(data)
+
+        def chunk_of(i):
+            start = max(offset, i * block_size)
+            return view[start - offset:min(end, (i + 1) * block_size) - offset], start - i * block_size
+
+        # 第一遍：找出内容确实发生变化的已有块，内容未变的块不重写；带间接索引时只读取覆盖写入范围的索引块
+        existing = blocks[first:min(required_blocks, old_count)]
+        if isinstance(existing, range):
+            existing = array('I', existing)  # 连续块读出的是 range，下面需要原地替换写时复制的块
+        dirty = []
+        for i, block_index in enumerate(existing, first):
+            chunk, block_offset = chunk_of(i)
+            if self.block_store.read_block(block_index)[block_offset:block_offset + len(chunk)] != chunk:
+                dirty.append(i)
+        shared = [i for i in dirty if self.allocator.refcount(existing[i - first]) > 1]
+
+        # 一次性分配新的尾部块、所需的索引块和写时复制所需的块
+        tail_blocks = []
+        index_blocks = []
+        if required_blocks > old_count:
+            overhead = self._index_overhead(blocks, required_blocks)
+            hint = None
+            if old_count:
+                # 尽量紧接文件末尾分配；末尾的块通常已在 existing 中，无需再查一次索引
+                last = existing[-1] if len(existing) and first + len(existing) == old_count else blocks[-1]
+                hint = last + 1
+            tail_blocks = self.allocator.allocate(required_blocks - old_count, hint)
+            if tail_blocks is None:
+                return False
+            index_blocks = self._allocate_index_blocks(overhead)
+            if index_blocks is None:
+                self.allocator.free(tail_blocks)
+                return False
+        copy_blocks = self.allocator.allocate(len(shared))
+        if copy_blocks is None:
+            self.allocator.free(tail_blocks + index_blocks)
+            return False
+
+        released = []
+        for i, new_block in zip(shared, copy_blocks):
+            old_block = existing[i - first]
+            released.append(old_block)
+            self.block_store.write_block(new_block, self.block_store.read_block(old_block))
+            self._set_block(inode, i, new_block)
+            existing[i - first] = new_block
+        self.allocator.release(released)
+        if tail_blocks:
+            self._extend_blocks(inode, tail_blocks, index_blocks)
+
+        for i in dirty:
+            block_index = existing[i - first]
+            chunk, block_offset = chunk_of(i)
+            self._save_block(block_index)
+            self.block_store.write_into(block_index, block_offset, chunk)
+        for i, block_index in enumerate(tail_blocks, old_count):
+            if i < first:
+                self.block_store.clear_block(block_index)  # 完全落在空洞中的新块
+                continue
+            chunk, block_offset = chunk_of(i)
+            if block_offset:
+                self.block_store.clear_block(block_index)
+                self.block_store.write_into(block_index, block_offset, chunk)
+            else:
+                self.block_store.write_block(block_index, chunk)
+        if self.dedup_index is not None:
+            self._dedup_blocks(inode, dirty + list(range(old_count, required_blocks)))
+
+        inode.size = max(inode.size, end)
+        inode.revise_timestamp = time.time()  # 更新修改时间
+        return True
+
+    @synchronized
+    def enable_dedup(self):
+        """启用块级去重：为已占用的数据块建立内容索引，此后内容相同的块在写入时被共享"""
+        self.dedup_index = DedupIndex()
+        index_blocks = set()
+        for inode in self._walk_files(self.root):
+            if isinstance(inode.blocks, BlockMap):
+                index_blocks.update(inode.blocks.index_blocks())
+        for start, length in self.allocator.used_extents():
+            for block_index in range(start, start + length):
+                if block_index in index_blocks:
+                    continue
+                data = self.block_store.read_block(block_index)
+                digest = self.dedup_index.fingerprint(data)
+                if self.dedup_index.lookup(digest) is None:
+                    self.dedup_index.add(block_index, digest)
+
+    @synchronized
+    def disable_dedup(self):
+        self.dedup_index = None
+
+    def _dedup_find(self, digest, data):
+        """查找内容与 data 相同的已占用块，索引项已过期时将其移除"""
+        block_index = self.dedup_index.lookup(digest)
+        if block_index is None:
+            return None
+        if self.allocator.is_free(block_index) or self.block_store.read_block(block_index) != data:
+            self.dedup_index.discard(block_index)
+            return None
+        return block_index
+
+    def _dedup_allocate(self, file_data):
+        """按块查重后分配：内容已存在的块直接共享，其余块分配新块写入；空间不足时返回 None"""
+        block_size = self.block_size
+        view = memoryview(file_data)
+        count = (len(view) + block_size - 1) // block_size
+        blocks = [None] * count
+        existing = []
+        pending = {}  # 指纹 -> (块内容, 文件中内容相同的块序号)
+        for i in range(count):
+            chunk = bytes(view[i * block_size:(i + 1) * block_size])
+            chunk += bytes(block_size - len(chunk))
+            digest = self.dedup_index.fingerprint(chunk)
+            block_index = self._dedup_find(digest, chunk)
+            if block_index is not None:
+                blocks[i] = block_index
+                existing.append(block_index)
+            elif digest in pending:
+                pending[digest][1].append(i)
+            else:
+                pending[digest] = (chunk, [i])
+
+        fresh = self.allocator.allocate(len(pending))
+        if fresh is None:
+            return None
+        self.allocator.share(existing)
+        for block_index, (digest, (chunk, positions)) in zip(fresh, pending.items()):
+            self.block_store.write_block(block_index, chunk)
+            self.dedup_index.add(block_index, digest)
+            self.allocator.share([block_index] * (len(positions) - 1))
+            for i in positions:
+                blocks[i] = block_index
+        self.dedup_index.hits += count - len(pending)
+        return blocks
+
+    def _dedup_blocks(self, inode, positions):
+        """写入后查重：内容与已有块相同的块改为共享已有块并释放自身"""
+        released = []
+        for i in positions:
             block_index = inode.blocks[i]
-            self.data_blocks[block_index] = new_data[i * self.block_size:(i + 1) * self.block_size]
+            data = self.block_store.read_block(block_index)
+            digest = self.dedup_index.fingerprint(data)
+            existing = self._dedup_find(digest, data)
+            if existing is None:
+                self.dedup_index.add(block_index, digest)
+            elif existing != block_index:
+                self.allocator.share([existing])
+                released.append(block_index)
+                self._set_block(inode, i, existing)
+                self.dedup_index.hits += 1
+        self.allocator.release(released)
 
-        print(f"File '{file_name}' written with new data. Blocks: {inode.blocks}")
-    
-    def delete_file(self, file_name):
-        """删除文件"""
-        if file_name not in self.current_directory.files:
-            print(f"File '{file_name}' not found.")
+    @synchronized
+    def dedup_stats(self):
+        """块共享统计：逻辑块数为各文件引用的块数之和，物理块数为实际占用的块数"""
+        physical = self.total_blocks - self.allocator.free_count
+        logical = physical + sum(count - 1 for count in self.allocator.refcounts.values())
+        return {
+            "enabled": self.dedup_index is not None,
+            "logical_blocks": logical,
+            "physical_blocks": physical,
+            "saved_blocks": logical - physical,
+            "saved_bytes": (logical - physical) * self.block_size,
+            "dedup_ratio": logical / physical if physical else 1.0,
+            "indexed_blocks": len(self.dedup_index) if self.dedup_index is not None else 0,
+            "dedup_hits": self.dedup_index.hits if self.dedup_index is not None else 0,
+        }
+
+    @instrumented("set_file_compression")
+    @synchronized
+    def set_file_compression(self, path, method):
+        """以 method 重新压缩文件（None 表示改为保存原始内容），文件内容和修改时间不变；之后覆盖写入时沿用该算法"""
+        check_method(method)
+        _, inode = self._lookup_file(path)
+        if inode is None:
+            raise NotFoundError(f"File '{path}' not found.")
+        if method == inode.compression:
             return
+        before = self._usage(inode)
+        revise_timestamp = inode.revise_timestamp
+        with self.inode_locks.writing(inode):
+            replaced = self._replace_content(inode, self.read_content(inode), method)
+            inode.revise_timestamp = revise_timestamp
+        if not replaced:
+            raise NoSpaceError("Not enough free space to recompress the file.")
+        self._account_file(inode, before)
+        self._log("compress", inode.location, method)
+        logger.info("File '%s' stored with compression %s.", path, inode.compression)
+
+    @synchronized
+    def compression_stats(self, path=None):
+        """压缩效果：path 为文件时报告该文件，为目录时报告其子树，为 None 时报告整个卷，均不需要遍历子树
+
+        logical_bytes 为文件内容的字节数，physical_bytes 为占用的块（含间接索引块）的字节数，
+        ratio 为两者之比，大于1表示压缩后节省了空间。
+        """
+        method = self.compression
+        if path is None:
+            logical, blocks = self.root.total_size, self.root.block_count
+        else:
+            directory = self._resolve_directory(path)
+            if directory is not None:
+                logical, blocks = directory.total_size, directory.block_count
+            else:
+                _, inode = self._lookup_file(path)
+                if inode is None:
+                    raise NotFoundError(f"'{path}' not found.")
+                (logical, blocks), method = self._usage(inode), inode.compression
+        physical = blocks * self.block_size
+        return {
+            "method": method,
+            "logical_bytes": logical,
+            "physical_bytes": physical,
+            "saved_bytes": logical - physical,
+            "ratio": logical / physical if physical else 1.0,
+        }
+
+    @synchronized
+    def fragmentation_stats(self, path=None):
+        """碎片程度：path 为文件时返回该文件的块数和连续区段数，为目录或 None 时遍历目录子树或整个卷汇总，
+        并附带空闲空间的碎片程度，见 defragmenter.volume_fragmentation()"""
+        if path is None:
+            return volume_fragmentation(self, self.root)
+        directory = self._resolve_directory(path)
+        if directory is not None:
+            return volume_fragmentation(self, directory)
+        _, inode = self._lookup_file(path)
+        if inode is None:
+            raise NotFoundError(f"'{path}' not found.")
+        return file_fragmentation(self, inode)
+
+    @instrumented("defragment")
+    @synchronized
+    def defragment(self, budget=None):
+        """整理碎片至多 budget 秒（None 表示整理完整个卷），整个卷整理完一遍时返回 True；见 Defragmenter.step()
+
+        可以反复以较小的 budget 调用（如由界面的定时器调用），每次之间文件系统照常使用。
+        """
+        if self._transaction is not None:
+            raise FileSystemError("Cannot defragment inside a batch.")
+        done = self.defragmenter.step(budget)
+        if done:
+            defragmenter = self.defragmenter
+            logger.info("Defragmentation pass finished: %d files checked, %d files (%d blocks) moved, %d skipped.",
+                        defragmenter.checked_files, defragmenter.moved_files, defragmenter.moved_blocks,
+                        defragmenter.skipped_files)
+        return done
+
+    @synchronized
+    def stats(self):
+        """返回运行统计的快照：各操作的次数、失败次数和耗时分布，读写字节数，以及分配器、目录项缓存、去重和压缩的状态"""
+        stats = self.metrics.snapshot()
+        stats["allocator"] = self.allocator.stats()
+        stats["dentry_cache"] = {
+            "entries": len(self.dentry_cache),
+            "hits": self.dentry_cache.hits,
+            "misses": self.dentry_cache.misses,
+        }
+        if self.dedup_index is not None:
+            stats["dedup"] = self.dedup_stats()
+        stats["compression"] = self.compression_stats()
+        stats["lsn"] = self.lsn
+        return stats
 
-        inode = self.current_directory.files[file_name]
+    @synchronized
+    def check_consistency(self):
+        """检查分配器与目录树是否一致：遍历整个卷统计每个块被文件引用的次数，与分配器的占用情况和引用计数比较
+
+        返回的各项均为块号列表，全部为空表示一致：leaked_blocks 已占用但没有文件引用（泄漏），
+        free_blocks_in_use 被文件引用却是空闲的（会被重复分配），refcount_mismatches 为 (块号, 引用次数, 引用计数)。
+        """
+        if self._transaction is not None:
+            raise FileSystemError("Cannot check consistency inside a batch.")  # 推迟的释放尚未执行
+        references = Counter()
+        for inode in self._walk_files(self.root):
+            references.update(_owned_blocks(inode))
+        allocator = self.allocator
+        leaked = []
+        for start, length in allocator.used_extents():
+            leaked.extend(block_index for block_index in range(start, start + length) if block_index not in references)
+        free_in_use = []
+        mismatches = []
+        for block_index, count in sorted(references.items()):
+            refcount = allocator.refcount(block_index)
+            if not refcount:
+                free_in_use.append(block_index)
+            elif refcount != count:
+                mismatches.append((block_index, count, refcount))
+        return {
+            "leaked_blocks": leaked,
+            "free_blocks_in_use": free_in_use,
+            "refcount_mismatches": mismatches,
+        }
+
+    def _truncate(self, inode, size):
+        """将文件截断为 size 字节并释放多余的块，调用前最后一块超出 size 的部分须已为0"""
+        self._touch(inode)
+        keep_blocks = (size + self.block_size - 1) // self.block_size
+        blocks = inode.blocks
+        if keep_blocks < len(blocks):
+            released = blocks[keep_blocks:]
+            if isinstance(blocks, BlockMap):
+                released.extend(blocks.truncate(keep_blocks))
+                if keep_blocks <= NDIRECT:
+                    inode.blocks = _block_list(blocks.direct)  # 不再需要间接索引
+            else:
+                inode.blocks = _block_list(blocks[:keep_blocks])
+            self.allocator.release(released)
+        inode.size = size
+        inode.revise_timestamp = time.time()
+
+    def _has_prefix(self, inode, data):
+        """判断 data 是否以文件当前内容开头"""
+        view = memoryview(data)
+        if inode.compression is not None:
+            return view[:inode.size] == self.read_content(inode)
+        pos = 0
         for block_index in inode.blocks:
-            self.data_blocks[block_index] = None
-            self.free_blocks.add(block_index)
+            block_view = self.block_store.read_block(block_index)[:inode.size - pos]
+            if view[pos:pos + len(block_view)] != block_view:
+                return False
+            pos += len(block_view)
+        return True
 
-        self.current_directory.remove_file(file_name)
-        print(f"File '{file_name}' deleted.")
+    @instrumented("delete_file")
+    @synchronized
+    def delete_file(self, path):
+        """删除文件"""
+        directory, inode = self._lookup_file(path)
+        if inode is None:
+            raise NotFoundError(f"File '{path}' not found.")
+
+        self._touch(directory)
+        with self.inode_locks.writing(inode):
+            self.allocator.release(_owned_blocks(inode))
+        file_path = inode.location
+        directory.remove_file(inode.name)
+        size, blocks = self._usage(inode)
+        self._account(directory, -size, -1, 0, -blocks)
+        self.dentry_cache.discard(file_path)
+        self._log("delete_file", file_path)
+        self._publish(DELETED, file_path, inode, directory)
+        logger.info("File '%s' deleted.", path)
 
-    def delete_directory(self, dir_name):
+    @instrumented("delete_directory")
+    @synchronized
+    def delete_directory(self, path):
         """递归删除目录及其内容"""
-        if dir_name not in self.current_directory.subdirectories:
-            print(f"Directory '{dir_name}' not found.")
-            return
+        dir_to_delete = self._resolve_directory(path)
+        if dir_to_delete is None or dir_to_delete.parent is None:
+            raise NotFoundError(f"Directory '{path}' not found.")
 
-        dir_to_delete = self.current_directory.subdirectories[dir_name]
-        self.recursive_delete_directory(dir_to_delete)
-        self.current_directory.remove_subdirectory(dir_name)
-        print(f"Directory '{dir_name}' and its contents deleted.")
+        # 当前目录位于被删除的子树中时退回到被删除目录的父目录
+        node = self.current_directory
+        while node is not None and node is not dir_to_delete:
+            node = node.parent
+        if node is dir_to_delete:
+            self.current_directory = dir_to_delete.parent
 
-    def recursive_delete_directory(self, directory):
-        """递归删除目录中的文件和子目录"""
+        dir_path = dir_to_delete.location
+        size, files, directories, blocks = dir_to_delete.usage
+        freed_blocks = []
+        self.recursive_delete_directory(dir_to_delete, freed_blocks)
+        with self.inode_locks.writing_all():  # 等待子树中文件进行中的读取结束
+            self.allocator.release(freed_blocks)  # 整棵子树的块一次性批量释放
+        parent = dir_to_delete.parent
+        self._touch(parent)
+        parent.remove_subdirectory(dir_to_delete.name)
+        self._account(parent, -size, -files, -directories - 1, -blocks)
+        self.dentry_cache.invalidate(dir_path)
+        self._log("delete_dir", dir_path)
+        self._publish(DELETED, dir_path, dir_to_delete, parent)
+        logger.info("Directory '%s' and its contents deleted.", path)
+
+    def recursive_delete_directory(self, directory, freed_blocks):
+        """递归删除目录中的文件和子目录，被释放的块收集到 freed_blocks 中"""
+        self._touch(directory)
         for file_name in list(directory.files.keys()):
             inode = directory.files[file_name]
-            for block_index in inode.blocks:
-                self.data_blocks[block_index] = None
-                self.free_blocks.add(block_index)
+            freed_blocks.extend(_owned_blocks(inode))
             del directory.files[file_name]
 
         for subdir_name in list(directory.subdirectories.keys()):
-            self.recursive_delete_directory(directory.subdirectories[subdir_name])
+            self.recursive_delete_directory(directory.subdirectories[subdir_name], freed_blocks)
             del directory.subdirectories[subdir_name]
 
+    @instrumented("copy_file")
+    @synchronized
     def copy_file(self, source_path, dest_path):
-        """复制文件"""
-        source_dir, source_file = os.path.split(source_path)
-        dest_dir = dest_path
-        self.change_directory(source_dir)
-        file_data = self.read_file(source_file)
-        if file_data is None:
-            return
-        self.change_directory(dest_dir)
-        new_file_name = source_file if dest_dir != source_dir else self.generate_new_name(source_file, self.current_directory.files)
-        self.allocate_file(new_file_name, file_data)
+        """复制文件：副本与源文件共享数据块，直到其中一方被修改，不改变当前目录"""
+        source_file = os.path.basename(source_path)
+        _, source_inode = self._lookup_file(source_path)
+        if source_inode is None:
+            raise NotFoundError(f"File '{source_path}' not found.")
+        dest_directory = self._resolve_directory(dest_path)
+        if dest_directory is None:
+            raise NotFoundError(f"Directory '{dest_path}' not found.")
+        new_file_name = source_file if source_file not in dest_directory.files else self.generate_new_name(source_file, dest_directory.files)
+        # 数据块与源文件共享，索引块则由副本单独分配
+        index_blocks = self._allocate_index_blocks(self._index_overhead(_NO_BLOCKS, len(source_inode.blocks)))
+        if index_blocks is None:
+            raise NoSpaceError("Not enough free space to copy the file.")
+        blocks = source_inode.blocks[:]
+        self.allocator.share(blocks)
+        inode = self._add_inode(dest_directory, new_file_name, source_inode.size, blocks, source_inode.type, index_blocks,
+                                source_inode.compression)
+        self._log("copy_file", source_inode.location, dest_directory.location)
+        self._publish(CREATED, inode.location, inode, dest_directory)
+        logger.info("File '%s' copied to '%s/%s'.", source_path, dest_directory.location, new_file_name)
     
     def generate_new_name(self, name, existing_names):
         """生成不重名的新名称"""
@@ -261,59 +1429,410 @@ class IndexedFileSystem:
             new_name = f"{base}_copy{count}{ext}"
         return new_name
 
-    def copy_directory(self, source_dir, dest_dir, new_name=None):
-        """复制目录"""
+    @instrumented("copy_directory")
+    @synchronized
+    def copy_directory(self, source_path, dest_path, new_name=None):
+        """复制目录：副本与源目录中的文件共享数据块，不改变当前目录；目标目录不能是源目录本身或其下的目录"""
+        source_dir = self._resolve_directory(source_path)
+        if source_dir is None:
+            raise NotFoundError(f"Directory '{source_path}' not found.")
+        dest_dir = self._resolve_directory(dest_path)
+        if dest_dir is None:
+            raise NotFoundError(f"Directory '{dest_path}' not found.")
+        ancestor = dest_dir
+        while ancestor is not None:
+            if ancestor is source_dir:
+                raise FileSystemError(f"Cannot copy directory '{source_dir.location}' into itself.")
+            ancestor = ancestor.parent
         if new_name is None:
-            new_name = source_dir.name if dest_dir != source_dir.parent else self.generate_new_name(source_dir.name, dest_dir.subdirectories)
-        new_dir = Directory(name=new_name, location=dest_dir.location + "/" + new_name, parent=dest_dir)
+            new_name = source_dir.name if source_dir.name not in dest_dir.subdirectories else self.generate_new_name(source_dir.name, dest_dir.subdirectories)
+        # 副本中的大文件需要各自的索引块，复制前一次性分配，空间不足时不做任何修改
+        overhead = sum(self._index_overhead(_NO_BLOCKS, len(inode.blocks)) for inode in self._walk_files(source_dir))
+        index_blocks = self._allocate_index_blocks(overhead)
+        if index_blocks is None:
+            raise NoSpaceError("Not enough free space to copy the directory.")
+        new_dir = Directory(name=new_name, parent=dest_dir)
+        self._touch(dest_dir)
         dest_dir.add_subdirectory(new_dir)
-        self.recursive_copy_directory(source_dir, new_dir)
+        self.recursive_copy_directory(source_dir, new_dir, iter(index_blocks), new_dir.init_timestamp)
+        # 副本与源目录的汇总值相同，上级目录只需更新一次
+        new_dir.usage = source_dir.usage
+        size, files, directories, blocks = new_dir.usage
+        self._account(dest_dir, size, files, directories + 1, blocks)
+        self._log("copy_dir", source_dir.location, dest_dir.location, new_name)
+        self._publish(CREATED, new_dir.location, new_dir, dest_dir)
+        logger.info("Directory '%s' copied to '%s'.", source_path, new_dir.location)
 
-    def recursive_copy_directory(self, src_dir, dst_dir):
+    def recursive_copy_directory(self, src_dir, dst_dir, index_blocks, timestamp=None):
+        """递归复制目录内容，副本所需的索引块依次从 index_blocks 中取用，副本的创建时间均为 timestamp"""
         for file_name, file_inode in src_dir.files.items():
-            file_data = self.read_file(file_inode.name)
-            new_file_name = file_name
-            new_file_inode = Inode(name=new_file_name, size=file_inode.size, location=dst_dir.location + "/" + new_file_name)
-            new_file_inode.blocks = file_inode.blocks.copy()  # 复制块信息
-            dst_dir.add_file(new_file_inode)
-            self.inodes[new_file_inode.name] = new_file_inode
+            blocks = file_inode.blocks[:]
+            self.allocator.share(blocks)  # 共享数据块，写时再复制
+            own_index = list(islice(index_blocks, index_count(len(blocks), self.block_size))) if len(blocks) > NDIRECT else ()
+            self._add_inode(dst_dir, file_name, file_inode.size, blocks, file_inode.type, own_index, file_inode.compression,
+                            account=False, timestamp=timestamp)
         
         for subdir_name, subdir in src_dir.subdirectories.items():
             new_subdir_name = subdir_name if subdir_name not in dst_dir.subdirectories else self.generate_new_name(subdir_name, dst_dir.subdirectories)
-            new_subdir = Directory(name=new_subdir_name, location=dst_dir.location + "/" + new_subdir_name, parent=dst_dir)
+            new_subdir = Directory(name=new_subdir_name, parent=dst_dir)
             dst_dir.add_subdirectory(new_subdir)
-            self.recursive_copy_directory(subdir, new_subdir)
+            self.recursive_copy_directory(subdir, new_subdir, index_blocks, timestamp)
+            new_subdir.usage = subdir.usage
+
+    def _walk_files(self, directory):
+        """依次返回目录子树中的全部文件"""
+        queue = [directory]
+        for directory in queue:
+            yield from directory.files.values()
+            queue.extend(directory.subdirectories.values())
 
+    @instrumented("move_file")
+    @synchronized
     def move_file(self, source_path, dest_path):
-        """移动文件"""
-        source_dir, source_file = os.path.split(source_path)
+        """移动文件：只修改目录项，数据块保持不动"""
+        source_directory, inode = self._lookup_file(source_path)
+        if inode is None:
+            raise NotFoundError(f"File '{source_path}' not found.")
         dest_dir, dest_file = os.path.split(dest_path)
-        self.change_directory(source_dir)
-        file_data = self.read_file(source_file)
-        if file_data is None:
+        dest_directory = self._resolve_directory(dest_dir) if dest_dir else self.current_directory
+        if dest_directory is None:
+            raise NotFoundError(f"Directory '{dest_dir}' not found.")
+        replaced = dest_directory.files.get(dest_file)
+        if replaced is inode:
             return
-        self.delete_file(source_file)
-        self.change_directory(dest_dir)
-        self.allocate_file(dest_file, file_data)
+        if replaced is not None:
+            with self.inode_locks.writing(replaced):
+                self.allocator.release(_owned_blocks(replaced))  # 目标已存在时覆盖
 
-    def change_file_type(self, file_name, new_type):
+        old_path = inode.location
+        self._touch(source_directory)
+        self._touch(dest_directory)
+        self._touch(inode)
+        source_directory.remove_file(inode.name)
+        inode.name = dest_file
+        dest_directory.add_file(inode)
+        inode.parent = dest_directory
+        if dest_directory is not source_directory:
+            size, blocks = self._usage(inode)
+            self._account(source_directory, -size, -1, 0, -blocks)
+            self._account(dest_directory, size, 1, 0, blocks)
+        if replaced is not None:
+            size, blocks = self._usage(replaced)
+            self._account(dest_directory, -size, -1, 0, -blocks)
+        self.dentry_cache.discard(old_path)
+        self.dentry_cache.discard(inode.location)
+        self._log("move_file", old_path, inode.location)
+        if replaced is not None:
+            self._publish(DELETED, replaced.location, replaced, dest_directory)
+        self._publish(MOVED if dest_directory is not source_directory else RENAMED, inode.location, inode,
+                      dest_directory, old_path, source_directory)
+        logger.info("File '%s' moved to '%s'.", source_path, inode.location)
+
+    @instrumented("change_file_type")
+    @synchronized
+    def change_file_type(self, path, new_type):
         """更改文件权限类型"""
-        if file_name not in self.current_directory.files:
-            print(f"File '{file_name}' not found.")
-            return
-        inode = self.current_directory.files[file_name]
+        _, inode = self._lookup_file(path)
+        if inode is None:
+            raise NotFoundError(f"File '{path}' not found.")
+        self._touch(inode)
         inode.type = new_type
-        inode.revise_time = datetime.now()  # 更新修改时间
-        print(f"File '{file_name}' type changed to {new_type}.")
+        inode.revise_timestamp = time.time()  # 更新修改时间
+        self._log("chtype", inode.location, new_type)
+        self._publish(TYPE_CHANGED, inode.location, inode, inode.parent)
+        logger.info("File '%s' type changed to %s.", path, new_type)
+
+    @instrumented("rename_file")
+    @synchronized
+    def rename_file(self, path, new_name):
+        """重命名文件"""
+        directory, inode = self._lookup_file(path)
+        if inode is None:
+            raise NotFoundError(f"File '{path}' not found.")
+        if new_name in directory.files:
+            raise AlreadyExistsError(f"File '{new_name}' already exists.")
+        old_path = inode.location
+        self._touch(directory)
+        self._touch(inode)
+        directory.files.pop(inode.name)
+        inode.name = new_name
+        directory.add_file(inode)
+        self.dentry_cache.discard(old_path)
+        self._log("rename_file", old_path, new_name)
+        self._publish(RENAMED, inode.location, inode, directory, old_path, directory)
+        logger.info("File '%s' renamed to '%s'.", path, new_name)
 
+    @instrumented("rename_directory")
+    @synchronized
+    def rename_directory(self, path, new_name):
+        """重命名目录"""
+        directory = self._resolve_directory(path)
+        if directory is None or directory.parent is None:
+            raise NotFoundError(f"Directory '{path}' not found.")
+        parent = directory.parent
+        if new_name in parent.subdirectories:
+            raise AlreadyExistsError(f"Directory '{new_name}' already exists.")
+        old_path = directory.location
+        self._touch(parent)
+        self._touch(directory)
+        parent.subdirectories.pop(directory.name)
+        directory.name = new_name
+        parent.add_subdirectory(directory)
+        self.dentry_cache.invalidate(old_path)
+        self._log("rename_dir", old_path, new_name)
+        self._publish(RENAMED, directory.location, directory, parent, old_path, parent)
+        logger.info("Directory '%s' renamed to '%s'.", path, new_name)
+
+    @synchronized
+    def attach_journal(self, journal, snapshot_path, checkpoint_bytes=4 * 1024 * 1024):
+        """启用预写日志：此后每次修改都追加一条日志记录，日志超过 checkpoint_bytes 时自动写检查点"""
+        self.journal = journal
+        self.snapshot_path = snapshot_path
+        self.checkpoint_bytes = checkpoint_bytes
+
+    @synchronized
+    def sync_journal(self):
+        """定期调用：日志中超过成组提交间隔仍未 fsync 的记录立即落盘，见 Journal.sync_due()"""
+        if self.journal is not None:
+            self.journal.sync_due()
+
+    def _log(self, op, *args):
+        """记录一次修改操作，路径参数均为绝对路径；批量操作中的修改在提交时合并记录"""
+        if self._transaction is not None:
+            # 数据参数可能是调用方之后还会修改的缓冲区，提交前先复制
+            args = tuple(bytes(arg) if isinstance(arg, (bytearray, memoryview)) else arg for arg in args)
+            self._transaction.records.append((op,) + args)
+            return
+        self._commit_changes((op,) + args, [(op,) + args])
+
+    def _commit_changes(self, record, changes):
+        self.lsn += 1  # 未启用日志时也计数，后台保存据此判断是否有未保存的修改
+        if self.journal is not None:
+            self.journal.append((self.lsn,) + record)
+            if self.journal.size >= self.checkpoint_bytes:
+                self.checkpoint()
+        for listener in list(self.listeners):
+            listener(changes)
+
+    @synchronized
+    def subscribe(self, listener):
+        """注册变更通知，listener(changes) 在每次修改或每个批量操作提交后调用一次，changes 为 (操作, 参数...) 列表"""
+        self.listeners.append(listener)
+
+    @synchronized
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    @synchronized
+    def watch(self, callback, path=None, recursive=True):
+        """订阅细粒度的变更事件，返回的订阅用于 unwatch()
+
+        callback(events) 的参数为 FileSystemEvent 列表：不在批量操作中时每次修改调用一次，批量操作提交时以合并后的事件调用一次，
+        回滚的批量操作不产生事件。path 为目录（路径或 Directory）时只订阅该子树，recursive 为 False 时只订阅目录本身及其直接子项；
+        订阅跟随目录节点，目录被重命名或移动后仍然有效。callback 在执行修改的线程中、持有全局锁时调用。
+        """
+        directory = path
+        if isinstance(path, str):
+            directory = self._resolve_directory(path)
+            if directory is None:
+                raise NotFoundError(f"Directory '{path}' not found.")
+        return self.events.subscribe(callback, directory, recursive)
+
+    @synchronized
+    def unwatch(self, subscription):
+        self.events.unsubscribe(subscription)
+
+    def _publish(self, kind, path, node, parent, old_path=None, old_parent=None):
+        if not self.events:
+            return  # 没有订阅时不创建事件
+        event = FileSystemEvent(kind, path, node, parent, old_path, old_parent)
+        if self._transaction is not None:
+            self._transaction.events.append(event)
+        else:
+            self.events.publish([event])
+
+    def _attached(self, node):
+        """节点是否仍在以 root 为根的目录树中"""
+        while node is not self.root:
+            parent = node.parent
+            if parent is None:
+                return False
+            entries = parent.subdirectories if isinstance(node, Directory) else parent.files
+            if entries.get(node.name) is not node:
+                return False
+            node = parent
+        return True
+
+    def _touch(self, node):
+        if self._transaction is not None:
+            self._transaction.touch(node)
+
+    @contextmanager
+    def batch(self):
+        """批量操作：with 块中的修改作为一个整体提交，任一操作失败（抛出 FileSystemError）或 with 块抛出异常时全部回滚
+
+        提交时所有修改合并为一条日志记录，并只发出一次变更通知；被释放的块在提交时统一释放。
+        嵌套的批量操作并入最外层。with 块执行期间一直持有全局锁，其它线程的操作（进行中的读取除外）等待其结束。
+        """
+        with self.lock:
+            if self._transaction is not None:
+                yield self
+                return
+            self._transaction = Transaction(self)
+            self.allocator.begin()
+            try:
+                yield self
+            except BaseException:
+                self._rollback()
+                raise
+            self._commit()
+
+    def _commit(self):
+        transaction, self._transaction = self._transaction, None
+        self.allocator.commit()
+        if transaction.records:
+            self._commit_changes(("batch", tuple(transaction.records)), transaction.records)
+        if transaction.events:
+            self.events.publish(coalesce(transaction.events, self._attached, transaction.original))
+
+    def _rollback(self):
+        transaction, self._transaction = self._transaction, None
+        self.allocator.rollback()
+        transaction.restore(self.block_store)
+        self.current_directory = transaction.current_directory
+        self.dentry_cache.clear()
+        _invalidate_paths()  # 名称和父目录已恢复，缓存的路径全部重新计算
+
+    @instrumented("checkpoint")
+    @synchronized
+    def checkpoint(self):
+        """写检查点：原子地保存完整映像后清空日志"""
+        self.save_to_disk(self.snapshot_path)
+        self.journal.reset()
+
+    # 日志操作名与方法名不同的操作，其余操作的方法名与操作名相同
+    _REPLAY_METHODS = {
+        "mkdir": "create_directory",
+        "create": "allocate_file",
+        "write": "write_file",
+        "delete_dir": "delete_directory",
+        "copy_dir": "copy_directory",
+        "rename_dir": "rename_directory",
+        "chtype": "change_file_type",
+        "compress": "set_file_compression",
+    }
+
+    @synchronized
+    def replay_journal(self, journal):
+        """重放日志中序号大于快照的记录"""
+        for record in journal.records():
+            if record[0] <= self.lsn:
+                continue
+            self._apply_record(record)
+            self.lsn = record[0]
+
+    def _apply_record(self, record):
+        op, args = record[1], record[2:]
+        if op == "batch":
+            for change in args[0]:
+                self._apply_record((record[0],) + change)
+        else:
+            getattr(self, self._REPLAY_METHODS.get(op, op))(*args)
+
+    @staticmethod
+    def load_with_journal(snapshot_path, journal_path, size=1024 * 1024, block_size=512, **journal_options):
+        """加载最近的快照并重放日志，返回已启用日志的文件系统；快照不存在时新建文件系统"""
+        try:
+            file_system = IndexedFileSystem.load_from_disk(snapshot_path)
+        except FileNotFoundError:
+            file_system = IndexedFileSystem(size, block_size)
+        journal = Journal(journal_path, **journal_options)
+        file_system.replay_journal(journal)
+        file_system.attach_journal(journal, snapshot_path)
+        return file_system
+
+    @instrumented("save_to_disk")
+    @synchronized
     def save_to_disk(self, filename):
-        """保存文件系统到磁盘"""
-        with open(filename, 'wb') as f:
-            pickle.dump(self, f)
+        """将文件系统保存为原生映像，写入临时文件后原子替换"""
+        with self.save_lock:  # 等待进行中的后台保存完成，避免较旧的快照覆盖本次保存
+            temp_path = diskImage.write_image(self, filename)
+            try:
+                os.replace(temp_path, filename)
+            except PermissionError:
+                # Windows 下无法替换仍被映射的文件：解码全部目录、将数据复制到内存后解除映射再替换
+                self._release_image()
+                os.replace(temp_path, filename)
+
+    def _release_image(self):
+        if self._image is not None:
+            # 关闭映像前解码全部尚未读取的目录，之后它们不能再从映像中读取
+            queue = [self.root]
+            for directory in queue:
+                queue.extend(directory.subdirectories.values())
+        self.block_store.detach()
+        if self._image is not None:
+            self._image.close()
+            self._image = None
 
     @staticmethod
     def load_from_disk(filename):
-        """从磁盘加载文件系统"""
-        with open(filename, 'rb') as f:
-            return pickle.load(f)
+        """从磁盘加载文件系统：原生映像只映射文件并按需解码目录，旧版 pickle 文件整体加载"""
+        if not diskImage.is_image(filename):
+            with open(filename, 'rb') as f:
+                return pickle.load(f)
+
+        image = diskImage.ImageReader(filename)
+        # 数据区以写时复制方式映射，修改只保存在内存中，直到下次保存映像
+        block_store = BlockStore(image.total_blocks, image.block_size, filename, image.data_offset, mmap.ACCESS_COPY)
+        allocator = ExtentAllocator.from_state(image.total_blocks, *image.allocator_state())
+        _, _, _, name, _, init_time, _, list_off, list_len, _ = image.inode(0)
+        root = Directory(name)
+        root.init_timestamp = init_time
+        usage = image.usage(0)
 
+        file_system = IndexedFileSystem.__new__(IndexedFileSystem)
+        file_system._setup(image.size, image.block_size, block_store, allocator, root, image.lsn)
+        file_system._image = image
+        root._loader = partial(file_system._load_directory, list_off=list_off, list_len=list_len)
+        if usage is not None:
+            root.usage = usage
+        else:
+            file_system._recount(root)  # 旧映像没有保存汇总值，加载时解码全部目录计算一次
+        return file_system
+
+    def _undecoded_children(self, node):
+        """尚未从映像中解码的目录返回其子项列表在映像中的 (偏移, 长度)，其它节点返回 None"""
+        loader = getattr(node, '_loader', None)
+        if loader is None:
+            return None
+        return loader.keywords['list_off'], loader.keywords['list_len']
+
+    def _load_directory(self, directory, list_off, list_len):
+        """从映像中解码目录的直接子项，子目录的内容留到首次访问时再解码"""
+        timestamps = {}  # 同一目录中相同的时间戳（批量创建、从未修改过的文件）共用一个对象
+        for ino in self._image.children(list_off, list_len):
+            kind, file_type, _, name, size, init_time, revise_time, child_off, child_len, compression = \
+                self._image.inode(ino)
+            init_time = timestamps.setdefault(init_time, init_time)
+            revise_time = timestamps.setdefault(revise_time, revise_time)
+            if kind == diskImage.KIND_DIRECTORY:
+                subdirectory = Directory(name, parent=directory)
+                subdirectory.init_timestamp = init_time
+                usage = self._image.usage(ino)
+                if usage is not None:
+                    subdirectory.usage = usage
+                subdirectory._loader = partial(self._load_directory, list_off=child_off, list_len=child_len)
+                directory._subdirectories[name] = subdirectory
+            else:
+                inode = Inode(name, size)
+                inode.init_timestamp = init_time
+                inode.revise_timestamp = revise_time
+                inode.type = file_type
+                inode.compression = compression
+                if kind == diskImage.KIND_INDEXED_FILE:
+                    inode.blocks = self._image.block_map(self.block_store, child_off, child_len)
+                else:
+                    inode.blocks = _block_list(self._image.blocks(child_off, child_len))
+                inode.parent = directory
+                directory._files[name] = inode
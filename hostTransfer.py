@@ -0,0 +1,193 @@
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from errors import NotFoundError, NoSpaceError
+
+
+def _read_host_file(host_path):
+    with open(host_path, 'rb') as f:
+        return f.read()
+
+
+def _write_host_file(host_path, data, mtime):
+    with open(host_path, 'wb') as f:
+        f.write(data)
+    os.utime(host_path, (mtime, mtime))
+    return len(data)
+
+
+def _bounded_map(pool, func, items, window):
+    """按顺序返回 (item, future)，同时在途的任务不超过 window 个，避免一次性读入全部数据"""
+    pending = deque()
+    items = iter(items)
+    for item in items:
+        pending.append((item, pool.submit(func, *item[-1])))
+        if len(pending) >= window:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+def import_tree(file_system, host_dir, dest_path, workers=8, batch_files=256, batch_bytes=8 * 1024 * 1024,
+                progress=None):
+    """将主机目录树导入到文件系统的 dest_path 目录下
+
+    主机文件由线程池并行读取，同一目录下的文件攒成一批后一次性分配数据块。
+    progress(已完成文件数, 文件总数, 已导入字节数) 在每批写入后调用。
+    返回 (导入的文件数, 导入的字节数, 跳过的文件列表 [(主机路径, 异常)])；空间不足时提前停止。
+    dest_path 不存在时抛出 NotFoundError。
+    """
+    dest = file_system.get_directory(dest_path)
+    if dest is None:
+        raise NotFoundError(f"Directory '{dest_path}' not found.")
+
+    # 在调用线程中创建目录结构并收集待导入的文件
+    files = []  # (目标目录路径, 文件名, (主机路径,))
+    for root, dirs, names in os.walk(host_dir):
+        dirs.sort()
+        relative = os.path.relpath(root, host_dir)
+        target = dest.location
+        if relative != ".":
+            target += "/" + relative.replace(os.sep, "/")
+            if file_system.get_directory(target) is None:
+                file_system.create_directory(target)
+        for name in sorted(names):
+            files.append((target, name, (os.path.join(root, name),)))
+
+    total = len(files)
+    done = imported_bytes = 0
+    skipped = []
+    batch = []
+    batch_dir = None
+    batch_size = 0
+
+    def flush():
+        nonlocal done, imported_bytes, batch, batch_size
+        try:
+            file_system.allocate_files(batch_dir, batch)
+        except NoSpaceError:
+            return False
+        done += len(batch)
+        imported_bytes += batch_size
+        batch = []
+        batch_size = 0
+        if progress is not None:
+            progress(done, total, imported_bytes)
+        return True
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for (target, name, (host_path,)), future in _bounded_map(pool, _read_host_file, files, workers * 4):
+            try:
+                data = future.result()
+            except OSError as e:
+                skipped.append((host_path, e))
+                continue
+            if batch and (target != batch_dir or len(batch) >= batch_files or batch_size >= batch_bytes):
+                if not flush():
+                    break
+            batch_dir = target
+            batch.append((name, data))
+            batch_size += len(data)
+        else:
+            if batch:
+                flush()
+    return done, imported_bytes, skipped
+
+
+def export_tree(file_system, src_path, host_dir, workers=8, progress=None):
+    """将文件系统中 src_path 目录下的整棵子树导出到主机目录 host_dir
+
+    子树在文件系统的全局锁中一次性遍历，其它线程可以同时修改文件系统；文件内容在调用线程中持有各文件的读锁读出，
+    由线程池并行写入主机文件，主机文件的修改时间取自 inode。遍历之后被删除的文件计入跳过的文件。
+    progress(已完成文件数, 文件总数, 已导出字节数) 在每个文件写入后调用。
+    返回 (导出的文件数, 导出的字节数, 跳过的文件列表 [(主机路径, 异常)])；src_path 不存在时抛出 NotFoundError。
+    """
+    inodes = []  # (主机路径, inode)
+    host_dirs = []
+    with file_system.lock:
+        source = file_system.get_directory(src_path)
+        if source is None:
+            raise NotFoundError(f"Directory '{src_path}' not found.")
+        queue = [(source, host_dir)]
+        for directory, host_path in queue:
+            host_dirs.append(host_path)
+            for name, inode in sorted(directory.files.items()):
+                inodes.append((os.path.join(host_path, name), inode))
+            for name, subdirectory in sorted(directory.subdirectories.items()):
+                queue.append((subdirectory, os.path.join(host_path, name)))
+    for host_path in host_dirs:  # 主机上的目录在全局锁之外创建
+        os.makedirs(host_path, exist_ok=True)
+
+    skipped = []
+
+    def contents():
+        for host_path, inode in inodes:
+            try:
+                with file_system.reading(inode):
+                    data = file_system.read_content(inode)
+                    mtime = inode.revise_timestamp
+            except NotFoundError as e:
+                skipped.append((host_path, e))
+                continue
+            yield host_path, (host_path, data, mtime)
+
+    total = len(inodes)
+    done = exported_bytes = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for (host_path, _), future in _bounded_map(pool, _write_host_file, contents(), workers * 4):
+            try:
+                exported_bytes += future.result()
+                done += 1
+            except OSError as e:
+                skipped.append((host_path, e))
+            if progress is not None:
+                progress(done, total, exported_bytes)
+    return done, exported_bytes, skipped
+
+
+def _print_progress(done, total, transferred):
+    print(f"\r{done}/{total} files, {transferred / (1024 * 1024):.1f} MiB", end="", flush=True)
+
+
+if __name__ == '__main__':
+    # python hostTransfer.py import filesystem.img ./data --dest /root
+    # python hostTransfer.py export filesystem.img /root ./backup
+    from fileManagement import IndexedFileSystem
+
+    parser = argparse.ArgumentParser(description="Bulk import/export between the host and a file system image")
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("image")
+    parser.add_argument("source")
+    parser.add_argument("target", nargs="?", default="/root")
+    parser.add_argument("--journal", help="journal path (default: image path with .journal suffix)")
+    parser.add_argument("--size", type=int, default=1024 * 1024, help="volume size when creating a new image")
+    parser.add_argument("--block-size", type=int, default=512)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    journal_path = args.journal or os.path.splitext(args.image)[0] + ".journal"
+    file_system = IndexedFileSystem.load_with_journal(args.image, journal_path, args.size, args.block_size)
+    start = time.monotonic()
+    try:
+        if args.command == "import":
+            # 批量导入不逐条写日志，完成后直接写检查点；中途退出时映像和日志均保持导入前的状态
+            journal, file_system.journal = file_system.journal, None
+            try:
+                count, size, skipped = import_tree(file_system, args.source, args.target, args.workers,
+                                                   progress=_print_progress)
+            finally:
+                file_system.journal = journal
+            file_system.checkpoint()
+        else:
+            count, size, skipped = export_tree(file_system, args.source, args.target, args.workers,
+                                               progress=_print_progress)
+    except NotFoundError as e:
+        sys.exit(str(e))
+    finally:
+        file_system.journal.close()
+    print(f"\n{args.command.capitalize()}ed {count} files ({size} bytes) in {time.monotonic() - start:.2f}s.")
+    for host_path, error in skipped:
+        print(f"Skipped '{host_path}': {error}", file=sys.stderr)
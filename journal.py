@@ -0,0 +1,135 @@
+import marshal
+import os
+import struct
+import time
+import zlib
+
+DURABILITY_ALWAYS = "always"  # 每条记录写入后立即 fsync
+DURABILITY_GROUP = "group"  # 每条记录立即写入文件，攒够一组记录或超过时间间隔后统一 fsync
+DURABILITY_NONE = "none"  # 只写入操作系统缓存，不主动 fsync
+
+_MAGIC = b"IFSJRNL1"
+_FRAME = struct.Struct("<II")  # 记录长度, crc32
+
+
+class Journal:
+    """预写日志：每次修改以一条紧凑记录追加到日志文件末尾
+
+    记录为 marshal 编码的元组，帧头包含长度和校验和，重放时遇到不完整或损坏的尾部记录即停止。
+    每条记录都在 append() 返回前写入操作系统，进程异常退出不会丢失；持久化级别只决定何时 fsync，
+    即操作系统崩溃或断电时可能丢失多少条最近的记录。
+    """
+
+    def __init__(self, path, durability=DURABILITY_GROUP, group_size=64, group_interval=0.5):
+        if durability not in (DURABILITY_ALWAYS, DURABILITY_GROUP, DURABILITY_NONE):
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self.path = path
+        self.durability = durability
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self._unsynced = 0  # 已写入文件但尚未 fsync 的记录数
+        self._unsynced_since = None
+        self._file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        self._file.seek(0)
+        if self._file.read(len(_MAGIC)) != _MAGIC:
+            self._file.seek(0)
+            self._file.truncate()
+            self._file.write(_MAGIC)
+        # 丢弃崩溃时写了一半的尾部记录，新记录从最后一条完整记录之后开始写
+        for _ in self._scan():
+            pass
+        self._file.truncate()
+        self.size = self._file.tell()
+
+    def _scan(self):
+        self._file.seek(len(_MAGIC))
+        while True:
+            offset = self._file.tell()
+            header = self._file.read(_FRAME.size)
+            if len(header) < _FRAME.size:
+                break
+            length, crc = _FRAME.unpack(header)
+            payload = self._file.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            yield marshal.loads(payload)
+        self._file.seek(offset)
+
+    def records(self):
+        """依次返回日志中的所有完整记录"""
+        yield from self._scan()
+
+    def append(self, record):
+        """追加一条记录：立即写入日志文件，按持久化级别决定何时 fsync"""
+        frame = _frame(record)
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(frame)
+        self._file.flush()
+        self.size += len(frame)
+        if self.durability == DURABILITY_ALWAYS:
+            self.commit()
+        elif self.durability == DURABILITY_GROUP:
+            now = time.monotonic()
+            if self._unsynced_since is None:
+                self._unsynced_since = now
+            self._unsynced += 1
+            if self._unsynced >= self.group_size or now - self._unsynced_since >= self.group_interval:
+                self.commit()
+
+    def sync_due(self):
+        """定期调用：成组提交时，最早一条尚未 fsync 的记录已超过时间间隔则立即 fsync，空闲时最近的记录也能按时落盘"""
+        if self._unsynced and time.monotonic() - self._unsynced_since >= self.group_interval:
+            self.commit()
+
+    def commit(self):
+        """按持久化级别将已写入的记录落盘"""
+        self._file.flush()
+        if self.durability != DURABILITY_NONE:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._unsynced_since = None
+
+    def reset(self):
+        """检查点完成后清空日志"""
+        self._unsynced = 0
+        self._unsynced_since = None
+        self._file.seek(len(_MAGIC))
+        self._file.truncate()
+        self._file.flush()
+        if self.durability != DURABILITY_NONE:
+            os.fsync(self._file.fileno())
+        self.size = len(_MAGIC)
+
+    def discard_through(self, lsn):
+        """丢弃序号不大于 lsn 的记录（已包含在快照中），保留快照之后追加的记录"""
+        kept = [_frame(record) for record in self.records() if record[0] > lsn]
+        if not kept:
+            self.reset()
+            return
+        # 剩余记录写入新文件后原子替换，替换前崩溃时旧日志仍然完整
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(_MAGIC)
+            f.write(b"".join(kept))
+            f.flush()
+            if self.durability != DURABILITY_NONE:
+                os.fsync(f.fileno())
+        self._file.close()
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, 'r+b')
+        self._file.seek(0, os.SEEK_END)
+        self.size = self._file.tell()
+        self._unsynced = 0  # 保留的记录已随新文件落盘
+        self._unsynced_since = None
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.commit()
+        self._file.close()
+
+
+def _frame(record):
+    """编码一条记录：帧头（长度, crc32）加 marshal 编码的记录"""
+    payload = marshal.dumps(record)
+    return _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
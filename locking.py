@@ -0,0 +1,116 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+STRIPES = 64  # 锁表中读写锁的个数
+
+
+class RWLock:
+    """读写锁：多个读者可以同时持有，写者独占；有写者在等待时新的读者不再进入，写者不会被持续的读取饿死
+
+    持有写锁的线程可以再次取得写锁或读锁（计入同一次持有）；持有读锁的线程不能升级为写锁。
+    """
+
+    __slots__ = ('_condition', '_readers', '_writer', '_depth', '_waiting')
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None  # 持有写锁的线程
+        self._depth = 0  # 写锁持有者重入的次数
+        self._waiting = 0  # 等待写锁的线程数
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._depth += 1
+                return
+            while self._writer is not None or self._waiting:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._condition:
+            if self._writer == threading.get_ident():
+                self._release_write()
+                return
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._depth += 1
+                return
+            self._waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting -= 1
+            self._writer = me
+            self._depth = 1
+
+    def release_write(self):
+        with self._condition:
+            self._release_write()
+
+    def _release_write(self):
+        if self._writer != threading.get_ident():
+            raise RuntimeError("Cannot release a write lock held by another thread.")
+        self._depth -= 1
+        if not self._depth:
+            self._writer = None
+            self._condition.notify_all()
+
+
+class LockTable:
+    """节点的读写锁：节点按 hash 映射到固定个数的锁上，不为每个 inode 单独创建锁，百万级文件时不额外占用内存
+
+    映射到同一把锁上的不同文件会互相等待，但不会死锁：写锁只在持有文件系统全局锁时取得，同一时刻只有一个写者。
+    """
+
+    def __init__(self, size=STRIPES):
+        self._locks = [RWLock() for _ in range(size)]
+
+    def lock_for(self, node):
+        return self._locks[hash(node) % len(self._locks)]
+
+    def acquire_read(self, node):
+        """取得节点的读锁并返回该锁，由调用方 release_read()"""
+        lock = self.lock_for(node)
+        lock.acquire_read()
+        return lock
+
+    @contextmanager
+    def writing(self, node):
+        """持有节点的写锁，等待进行中的读取结束"""
+        lock = self.lock_for(node)
+        lock.acquire_write()
+        try:
+            yield
+        finally:
+            lock.release_write()
+
+    @contextmanager
+    def writing_all(self):
+        """持有全部写锁，用于删除目录和格式化等一次影响大量文件的操作"""
+        for lock in self._locks:
+            lock.acquire_write()
+        try:
+            yield
+        finally:
+            for lock in reversed(self._locks):
+                lock.release_write()
+
+
+def synchronized(func):
+    """在文件系统的全局锁 self.lock 中执行方法"""
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return func(self, *args, **kwargs)
+    return wrapper
@@ -1,13 +1,23 @@
 import sys
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QLineEdit, QPushButton,
-                             QTreeWidget, QTreeWidgetItem, QMenu, QAction, QSplitter, QInputDialog,
-                             QGridLayout, QLabel, QScrollArea, QFrame, QDialog, QFormLayout, QToolButton, QPlainTextEdit,QMessageBox)
-from PyQt5.QtCore import Qt, QSize
-from PyQt5.QtGui import QPixmap, QFontDatabase, QFont,QIcon
+                             QTreeView, QMenu, QAction, QSplitter, QInputDialog,
+                             QLabel, QDialog, QFormLayout, QToolButton, QPlainTextEdit,QMessageBox, QCheckBox,
+                             QListWidget, QListWidgetItem)
+from PyQt5.QtCore import Qt, QSize, QTimer, QItemSelection, QItemSelectionModel, pyqtSignal
+from PyQt5.QtGui import QFontDatabase, QFont,QIcon
 from fileManagement import Inode, Directory, IndexedFileSystem
+from errors import FileSystemError
+from journal import Journal, DURABILITY_GROUP
+from backgroundSaver import BackgroundSaver
+from directoryTreeModel import DirectoryTreeModel
+from fileGrid import FileGridView, FileListModel
 import pickle
 
+import codecs
+import logging
 import os
+import struct
+import time
 
 def get_resource_path(relative_path):
     """获取资源文件的绝对路径，考虑 PyInstaller 打包后的情况"""
@@ -24,42 +34,76 @@ file_path = get_resource_path("file.png")
 dir_path = get_resource_path("dir.png")
 filesystem_path = get_resource_path("filesystem.pkl")
 
-# 确保在使用这些路径时正确处理
+VOLUME_SIZE = 1024 * 1024  # 新建卷的大小（字节）
+BLOCK_SIZE = 512  # 新建卷的块大小（字节），单个文件的最大大小随块大小的三次方增长
+# 新写入文件默认的压缩算法：zlib / lzma / None（不压缩）。压缩的文件每次保存或追加都要整体解压后重新压缩写入，
+# 不能只改写变化的块，因此默认不压缩，由右键菜单为单个文件或整个卷开启
+COMPRESSION = None
+JOURNAL_DURABILITY = DURABILITY_GROUP  # 日志持久化级别：always / group / none
+AUTOSAVE_INTERVAL = 30.0  # 有未保存的修改时，自动保存的最长间隔（秒）
+AUTOSAVE_DIRTY_OPS = 256  # 未保存的修改次数达到该值时立即自动保存
+AUTOSAVE_POLL_MS = 500  # 检查是否需要自动保存和日志落盘的周期（毫秒）
+DEFRAG_STEP_SECONDS = 0.01  # 碎片整理每一步的时间预算（秒），步与步之间界面照常响应
+DEFRAG_POLL_MS = 20  # 碎片整理两步之间的间隔（毫秒）
+SEARCH_LIMIT = 500  # 搜索结果最多显示的项数
+LOG_LEVEL = logging.INFO  # 文件系统操作的提示信息输出到控制台，设为 logging.WARNING 即可关闭
 
-class CustomFileView(QWidget):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.parent = parent
-        self.setLayout(QGridLayout())
-        self.setContextMenuPolicy(Qt.CustomContextMenu)
-
-    def mousePressEvent(self, event):
-        if event.button() == Qt.LeftButton:
-            if self.parent.selected_frame:
-                self.parent.selected_frame.setStyleSheet("")
-                self.parent.selected_frame = None
-        elif event.button() == Qt.RightButton:
-            if self.parent.selected_frame:
-                self.parent.selected_frame.setStyleSheet("")
-                self.parent.selected_frame = None
-            self.parent.show_context_menu(event.globalPos())
+# 确保在使用这些路径时正确处理
 
 class FileManagementSystem(QMainWindow):
+    save_progress = pyqtSignal(int, int)  # 后台保存的进度，从工作线程发出
+
     def __init__(self):
         super().__init__()
-        self.selected_frame = None
         self.initUI()
-        self.file_system_path = "filesystem.pkl"  # 保存文件系统的路径
-        
-        # 尝试加载文件系统
+        self.file_system_path = "filesystem.img"  # 保存文件系统映像的路径
+        self.legacy_file_system_path = "filesystem.pkl"  # 旧版本保存的 pickle 文件
+        self.journal_path = "filesystem.journal"  # 预写日志的路径
+
+        # 首次启动时将旧版 pickle 文件一次性转换为原生映像
+        if not os.path.exists(self.file_system_path) and os.path.exists(self.legacy_file_system_path):
+            legacy = IndexedFileSystem.load_from_disk(self.legacy_file_system_path)
+            problems = legacy.check_consistency()
+            if any(problems.values()):
+                # 不把不一致的分配状态写入映像，保留旧文件，下次启动时重新转换
+                print("旧版文件系统的块分配不一致，未转换:", {key: len(value) for key, value in problems.items()})
+            else:
+                legacy.save_to_disk(self.file_system_path)
+                print("已将旧版文件系统转换为映像格式")
+        
+        # 尝试加载文件系统快照并重放日志
         try:
-            self.file_system = IndexedFileSystem.load_from_disk(self.file_system_path)
+            self.file_system = IndexedFileSystem.load_with_journal(self.file_system_path, self.journal_path, VOLUME_SIZE, BLOCK_SIZE, durability=JOURNAL_DURABILITY)
             print("文件系统加载成功")
-        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        except (EOFError, ValueError, struct.error, pickle.UnpicklingError):
             print("加载文件系统失败，初始化新文件系统")
-            self.file_system = IndexedFileSystem(1024 * 1024, 512)  # 初始化文件系统
+            self.file_system = IndexedFileSystem(VOLUME_SIZE, BLOCK_SIZE)  # 初始化文件系统
             self.file_system.format()
-        
+            journal = Journal(self.journal_path, durability=JOURNAL_DURABILITY)
+            journal.reset()  # 旧日志无法应用到新文件系统上
+            self.file_system.attach_journal(journal, self.file_system_path)
+        self.file_system.set_compression(COMPRESSION)  # 运行时设置，不保存在映像中
+        
+        # 后台自动保存：快照在 GUI 线程中取得，写盘在工作线程中进行
+        self.save_progress.connect(self.on_save_progress)
+        self.saver = BackgroundSaver(self.file_system, self.file_system_path, AUTOSAVE_INTERVAL, AUTOSAVE_DIRTY_OPS,
+                                     on_progress=self.save_progress.emit, on_finished=self.on_save_finished)
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.timeout.connect(self.poll_persistence)
+        self.autosave_timer.start(AUTOSAVE_POLL_MS)
+        self.defrag_timer = QTimer(self)
+        self.defrag_timer.timeout.connect(self.defragment_step)
+
+        # 文件系统每次修改（或每个批量操作）通知一次，同一轮事件循环内的多次通知只刷新一次视图
+        self.refresh_pending = False
+        self.file_system.subscribe(self.on_file_system_changed)
+
+        # 目录树和文件视图各自订阅变更事件，修改后只更新受影响的行
+        self.tree_model = DirectoryTreeModel(self.file_system, self)
+        self.tree_view.setModel(self.tree_model)
+        self.file_model = FileListModel(self.file_system, dir_path, file_path, self)
+        self.file_view.setModel(self.file_model)
+
         self.update_tree_view()
         self.update_file_view()
         self.path_edit.setText('/root')  # 初始化路径为/root
@@ -100,6 +144,18 @@ class FileManagementSystem(QMainWindow):
         self.path_edit.returnPressed.connect(self.change_directory)
         self.path_edit.setFont(font_english)
         path_layout.addWidget(self.path_edit)
+
+        # 全卷搜索：按名称（子串或通配符）查找，勾选 Content 时按文件内容中的词查找
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText('Search')
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.returnPressed.connect(self.search)
+        self.search_edit.setFont(font_english)
+        path_layout.addWidget(self.search_edit)
+
+        self.content_check = QCheckBox('Content')
+        self.content_check.setFont(font_english)
+        path_layout.addWidget(self.content_check)
         
         main_layout.addLayout(path_layout)
         
@@ -140,6 +196,11 @@ class FileManagementSystem(QMainWindow):
         format_button.setFont(font_english)
         operation_layout.addWidget(format_button)
 
+        defrag_button = QPushButton('Defrag')
+        defrag_button.clicked.connect(self.defragment)
+        defrag_button.setFont(font_english)
+        operation_layout.addWidget(defrag_button)
+
         details_button = QPushButton('Details')
         details_button.clicked.connect(self.show_properties)
         details_button.setFont(font_english)
@@ -150,19 +211,18 @@ class FileManagementSystem(QMainWindow):
         # 目录树和文件视图
         splitter = QSplitter(Qt.Horizontal)
         
-        self.tree_view = QTreeWidget()
-        self.tree_view.setHeaderLabel('快速访问')
+        self.tree_view = QTreeView()  # 模型在文件系统加载后设置
         self.tree_view.setContextMenuPolicy(Qt.CustomContextMenu)
         self.tree_view.customContextMenuRequested.connect(self.show_tree_context_menu)
-        self.tree_view.itemDoubleClicked.connect(self.tree_item_double_clicked)
+        self.tree_view.doubleClicked.connect(self.tree_item_double_clicked)
         self.tree_view.setFont(font_english)
         splitter.addWidget(self.tree_view)
         
-        self.file_view = CustomFileView(self)  # 使用自定义的 CustomFileView 类
-        scroll_area = QScrollArea()
-        scroll_area.setWidgetResizable(True)
-        scroll_area.setWidget(self.file_view)
-        splitter.addWidget(scroll_area)
+        self.file_view = FileGridView()  # 模型在文件系统加载后设置
+        self.file_view.customContextMenuRequested.connect(
+            lambda pos: self.show_context_menu(self.file_view.viewport().mapToGlobal(pos)))
+        self.file_view.doubleClicked.connect(self.file_item_double_clicked)
+        splitter.addWidget(self.file_view)
         
         splitter.setSizes([300, 700])  # 设置左右比例为3:7
         
@@ -175,9 +235,54 @@ class FileManagementSystem(QMainWindow):
 
         self.show()
 
+    def poll_persistence(self):
+        """定时调用：按需触发后台保存，并使空闲时成组提交的日志记录按时落盘"""
+        self.saver.poll()
+        self.file_system.sync_journal()
+
+    def on_save_progress(self, written, total):
+        self.statusBar().showMessage(f"正在保存 {written * 100 // max(total, 1)}%")
+
+    def on_save_finished(self, lsn, latency, error):
+        if error is None:
+            self.statusBar().showMessage(f"已自动保存（{latency * 1000:.0f} ms）", 5000)
+        else:
+            self.statusBar().showMessage(f"自动保存失败：{error}")
+
+    def defragment(self):
+        """开始分步整理碎片，已在整理时不做任何事"""
+        if not self.defrag_timer.isActive():
+            self.defrag_timer.start(DEFRAG_POLL_MS)
+
+    def defragment_step(self):
+        defragmenter = self.file_system.defragmenter
+        if not self.file_system.defragment(DEFRAG_STEP_SECONDS):
+            self.statusBar().showMessage(f"正在整理碎片：已检查 {defragmenter.checked_files} 个文件")
+            return
+        self.defrag_timer.stop()
+        stats = self.file_system.fragmentation_stats()
+        self.statusBar().showMessage(f"碎片整理完成：移动了 {defragmenter.moved_files} 个文件，"
+                                     f"平均每个文件 {stats['extents_per_file']:.2f} 段，"
+                                     f"最大空闲区段 {stats['largest_free_extent']} 块", 5000)
+
+    def on_file_system_changed(self, changes):
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            QTimer.singleShot(0, self.refresh_views)
+
+    def refresh_views(self):
+        self.refresh_pending = False
+        self.path_edit.setText(self.file_system.get_current_path())
+        self.update_tree_view()
+        if self.file_model.directory is not self.file_system.current_directory:
+            self.update_file_view()  # 当前目录被删除或文件系统被格式化
+
     def closeEvent(self, event):
-        """在关闭窗口时保存文件系统"""
-        self.file_system.save_to_disk(self.file_system_path)
+        """在关闭窗口时等待后台保存完成，再写检查点并关闭日志"""
+        self.autosave_timer.stop()
+        self.saver.close()
+        self.file_system.checkpoint()
+        self.file_system.journal.close()
         print("文件系统已保存")
         event.accept()
     
@@ -191,133 +296,110 @@ class FileManagementSystem(QMainWindow):
         else:
             super().keyPressEvent(event)
     
+    def search(self):
+        text = self.search_edit.text().strip()
+        if not text:
+            return
+        start = time.perf_counter()
+        if self.content_check.isChecked():
+            results = self.file_system.find(content=text, limit=SEARCH_LIMIT)
+        else:
+            results = self.file_system.find(text, limit=SEARCH_LIMIT)
+        elapsed = time.perf_counter() - start
+        self.statusBar().showMessage(f"找到 {len(results)} 项（{elapsed * 1000:.0f} ms）", 5000)
+        self.show_search_results(text, results)
+
+    def show_search_results(self, text, results):
+        """列出搜索结果，双击打开目录或定位到文件所在的目录"""
+        results_dialog = QDialog(self)
+        results_dialog.setWindowTitle(f"Search: {text}")
+        results_dialog.resize(600, 400)
+        layout = QVBoxLayout(results_dialog)
+        results_list = QListWidget()
+        dir_icon, file_icon = QIcon(dir_path), QIcon(file_path)
+        for node in results:
+            item = QListWidgetItem(dir_icon if isinstance(node, Directory) else file_icon, node.location)
+            item.setData(Qt.UserRole, node)
+            results_list.addItem(item)
+        if len(results) >= SEARCH_LIMIT:
+            layout.addWidget(QLabel(f"Showing the first {SEARCH_LIMIT} results."))
+        results_list.itemDoubleClicked.connect(
+            lambda item: (self.reveal(item.data(Qt.UserRole)), results_dialog.accept()))
+        layout.addWidget(results_list)
+        results_dialog.exec_()
+
+    def reveal(self, node):
+        """打开目录；对于文件，打开其所在的目录并选中该文件"""
+        directory = node if isinstance(node, Directory) else node.parent
+        try:
+            self.file_system.change_directory(directory.location)
+        except FileSystemError as e:  # 搜索结果可能已被删除或移动
+            QMessageBox.warning(self, 'Error', str(e))
+            return
+        self.path_edit.setText(self.file_system.get_current_path())
+        self.update_file_view()
+        self.update_tree_view()
+        self.history.append(self.file_system.get_current_path())
+        self.history_index += 1
+        if isinstance(node, Inode):
+            index = self.file_model.index_of(node)
+            if index.isValid():
+                self.file_view.selectionModel().select(index, QItemSelectionModel.ClearAndSelect)
+                self.file_view.setCurrentIndex(index)
+                self.file_view.scrollTo(index)
+
     def update_tree_view(self):
-        expanded_items = self.get_expanded_items(self.tree_view.invisibleRootItem())
-        self.tree_view.clear()
-        self.add_tree_items(self.tree_view.invisibleRootItem(), self.file_system.root)
-        self.set_expanded_items(self.tree_view.invisibleRootItem(), expanded_items)
-        self.expand_current_directory()
-    
-    def add_tree_items(self, parent_item, directory):
-        is_current_path = (self.file_system.current_directory == directory)
-        dir_name = f"📂 {directory.name}" if is_current_path else f"📁 {directory.name}"
-        dir_item = QTreeWidgetItem(parent_item, [dir_name])
-        dir_item.setData(0, Qt.UserRole, directory)
-        
-        if is_current_path:
-            dir_item.setExpanded(True)  # 展开当前目录
-        
-        for subdir in directory.subdirectories.values():
-            self.add_tree_items(dir_item, subdir)
-        '''
-        for file in directory.files.values():
-            file_name = f"📁 {file.name}"
-            file_item = QTreeWidgetItem(dir_item, [file_name])
-            file_item.setData(0, Qt.UserRole, file)
-        '''
-    
-    def expand_current_directory(self):
-        root = self.tree_view.invisibleRootItem()
-        self.expand_directory(root)
-
-    def expand_directory(self, parent_item):
-        for i in range(parent_item.childCount()):
-            child = parent_item.child(i)
-            directory = child.data(0, Qt.UserRole)
-            if isinstance(directory, Directory) and self.file_system.current_directory == directory:
-                child.setExpanded(True)  # 展开当前目录
-                self.expand_directory(child)  # 递归展开子目录
-
-    def get_expanded_items(self, item):
-        expanded = []
-        for i in range(item.childCount()):
-            child = item.child(i)
-            if child.isExpanded():
-                expanded.append(child.data(0, Qt.UserRole).name)
-                expanded.extend(self.get_expanded_items(child))
-        return expanded
-
-    def set_expanded_items(self, item, expanded):
-        for i in range(item.childCount()):
-            child = item.child(i)
-            if child.data(0, Qt.UserRole).name in expanded:
-                child.setExpanded(True)
-                self.set_expanded_items(child, expanded)
+        """标记当前目录并展开到当前目录，树的结构由模型增量维护"""
+        self.tree_model.set_current_directory(self.file_system.current_directory)
+        index = self.tree_model.index_for(self.file_system.current_directory)
+        if index.isValid():
+            parent = index
+            while parent.isValid():
+                self.tree_view.expand(parent)
+                parent = parent.parent()
+            self.tree_view.setCurrentIndex(index)
     
     def update_file_view(self):
-        # 清空网格布局
-        for i in reversed(range(self.file_view.layout().count())):
-            widget_to_remove = self.file_view.layout().itemAt(i).widget()
-            if widget_to_remove is not None:
-                self.file_view.layout().removeWidget(widget_to_remove)
-                widget_to_remove.setParent(None)
-        
-        # 设置网格布局的行和列
-        rows = 4
-        cols = 4
-        
-        # 初始化行列位置
-        row = 0
-        col = 0
-        
-        items = list(self.file_system.current_directory.files.values()) + list(self.file_system.current_directory.subdirectories.values())
-        
-        for item in items:
-            if col >= cols:
-                col = 0
-                row += 1
-            self.add_file_view_item(item, row, col, is_dir=isinstance(item, Directory))
-            col += 1
-        
-        # 填充空白区域
-        for r in range(rows):
-            for c in range(cols):
-                if self.file_view.layout().itemAtPosition(r, c) is None:
-                    spacer = QLabel()
-                    spacer.setFixedSize(100, 100)
-                    self.file_view.layout().addWidget(spacer, r, c)
-
-    def add_file_view_item(self, inode, row, col, is_dir=False):
-        icon = QLabel()
-        pixmap = QPixmap("dir.png" if is_dir else "file.png")
-        icon.setPixmap(pixmap.scaled(64, 64, Qt.KeepAspectRatio, Qt.SmoothTransformation))
-        icon.setAlignment(Qt.AlignCenter)
-        
-        name = QLabel(inode.name)
-        name.setAlignment(Qt.AlignCenter)
-        name.setFont(QFont("SimSun", 8))
-
-        container = QVBoxLayout()
-        container.addWidget(icon)
-        container.addWidget(name)
-        
-        frame = QFrame()
-        frame.setLayout(container)
-        frame.setFixedSize(100, 100)  # 固定每个格子的大小
-        frame.setFrameShape(QFrame.NoFrame)  # 移除外框
-        frame.setContextMenuPolicy(Qt.CustomContextMenu)
-        frame.mousePressEvent = lambda event: self.select_frame(frame, event)
-        frame.mouseDoubleClickEvent = lambda event: self.double_click_frame(frame)
-
-        self.file_view.layout().addWidget(frame, row, col)
-
-        # 将 inode 存储在 frame 的 UserRole 中，便于后续操作
-        frame.setProperty('inode', inode)
-
-    def select_frame(self, frame, event):
-        if event.button() == Qt.LeftButton:
-            if self.selected_frame:
-                self.selected_frame.setStyleSheet("")
-            self.selected_frame = frame
-            frame.setStyleSheet("background-color: lightblue;")
-        elif event.button() == Qt.RightButton:
-            self.selected_frame = frame
-            self.selected_frame.setStyleSheet("background-color: lightblue;")
-            self.show_context_menu(event.globalPos())
+        """显示当前目录的内容，刷新前选中的项在刷新后仍保持选中"""
+        selected = self.selected_items()
+        self.file_model.set_directory(self.file_system.current_directory)
+        selection = QItemSelection()
+        for node in selected:
+            index = self.file_model.index_of(node)
+            if index.isValid():
+                selection.select(index, index)
+        self.file_view.selectionModel().select(selection, QItemSelectionModel.Select)
+
+    def selected_items(self):
+        """按显示顺序返回选中的文件和目录"""
+        if self.file_view.selectionModel() is None:
+            return []
+        rows = sorted(index.row() for index in self.file_view.selectionModel().selectedIndexes())
+        return [self.file_model.entries[row] for row in rows]
+
+    def selected_item(self):
+        """单项操作（打开、重命名、属性）的对象：当前项被选中时为当前项，否则为第一个选中的项"""
+        index = self.file_view.currentIndex()
+        if index.isValid() and self.file_view.selectionModel().isSelected(index):
+            return self.file_model.node(index)
+        selected = self.selected_items()
+        return selected[0] if selected else None
+
+    def sort_file_view(self, sort_key):
+        """按指定方式排序，再次选择同一方式时切换升降序"""
+        order = Qt.AscendingOrder
+        if sort_key == self.file_model.sort_key and self.file_model.sort_order == Qt.AscendingOrder:
+            order = Qt.DescendingOrder
+        self.file_model.set_sort_key(sort_key, order)
 
     def change_directory(self):
         path = self.path_edit.text()
-        self.file_system.change_directory(path)
+        try:
+            self.file_system.change_directory(path)
+        except FileSystemError as e:
+            QMessageBox.warning(self, 'Error', str(e))
+            self.path_edit.setText(self.file_system.get_current_path())
+            return
         self.path_edit.setText(self.file_system.get_current_path())
         self.update_file_view()
         self.update_tree_view()  # 更新树视图
@@ -325,7 +407,11 @@ class FileManagementSystem(QMainWindow):
         self.history_index += 1
     
     def go_up_directory(self):
-        self.file_system.change_directory('..')
+        try:
+            self.file_system.change_directory('..')
+        except FileSystemError as e:  # 当前目录已被其它操作删除
+            QMessageBox.warning(self, 'Error', str(e))
+            return
         self.path_edit.setText(self.file_system.get_current_path())
         self.update_file_view()
         self.update_tree_view()  # 更新树视图
@@ -335,7 +421,11 @@ class FileManagementSystem(QMainWindow):
     def go_down_directory(self):
         if self.history_index < len(self.history) - 1:
             self.history_index += 1
-            self.file_system.change_directory(self.history[self.history_index])
+            try:
+                self.file_system.change_directory(self.history[self.history_index])
+            except FileSystemError as e:  # 历史记录中的目录可能已被删除或重命名
+                QMessageBox.warning(self, 'Error', str(e))
+                return
             self.path_edit.setText(self.file_system.get_current_path())
             self.update_file_view()
             self.update_tree_view()
@@ -346,9 +436,10 @@ class FileManagementSystem(QMainWindow):
             if file_name in self.file_system.current_directory.files:
                 QMessageBox.warning(self, 'Error', 'A file with the same name already exists.')
                 return
-            self.file_system.allocate_file(file_name, b'')
-            self.update_file_view()
-            self.update_tree_view()  # 更新树视图
+            try:
+                self.file_system.allocate_file(file_name, b'')
+            except FileSystemError as e:
+                QMessageBox.warning(self, 'Error', str(e))
     
     def add_folder(self):
         folder_name, ok = QInputDialog.getText(self, 'Add Folder', 'Enter folder name:')
@@ -356,51 +447,75 @@ class FileManagementSystem(QMainWindow):
             if folder_name in self.file_system.current_directory.subdirectories:
                 QMessageBox.warning(self, 'Error', 'A folder with the same name already exists.')
                 return
-            self.file_system.create_directory(folder_name)
-            self.update_tree_view()
-            self.update_file_view()
+            try:
+                self.file_system.create_directory(folder_name)
+            except FileSystemError as e:
+                QMessageBox.warning(self, 'Error', str(e))
     
     def delete_item(self):
-        if self.selected_frame:
-            inode = self.selected_frame.property('inode')
-            if isinstance(inode, Inode):
-                self.file_system.delete_file(inode.name)
-            elif isinstance(inode, Directory):
-                self.file_system.delete_directory(inode.name)
-            self.update_tree_view()
-            self.update_file_view()
+        items = self.selected_items()
+        if items:
+            try:
+                with self.file_system.batch():  # 多选删除作为一个整体，任一项失败时全部保留
+                    for inode in items:
+                        if isinstance(inode, Inode):
+                            self.file_system.delete_file(inode.location)
+                        elif isinstance(inode, Directory):
+                            self.file_system.delete_directory(inode.location)
+            except FileSystemError as e:
+                QMessageBox.warning(self, 'Error', str(e))
+
+    def compress_items(self, method):
+        """以 method 重新压缩选中的文件（None 表示改为保存原始内容），选中的目录被跳过"""
+        files = [inode for inode in self.selected_items() if isinstance(inode, Inode)]
+        if not files:
+            return
+        try:
+            with self.file_system.batch():
+                for inode in files:
+                    self.file_system.set_file_compression(inode.location, method)
+        except FileSystemError as e:
+            QMessageBox.warning(self, 'Error', str(e))
+            return
+        self.statusBar().showMessage(f"已将 {len(files)} 个文件的压缩方式改为 {method or '不压缩'}")
+
+    def set_volume_compression(self, method):
+        """设置此后新写入文件默认的压缩算法，已有文件保持原样"""
+        self.file_system.set_compression(method)
+        self.statusBar().showMessage(f"新写入的文件将{'以 ' + method + ' 压缩' if method else '不再压缩'}")
 
     def format_system(self):
         if self.file_system:
             self.file_system.format()
-        self.update_tree_view()
-        self.update_file_view()    
 
     def rename_item(self):
-        if self.selected_frame:
-            inode = self.selected_frame.property('inode')
+        inode = self.selected_item()
+        if inode is not None:
             new_name, ok = QInputDialog.getText(self, 'Rename', 'Enter new name:')
             if ok and new_name:
-                if isinstance(inode, Inode):
-                    self.file_system.current_directory.files[new_name] = self.file_system.current_directory.files.pop(inode.name)
-                    inode.name = new_name
-                elif isinstance(inode, Directory):
-                    self.file_system.current_directory.subdirectories[new_name] = self.file_system.current_directory.subdirectories.pop(inode.name)
-                    inode.name = new_name
-                self.update_tree_view()
-                self.update_file_view()
-
-    def tree_item_double_clicked(self, item, column):
-        inode = item.data(0, Qt.UserRole)
+                try:
+                    if isinstance(inode, Inode):
+                        self.file_system.rename_file(inode.name, new_name)
+                    elif isinstance(inode, Directory):
+                        self.file_system.rename_directory(inode.name, new_name)
+                except FileSystemError as e:
+                    QMessageBox.warning(self, 'Error', str(e))
+
+    def tree_item_double_clicked(self, index):
+        inode = self.tree_model.directory(index)
         if isinstance(inode, Directory):
-            self.file_system.change_directory(inode.location)
+            try:
+                self.file_system.change_directory(inode.location)
+            except FileSystemError as e:
+                QMessageBox.warning(self, 'Error', str(e))
+                return
             self.path_edit.setText(self.file_system.get_current_path())
             self.update_file_view()
             self.update_tree_view()
     
     def show_context_menu(self, pos):
         context_menu = QMenu(self)
-        if self.selected_frame and self.selected_frame.property('inode') is not None:
+        if self.selected_items():
             open_action = QAction('Open', self)
             open_action.triggered.connect(self.open_item)
             context_menu.addAction(open_action)
@@ -417,6 +532,12 @@ class FileManagementSystem(QMainWindow):
             delete_action.triggered.connect(self.delete_item)
             context_menu.addAction(delete_action)
             
+            compress_menu = context_menu.addMenu('Compression')
+            for label, method in (('None', None), ('zlib', 'zlib'), ('lzma', 'lzma')):
+                compress_action = QAction(label, self)
+                compress_action.triggered.connect(lambda checked, method=method: self.compress_items(method))
+                compress_menu.addAction(compress_action)
+
             properties_action = QAction('Settings', self)
             properties_action.triggered.connect(self.show_properties)
             context_menu.addAction(properties_action)
@@ -436,60 +557,97 @@ class FileManagementSystem(QMainWindow):
             back_action = QAction('Go Back', self)
             back_action.triggered.connect(self.go_up_directory)
             context_menu.addAction(back_action)
+
+            sort_menu = context_menu.addMenu('Sort By')
+            for label, sort_key in (('Name', 'name'), ('Size', 'size'), ('Date Modified', 'modified'), ('Type', 'type')):
+                sort_action = QAction(label, self)
+                sort_action.setCheckable(True)
+                sort_action.setChecked(sort_key == self.file_model.sort_key)
+                sort_action.triggered.connect(lambda checked, sort_key=sort_key: self.sort_file_view(sort_key))
+                sort_menu.addAction(sort_action)
+
+            volume_menu = context_menu.addMenu('Volume Compression')
+            for label, method in (('None', None), ('zlib', 'zlib'), ('lzma', 'lzma')):
+                volume_action = QAction(label, self)
+                volume_action.setCheckable(True)
+                volume_action.setChecked(method == self.file_system.compression)
+                volume_action.triggered.connect(lambda checked, method=method: self.set_volume_compression(method))
+                volume_menu.addAction(volume_action)
         
         context_menu.exec_(pos)
     
     def show_tree_context_menu(self, pos):
-        item = self.tree_view.itemAt(pos)
-        if item:
+        index = self.tree_view.indexAt(pos)
+        if index.isValid():
             context_menu = QMenu(self)
             
             unfold_action = QAction('Unfold Directory', self)
-            unfold_action.triggered.connect(lambda: self.unfold_item(item))
+            unfold_action.triggered.connect(lambda: self.unfold_item(index))
             context_menu.addAction(unfold_action)
 
             fold_action = QAction('Fold Directory', self)
-            fold_action.triggered.connect(lambda: self.fold_item(item))
+            fold_action.triggered.connect(lambda: self.fold_item(index))
             context_menu.addAction(fold_action)
             
             context_menu.exec_(self.tree_view.mapToGlobal(pos))
     
-    def unfold_item(self, item):
-        item.setExpanded(True)
-        self.expand_all_children(item)
+    def unfold_item(self, index):
+        self.tree_view.expand(index)
+        self.expand_all_children(index)
     
-    def expand_all_children(self, item):
-        for i in range(item.childCount()):
-            child = item.child(i)
-            child.setExpanded(True)
+    def expand_all_children(self, index):
+        if self.tree_model.canFetchMore(index):
+            self.tree_model.fetchMore(index)
+        for row in range(self.tree_model.rowCount(index)):
+            child = self.tree_model.index(row, 0, index)
+            self.tree_view.expand(child)
             self.expand_all_children(child)
 
-    def fold_item(self, item):
-        item.setExpanded(False)
-        self.collapse_all_children(item)
+    def fold_item(self, index):
+        self.tree_view.collapse(index)
+        self.collapse_all_children(index)
     
-    def collapse_all_children(self, item):
-        for i in range(item.childCount()):
-            child = item.child(i)
-            child.setExpanded(False)
+    def collapse_all_children(self, index):
+        # 只需处理已读取的子目录，未读取的子目录不可能处于展开状态
+        for row in range(self.tree_model.rowCount(index)):
+            child = self.tree_model.index(row, 0, index)
+            self.tree_view.collapse(child)
             self.collapse_all_children(child)
 
-    def double_click_frame(self, frame):
-        inode = frame.property('inode')
+    def file_item_double_clicked(self, index):
+        inode = self.file_model.node(index)
         if isinstance(inode, Directory):
-            self.file_system.change_directory(inode.location)
+            try:
+                self.file_system.change_directory(inode.location)
+            except FileSystemError as e:
+                QMessageBox.warning(self, 'Error', str(e))
+                return
             self.path_edit.setText(self.file_system.get_current_path())
             self.update_file_view()
             self.update_tree_view()
         elif isinstance(inode, Inode):
-            file_data = self.file_system.read_file(inode.name)
-            if file_data is not None:
-                try:
-                    content = file_data.decode('utf-8')
-                except UnicodeDecodeError:
-                    content = file_data.decode('latin1')  # 尝试使用另一种编码进行解码
+            content = self.read_file_text(inode.name)
+            if content is not None:
                 self.show_file_editor(inode.name, content)
     
+    def read_file_text(self, file_name):
+        """按块流式读取文件并增量解码为文本"""
+        try:
+            handle = self.file_system.open(file_name)
+        except FileSystemError as e:
+            QMessageBox.warning(self, 'Error', str(e))
+            return None
+        with handle:
+            for encoding in ('utf-8', 'latin1'):  # utf-8 解码失败时尝试使用另一种编码
+                handle.seek(0)
+                decoder = codecs.getincrementaldecoder(encoding)()
+                try:
+                    parts = [decoder.decode(view) for view in handle.iter_blocks()]
+                    parts.append(decoder.decode(b'', final=True))
+                    return ''.join(parts)
+                except UnicodeDecodeError:
+                    continue
+
     def show_file_editor(self, file_name, file_content):
         content_dialog = QDialog(self)
         content_dialog.setWindowTitle(file_name)
@@ -508,54 +666,56 @@ class FileManagementSystem(QMainWindow):
         content_dialog.exec_()
 
     def save_file_content(self, file_name, file_content, dialog):
-        self.file_system.write_file(file_name, file_content.encode('utf-8'))
+        try:
+            self.file_system.write_file(file_name, file_content.encode('utf-8'))
+        except FileSystemError as e:  # 只读文件或空间不足时保留编辑框，内容不会丢失
+            QMessageBox.warning(self, 'Error', str(e))
+            return
         dialog.accept()
 
     def open_item(self):
-        if self.selected_frame:
-            inode = self.selected_frame.property('inode')
+        inode = self.selected_item()
+        if inode is not None:
             if isinstance(inode, Directory):
-                self.file_system.change_directory(inode.location)
+                try:
+                    self.file_system.change_directory(inode.location)
+                except FileSystemError as e:
+                    QMessageBox.warning(self, 'Error', str(e))
+                    return
                 self.path_edit.setText(self.file_system.get_current_path())
                 self.update_file_view()
                 self.update_tree_view()  # 更新树视图
             elif isinstance(inode, Inode):
-                file_data = self.file_system.read_file(inode.name)
-                if file_data is not None:
-                    try:
-                        content = file_data.decode('utf-8')
-                    except UnicodeDecodeError:
-                        content = file_data.decode('latin1')  # 尝试使用另一种编码进行解码
+                content = self.read_file_text(inode.name)
+                if content is not None:
                     self.show_file_editor(inode.name, content)
     
     def copy_item(self):
-        if self.selected_frame:
-            inode = self.selected_frame.property('inode')
-            self.copy_file = inode
+        items = self.selected_items()
+        if items:
+            self.copied_items = items
 
     def paste_item(self):
-        if hasattr(self, 'copy_file'):
-            copy_inode = self.copy_file
-            copy_file_path = copy_inode.location
-            if isinstance(copy_inode, Inode):
-                self.file_system.copy_file(copy_file_path, self.file_system.current_directory.location)
-            elif isinstance(copy_inode, Directory):
-                # 检查目标目录是否为源目录的子目录
-                current_path = self.file_system.get_current_path()
-                if current_path.startswith(copy_inode.location):
-                    QMessageBox.warning(self, 'Error', 'Cannot copy a directory into its own subdirectory.')
-                    return
-                self.file_system.copy_directory(copy_inode, self.file_system.current_directory)
-            self.update_file_view()
-            self.update_tree_view()
+        if not hasattr(self, 'copied_items'):
+            return
+        current_path = self.file_system.get_current_path()
+        try:
+            with self.file_system.batch():  # 多项粘贴只刷新一次视图，任一项失败时全部回滚
+                for copy_inode in self.copied_items:
+                    if isinstance(copy_inode, Inode):
+                        self.file_system.copy_file(copy_inode.location, current_path)
+                    elif isinstance(copy_inode, Directory):
+                        self.file_system.copy_directory(copy_inode.location, current_path)
+        except FileSystemError as e:  # 被复制的文件可能已被删除，或目标是源目录的子目录
+            QMessageBox.warning(self, 'Error', str(e))
 
     def move_item(self):
         # Implement move functionality
         pass
     
     def show_properties(self):
-        if self.selected_frame:
-            inode = self.selected_frame.property('inode')
+        inode = self.selected_item()
+        if inode is not None:
             self.show_inode_properties(inode)
     
     def show_inode_properties(self, inode):
@@ -570,8 +730,21 @@ class FileManagementSystem(QMainWindow):
         name_label.setFont(font_chinese)
         location_label = QLabel(inode.location)
         location_label.setFont(font_chinese)
-        size_label = QLabel(str(inode.size)+"B" if hasattr(inode, 'size') else 'N/A')
+        # 目录的大小、文件数和块数取自随每次修改更新的汇总值，不需要遍历子树
+        size_label = QLabel(str(inode.total_size if isinstance(inode, Directory) else inode.size)+"B")
         size_label.setFont(font_english)
+        if isinstance(inode, Directory):
+            contents_label = QLabel(f"{inode.file_count} files, {inode.directory_count} folders")
+            contents_label.setFont(font_english)
+            blocks_label = QLabel(f"{inode.block_count} ({inode.block_count * self.file_system.block_size}B)")
+            blocks_label.setFont(font_english)
+        # 内容字节数与实际占用字节数之比，文件同时显示压缩算法
+        compression = self.file_system.compression_stats(inode.location)
+        compression_text = f"{compression['ratio']:.2f}x ({compression['physical_bytes']}B stored)"
+        if not isinstance(inode, Directory):
+            compression_text = f"{compression['method'] or 'None'}, {compression_text}"
+        compression_label = QLabel(compression_text)
+        compression_label.setFont(font_english)
         init_time_label = QLabel(inode.init_time.strftime('%Y-%m-%d %H:%M:%S'))
         init_time_label.setFont(font_english)
         if hasattr(inode, 'revise_time'):
@@ -602,6 +775,16 @@ class FileManagementSystem(QMainWindow):
         layout.addRow(name_text_label, name_label)
         layout.addRow(location_text_label, location_label)
         layout.addRow(size_text_label, size_label)
+        if isinstance(inode, Directory):
+            contents_text_label = QLabel('Contents:')
+            contents_text_label.setFont(font_english)
+            layout.addRow(contents_text_label, contents_label)
+            blocks_text_label = QLabel('Blocks:')
+            blocks_text_label.setFont(font_english)
+            layout.addRow(blocks_text_label, blocks_label)
+        compression_text_label = QLabel('Compression:')
+        compression_text_label.setFont(font_english)
+        layout.addRow(compression_text_label, compression_label)
         layout.addRow(init_time_text_label, init_time_label)
         if hasattr(inode, 'revise_time'):
             layout.addRow(revise_time_text_label, revise_time_label)
@@ -614,6 +797,7 @@ class FileManagementSystem(QMainWindow):
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=LOG_LEVEL, format="%(message)s")
     app = QApplication(sys.argv)
     ex = FileManagementSystem()
     sys.exit(app.exec_())
@@ -0,0 +1,104 @@
+import threading
+from functools import wraps
+from time import perf_counter_ns
+
+_BUCKETS = 64  # 第 i 个桶记录耗时在 [2^(i-1), 2^i) 纳秒之间的操作
+
+
+class OpStats:
+    """单种操作的调用次数、失败次数和耗时直方图"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.histogram = [0] * _BUCKETS
+
+    def percentile(self, fraction):
+        """由直方图估算分位数（纳秒），返回所在桶的上界"""
+        target = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= target:
+                return min(1 << i, self.max_ns)
+        return self.max_ns
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "total_seconds": self.total_ns / 1e9,
+            "mean_us": self.total_ns / self.count / 1000 if self.count else 0.0,
+            "p50_us": self.percentile(0.50) / 1000,
+            "p90_us": self.percentile(0.90) / 1000,
+            "p99_us": self.percentile(0.99) / 1000,
+            "max_us": self.max_ns / 1000,
+            # [(桶上界微秒, 次数), ...]，只列出非空的桶
+            "histogram": [((1 << i) / 1000, count) for i, count in enumerate(self.histogram) if count],
+        }
+
+
+class Metrics:
+    """文件系统的运行统计：每种操作的次数和耗时分布，以及读写的字节数
+
+    记录一次操作只需常数次加法；hooks 中的回调在每次操作结束后以 (操作名, 耗时秒数, 异常或 None) 调用，
+    可用于接入外部的监控系统。多个线程同时操作文件系统时，统计的更新由 _lock 保护。
+    """
+
+    def __init__(self):
+        self.hooks = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.ops = {}  # 操作名 -> OpStats
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def record(self, op, elapsed_ns, error=None):
+        with self._lock:
+            stats = self.ops.get(op)
+            if stats is None:
+                stats = self.ops[op] = OpStats()
+            stats.count += 1
+            if error is not None:
+                stats.errors += 1
+            stats.total_ns += elapsed_ns
+            if elapsed_ns > stats.max_ns:
+                stats.max_ns = elapsed_ns
+            stats.histogram[elapsed_ns.bit_length()] += 1  # 2^63 纳秒约为292年，不会越界
+        if self.hooks:
+            for hook in self.hooks:
+                hook(op, elapsed_ns / 1e9, error)
+
+    def count_read(self, nbytes):
+        """累加读取的字节数；读取在文件系统的全局锁之外进行，须经由此方法更新"""
+        with self._lock:
+            self.bytes_read += nbytes
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "ops": {op: stats.snapshot() for op, stats in sorted(self.ops.items())},
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+            }
+
+
+def instrumented(op):
+    """为文件系统的方法计时，结果记入 self.metrics；抛出异常的调用计为失败"""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                result = func(self, *args, **kwargs)
+            except BaseException as e:
+                self.metrics.record(op, perf_counter_ns() - start, e)
+                raise
+            self.metrics.record(op, perf_counter_ns() - start)
+            return result
+        return wrapper
+    return decorate
@@ -0,0 +1,251 @@
+import re
+from fnmatch import translate
+from bisect import bisect_left, insort
+
+from eventBus import CREATED, DELETED, RENAMED, MOVED, WRITTEN, FORMATTED
+
+GRAM = 3  # 名称索引的 n-gram 长度，更短的查询退化为扫描全部不同的名称
+CONTENT_LIMIT = 1024 * 1024  # 每个文件只索引开头这么多字节的内容
+
+_WILDCARDS = re.compile(r"\[[^\]]*\]|[*?]")
+_TOKEN = re.compile(r"\w+")
+_EMPTY = frozenset()
+
+
+def _location(node):
+    return node.location
+
+
+def _grams(text):
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+def tokenize(data):
+    """文本或字节串中的词（小写），字节串按 UTF-8 解码，无法解码的字节被忽略"""
+    if not isinstance(data, str):
+        data = bytes(data).decode("utf-8", errors="ignore")
+    return _TOKEN.findall(data.casefold())
+
+
+class SearchIndex:
+    """全卷的名称索引和可选的内容倒排索引
+
+    名称索引将每个不同的名称（不区分大小写）拆成三字母组，查询时先求各组对应名称集合的交集，再逐个核对；
+    内容索引记录每个词出现在哪些文件中。索引在首次查询时遍历整个卷建立，之后订阅文件系统的变更事件增量维护，
+    批量操作的修改在提交时一并反映，回滚的修改不影响索引。索引按节点而不是路径记录，目录重命名或移动时
+    不需要更新其子树；同时保存一份子节点关系，目录被删除时据此移除整棵子树。
+    """
+
+    def __init__(self, file_system, index_content=False):
+        self.file_system = file_system
+        self.index_content = index_content  # 是否同时维护内容索引，首次按内容查询时自动开启
+        self.subscription = None  # 索引建立后才订阅变更事件
+        self._clear()
+
+    def _clear(self):
+        self._entries = {}  # id(节点) -> [节点, 小写名称, id(父目录)]
+        self._children = {}  # id(目录) -> {id(子节点)}
+        self._names = {}  # 小写名称 -> {id(节点): 节点}
+        self._grams = {}  # 三字母组 -> {小写名称}
+        self._sorted = []  # 全部不同的小写名称，有序；建立索引期间为 None，建立完成后一次排序
+        self._postings = {}  # 词 -> {id(文件)}
+        self._tokens = {}  # id(文件) -> 文件内容中的词
+
+    def __len__(self):
+        return len(self._entries)
+
+    def build(self):
+        """遍历整个卷建立索引并开始订阅变更事件；已建立时不做任何事"""
+        if self.subscription is not None:
+            return
+        self._clear()
+        self._sorted = None
+        root = self.file_system.root
+        for child in list(root.subdirectories.values()) + list(root.files.values()):
+            self._add(child, id(root))
+        self._sorted = sorted(self._names)
+        self.subscription = self.file_system.watch(self.on_events)
+
+    def reset(self):
+        """丢弃索引并取消订阅，下次查询时重新建立"""
+        if self.subscription is not None:
+            self.file_system.unwatch(self.subscription)
+            self.subscription = None
+        self._clear()
+
+    def enable_content(self):
+        """开启内容索引，已建立的索引中的文件立即补充索引"""
+        if self.index_content:
+            return
+        self.index_content = True
+        for node, _, _ in list(self._entries.values()):
+            if not hasattr(node, 'subdirectories'):
+                self._index_content(node)
+
+    # 查询
+
+    def find(self, pattern="", content=None, limit=None):
+        """按名称和内容查找，返回按名称排序的节点列表，同名的按路径排序
+
+        pattern 不含通配符时匹配名称中包含 pattern 的项，含 *、?、[...] 时按通配符匹配整个名称，均不区分大小写；
+        content 不为 None 时只返回内容中包含其全部词的文件。limit 限制返回的个数。
+        """
+        self.build()
+        files = None
+        if content is not None:
+            self.enable_content()
+            files = self._content_matches(content)
+        results = []
+        for name in self._sorted_names(pattern.casefold(), files, limit):
+            nodes = self._names[name].values()
+            if files is not None:
+                nodes = [node for node in nodes if id(node) in files]
+            results.extend(sorted(nodes, key=_location))
+            if limit is not None and len(results) >= limit:
+                return results[:limit]
+        return results
+
+    def _sorted_names(self, folded, files, limit):
+        """按顺序产生可能匹配的名称：候选较少时排序候选，较多且有 limit 时顺序扫描全部名称，取够即可停止"""
+        candidates, match = self._candidates(folded)
+        if files is not None and len(files) * 4 < (len(self._names) if candidates is None else len(candidates)):
+            # 按内容筛选出的文件较少时，由文件反查名称
+            names = {self._entries[node_id][1] for node_id in files}
+            candidates = names if candidates is None else names & candidates
+        if limit is not None and (candidates is None or len(candidates) * 8 > len(self._sorted)):
+            names = self._sorted if candidates is None else filter(candidates.__contains__, self._sorted)
+            yield from names if match is None else filter(match, names)
+            return
+        if candidates is None:
+            candidates = self._names.keys()
+        yield from sorted(candidates if match is None else filter(match, candidates))
+
+    def _candidates(self, folded):
+        """由三字母组求出的候选名称集合（None 表示全部名称）和逐个核对的函数（None 表示不需要核对）"""
+        if not folded:
+            return None, None
+        glob = _WILDCARDS.search(folded) is not None
+        literals = [part for part in _WILDCARDS.split(folded) if part] if glob else [folded]
+        match = re.compile(translate(folded)).match if glob else re.compile(re.escape(folded)).search
+        grams = set().union(*(_grams(literal) for literal in literals))
+        if not grams:
+            return None, match
+        sets = sorted((self._grams.get(gram, _EMPTY) for gram in grams), key=len)
+        return sets[0].intersection(*sets[1:]), match
+
+    def _content_matches(self, content):
+        tokens = set(tokenize(content))
+        if not tokens:
+            return set(self._tokens)
+        postings = sorted((self._postings.get(token, _EMPTY) for token in tokens), key=len)
+        return postings[0].intersection(*postings[1:])
+
+    # 增量维护
+
+    def on_events(self, events):
+        for event in events:
+            kind = event.kind
+            if kind == FORMATTED:
+                self.reset()
+                return
+            node = event.node
+            if kind == CREATED:
+                self._add(node, id(event.parent))
+            elif kind == DELETED:
+                self._remove(id(node))
+            elif kind == RENAMED or kind == MOVED:
+                self._move(node)
+            elif kind == WRITTEN and self.index_content and id(node) in self._entries:
+                self._index_content(node)
+
+    def _add(self, node, parent_id):
+        """索引节点及其子树；已索引的节点重新索引"""
+        stack = [(node, parent_id)]
+        while stack:
+            node, parent_id = stack.pop()
+            node_id = id(node)
+            folded = node.name.casefold()
+            entry = self._entries.get(node_id)
+            if entry is not None:
+                self._unlink(node_id, entry[1])
+                self._children.get(entry[2], set()).discard(node_id)
+            self._entries[node_id] = [node, folded, parent_id]
+            self._children.setdefault(parent_id, set()).add(node_id)
+            self._link(node_id, node, folded)
+            if hasattr(node, 'subdirectories'):
+                stack.extend((child, node_id) for child in node.subdirectories.values())
+                stack.extend((child, node_id) for child in node.files.values())
+            elif self.index_content:
+                self._index_content(node)
+
+    def _remove(self, node_id):
+        """移除节点及其子树，子树按索引中记录的子节点关系查找（被删除的目录已被清空）"""
+        stack = [node_id]
+        while stack:
+            node_id = stack.pop()
+            entry = self._entries.pop(node_id, None)
+            if entry is None:
+                continue
+            self._unlink(node_id, entry[1])
+            self._children.get(entry[2], set()).discard(node_id)
+            stack.extend(self._children.pop(node_id, ()))
+            self._drop_content(node_id)
+
+    def _move(self, node):
+        entry = self._entries.get(id(node))
+        if entry is None:
+            self._add(node, id(node.parent))
+            return
+        node_id = id(node)
+        folded = node.name.casefold()
+        if folded != entry[1]:
+            self._unlink(node_id, entry[1])
+            self._link(node_id, node, folded)
+            entry[1] = folded
+        parent_id = id(node.parent)
+        if parent_id != entry[2]:
+            self._children.get(entry[2], set()).discard(node_id)
+            self._children.setdefault(parent_id, set()).add(node_id)
+            entry[2] = parent_id
+
+    def _link(self, node_id, node, folded):
+        nodes = self._names.get(folded)
+        if nodes is None:
+            nodes = self._names[folded] = {}
+            for gram in _grams(folded):
+                self._grams.setdefault(gram, set()).add(folded)
+            if self._sorted is not None:
+                insort(self._sorted, folded)
+        nodes[node_id] = node
+
+    def _unlink(self, node_id, folded):
+        nodes = self._names[folded]
+        del nodes[node_id]
+        if nodes:
+            return
+        del self._names[folded]
+        del self._sorted[bisect_left(self._sorted, folded)]
+        for gram in _grams(folded):
+            names = self._grams[gram]
+            names.discard(folded)
+            if not names:
+                del self._grams[gram]
+
+    def _index_content(self, inode):
+        node_id = id(inode)
+        self._drop_content(node_id)
+        data = self.file_system.read_content(inode, CONTENT_LIMIT)
+        tokens = frozenset(tokenize(data))
+        self._tokens[node_id] = tokens
+        for token in tokens:
+            self._postings.setdefault(token, set()).add(node_id)
+
+    def _drop_content(self, node_id):
+        tokens = self._tokens.pop(node_id, None)
+        if tokens is None:
+            return
+        for token in tokens:
+            files = self._postings[token]
+            files.discard(node_id)
+            if not files:
+                del self._postings[token]
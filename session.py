@@ -0,0 +1,32 @@
+from contextlib import contextmanager
+from functools import wraps
+
+
+class Session:
+    """文件系统的会话：拥有独立的当前目录，通过会话调用的操作中的相对路径都相对于该目录解析
+
+    会话原样转发文件系统的公开方法（session.read_file()、session.change_directory() 等），调用期间只在当前线程中
+    以会话的当前目录代替文件系统的当前目录，其它线程和其它会话不受影响；文件系统自身的当前目录即界面使用的默认会话。
+    一个会话同一时刻只应在一个线程中使用，多个线程各自创建会话，见 IndexedFileSystem.session()。
+    """
+
+    def __init__(self, file_system):
+        self.file_system = file_system
+        self.current_directory = file_system.root
+
+    def __getattr__(self, name):
+        attribute = getattr(self.file_system, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+
+        @wraps(attribute)
+        def call(*args, **kwargs):
+            with self.file_system._bound(self):
+                return attribute(*args, **kwargs)
+        return call
+
+    @contextmanager
+    def batch(self):
+        """会话中的批量操作，见 IndexedFileSystem.batch()；with 块中的操作都使用会话的当前目录，回滚时一并恢复"""
+        with self.file_system._bound(self), self.file_system.batch():
+            yield self
@@ -0,0 +1,51 @@
+from copy import copy
+
+
+class Transaction:
+    """批量操作的撤销信息：节点在首次修改前保存其属性，数据块在首次原地改写前保存其内容"""
+
+    def __init__(self, file_system):
+        self.current_directory = file_system.current_directory
+        self.records = []  # 提交时合并为一条日志记录
+        self.events = []  # 提交时合并后发布
+        self._nodes = {}  # id -> (节点, 修改前的属性)
+        self._blocks = {}  # 块号 -> 修改前的内容
+        self._usage = {}  # id -> (目录, 修改前的汇总值)；上级目录只有汇总值改变，不保存整个节点
+
+    def touch(self, node):
+        """在修改文件或目录之前调用"""
+        if id(node) in self._nodes:
+            return
+        if getattr(node, '_loader', None) is not None:
+            node._load_children()  # 未解码的目录先解码，回滚后不会重复加载
+        state = node.__getstate__()
+        for key in ('_files', '_subdirectories', '_blocks'):
+            if key in state:
+                state[key] = copy(state[key])
+        self._nodes[id(node)] = (node, state)
+
+    def original(self, node):
+        """节点在事务开始时的 (名称, 父目录)"""
+        saved = self._nodes.get(id(node))
+        if saved is None:
+            return node.name, node.parent
+        return saved[1]['_name'], saved[1]['_parent']
+
+    def save_usage(self, directory):
+        """在更新目录的汇总值之前调用"""
+        if id(directory) not in self._usage:
+            self._usage[id(directory)] = (directory, directory.usage)
+
+    def save_block(self, block_store, block_index):
+        """在原地改写数据块之前调用"""
+        if block_index not in self._blocks:
+            self._blocks[block_index] = bytes(block_store.read_block(block_index))
+
+    def restore(self, block_store):
+        """将所有被修改过的节点和数据块恢复到事务开始时的状态"""
+        for node, state in self._nodes.values():
+            node.__setstate__(state)
+        for directory, usage in self._usage.values():
+            directory.usage = usage
+        for block_index, data in self._blocks.items():
+            block_store.write_block(block_index, data)